@@ -8,6 +8,10 @@ import requests
 from typing import List, Dict, Any
 import json
 
+from p4_logging import get_logger, sample_debug
+
+logger = get_logger("app_deploy")
+
 
 # --- Database Operations ---
 def init_database():
@@ -50,7 +54,7 @@ def execute_sql(query: str) -> List[Dict[str, Any]]:
         return results
         
     except Exception as e:
-        print(f"Database error: {e}")
+        logger.error(f"Database error: {e}")
         return []
 
 
@@ -118,7 +122,8 @@ def text2sql(query: str) -> str:
         else:
             sql = "SELECT * FROM outlets ORDER BY name"
     
-    print(f"[DEBUG] Generated SQL: {sql}")
+    if sample_debug(logger):
+        logger.debug("Generated SQL: %s", sql)
     return sql
 
 
@@ -147,7 +152,7 @@ def ingest_outlets_from_web():
     
     conn.commit()
     conn.close()
-    print("[INFO] Sample outlets data loaded successfully")
+    logger.info("Sample outlets data loaded successfully")
 
 
 def load_products_from_csv():
@@ -163,9 +168,9 @@ def load_products_from_csv():
                     "description": row.get("description", ""),
                     "category": row.get("category", "drinkware")
                 })
-        print(f"[INFO] Loaded {len(products)} products from CSV")
+        logger.info(f"Loaded {len(products)} products from CSV")
     except FileNotFoundError:
-        print("[WARNING] CSV file not found, using sample products")
+        logger.warning("CSV file not found, using sample products")
         products = [
             {"name": "OG CUP 2.0 With Screw-On Lid 500ml", "price": "RM45.00", "description": "Durable coffee cup", "category": "drinkware"},
             {"name": "All-Can Tumbler 600ml", "price": "RM55.00", "description": "Insulated tumbler", "category": "drinkware"},
@@ -238,11 +243,11 @@ class OutletsResponse(BaseModel):
 async def lifespan(app: FastAPI):
     # Startup
     global PRODUCTS
-    print("[STARTUP] Initializing ZUS Coffee API...")
+    logger.info("Initializing ZUS Coffee API...")
     init_database()
     ingest_outlets_from_web()
     PRODUCTS = load_products_from_csv()
-    print("[STARTUP] API initialization complete!")
+    logger.info("API initialization complete!")
     yield
     # Shutdown (if needed)
 
@@ -1,15 +1,24 @@
 import os
 import csv
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Query, HTTPException
 from pydantic import BaseModel
+import numpy as np
 import requests
 
+from p4_logging import get_logger, sample_debug
+
+logger = get_logger("app_railway")
+
 # --- Global Variables ---
 PRODUCTS = []
 OUTLETS = []
+OUTLET_STORE = None
+
+# np.strings (NumPy 2) runs the substring search as a ufunc; np.char is the older equivalent
+_str_find = np.strings.find if hasattr(np, "strings") else np.char.find
 
 # --- In-Memory Data Storage ---
 def load_sample_outlets():
@@ -70,7 +79,7 @@ def load_products_from_csv():
                     "description": row.get("description", ""),
                     "category": row.get("category", "drinkware")
                 })
-        print(f"[INFO] Loaded {len(products)} products from CSV")
+        logger.info(f"Loaded {len(products)} products from CSV")
     except FileNotFoundError:
         # Fallback sample data
         products = [
@@ -93,94 +102,127 @@ def load_products_from_csv():
                 "category": "coffee"
             }
         ]
-        print(f"[INFO] Using fallback sample data: {len(products)} products")
+        logger.info(f"Using fallback sample data: {len(products)} products")
     
     return products
 
-def text2sql(text: str) -> str:
-    """Enhanced text-to-SQL conversion with Malaysian location intelligence"""
+# Location mapping with Malaysian context
+LOCATION_PATTERNS = {
+    'kuala lumpur': ['kuala lumpur', 'kl', 'klcc', 'city centre'],
+    'selangor': ['selangor', 'shah alam', 'petaling jaya', 'pj', 'subang', 'sunway'],
+    'putrajaya': ['putrajaya', 'cyberjaya'],
+    'johor': ['johor', 'jb', 'johor bahru'],
+    'penang': ['penang', 'georgetown', 'butterworth'],
+    'perak': ['perak', 'ipoh'],
+    'negeri sembilan': ['negeri sembilan', 'seremban'],
+    'melaka': ['melaka', 'malacca'],
+    'pahang': ['pahang', 'kuantan'],
+    'kelantan': ['kelantan', 'kota bharu'],
+    'terengganu': ['terengganu', 'kuala terengganu'],
+    'kedah': ['kedah', 'alor setar'],
+    'perlis': ['perlis', 'kangar'],
+    'sabah': ['sabah', 'kota kinabalu'],
+    'sarawak': ['sarawak', 'kuching']
+}
+
+# Service patterns
+SERVICE_PATTERNS = {
+    'delivery': ['delivery', 'deliver', 'send', 'order online'],
+    'dine-in': ['dine in', 'dine-in', 'sit', 'eat in', 'restaurant'],
+    'takeaway': ['takeaway', 'take away', 'pickup', 'grab and go']
+}
+
+MALL_KEYWORDS = ['mall', 'shopping', 'centre', 'center', 'plaza', 'pavilion', 'klcc', 'mid valley']
+
+class Condition(NamedTuple):
+    """One WHERE condition: column contains (case-insensitively) any of terms"""
+    column: str
+    terms: Tuple[str, ...]
+
+def parse_conditions(text: str) -> List[Condition]:
+    """The conditions text2sql puts in its WHERE clause; a row matches if any of them holds"""
     text_lower = text.lower()
-    
-    # Location mapping with Malaysian context
-    location_patterns = {
-        'kuala lumpur': ['kuala lumpur', 'kl', 'klcc', 'city centre'],
-        'selangor': ['selangor', 'shah alam', 'petaling jaya', 'pj', 'subang', 'sunway'],
-        'putrajaya': ['putrajaya', 'cyberjaya'],
-        'johor': ['johor', 'jb', 'johor bahru'],
-        'penang': ['penang', 'georgetown', 'butterworth'],
-        'perak': ['perak', 'ipoh'],
-        'negeri sembilan': ['negeri sembilan', 'seremban'],
-        'melaka': ['melaka', 'malacca'],
-        'pahang': ['pahang', 'kuantan'],
-        'kelantan': ['kelantan', 'kota bharu'],
-        'terengganu': ['terengganu', 'kuala terengganu'],
-        'kedah': ['kedah', 'alor setar'],
-        'perlis': ['perlis', 'kangar'],
-        'sabah': ['sabah', 'kota kinabalu'],
-        'sarawak': ['sarawak', 'kuching']
-    }
-    
-    # Service patterns
-    service_patterns = {
-        'delivery': ['delivery', 'deliver', 'send', 'order online'],
-        'dine-in': ['dine in', 'dine-in', 'sit', 'eat in', 'restaurant'],
-        'takeaway': ['takeaway', 'take away', 'pickup', 'grab and go']
-    }
-    
-    # Build WHERE conditions
     conditions = []
     
     # Check for location matches
-    for location, patterns in location_patterns.items():
+    for location, patterns in LOCATION_PATTERNS.items():
         if any(pattern in text_lower for pattern in patterns):
-            conditions.append(f"LOWER(location) LIKE '%{location}%'")
+            conditions.append(Condition("location", (location,)))
     
     # Check for service matches
-    for service, patterns in service_patterns.items():
+    for service, patterns in SERVICE_PATTERNS.items():
         if any(pattern in text_lower for pattern in patterns):
-            conditions.append(f"services LIKE '%{service}%'")
+            conditions.append(Condition("services", (service,)))
     
     # Check for mall/shopping center keywords
-    mall_keywords = ['mall', 'shopping', 'centre', 'center', 'plaza', 'pavilion', 'klcc', 'mid valley']
-    if any(keyword in text_lower for keyword in mall_keywords):
-        mall_conditions = []
-        for keyword in mall_keywords:
-            if keyword in text_lower:
-                mall_conditions.append(f"LOWER(address) LIKE '%{keyword}%'")
-        if mall_conditions:
-            conditions.append(f"({' OR '.join(mall_conditions)})")
+    mall_terms = tuple(keyword for keyword in MALL_KEYWORDS if keyword in text_lower)
+    if mall_terms:
+        conditions.append(Condition("address", mall_terms))
     
     # Check for specific outlet names
     if 'zus' in text_lower or 'coffee' in text_lower:
-        conditions.append("LOWER(name) LIKE '%zus%'")
+        conditions.append(Condition("name", ("zus",)))
     
-    # Build final SQL
-    if conditions:
-        where_clause = " OR ".join(conditions)
-        sql = f"SELECT * FROM outlets WHERE {where_clause} ORDER BY name"
-    else:
-        sql = "SELECT * FROM outlets ORDER BY name"
+    return conditions
+
+def conditions_to_sql(conditions: List[Condition]) -> str:
+    clauses = []
+    for condition in conditions:
+        column = condition.column if condition.column == "services" else f"LOWER({condition.column})"
+        likes = [f"{column} LIKE '%{term}%'" for term in condition.terms]
+        clauses.append(likes[0] if condition.column != "address" else f"({' OR '.join(likes)})")
     
-    print(f"[DEBUG] Generated SQL: {sql}")
-    return sql
+    if clauses:
+        return f"SELECT * FROM outlets WHERE {' OR '.join(clauses)} ORDER BY name"
+    return "SELECT * FROM outlets ORDER BY name"
 
-def execute_sql_memory(sql: str) -> List[Dict[str, Any]]:
-    """Execute SQL-like queries on in-memory data"""
-    try:
-        # Simple in-memory filtering for deployment
-        if "WHERE" in sql.upper():
-            # Extract conditions and filter
-            results = []
-            for outlet in OUTLETS:
-                # Simple text matching for demo
-                if any(term in str(outlet).lower() for term in ['kuala lumpur', 'kl', 'selangor', 'delivery', 'dine-in']):
-                    results.append(outlet)
-            return results[:10]  # Limit results
-        else:
-            return OUTLETS[:10]
-    except Exception as e:
-        print(f"[ERROR] Query execution failed: {e}")
-        return []
+def text2sql(text: str) -> str:
+    """Enhanced text-to-SQL conversion with Malaysian location intelligence"""
+    return conditions_to_sql(parse_conditions(text))
+
+class OutletStore:
+    """Columnar, in-memory copy of the outlets for evaluating text2sql conditions with NumPy
+    
+    Each text column is lowercased, UTF-8 encoded and dictionary-encoded:
+    a substring test runs once per distinct value (a handful for location
+    and services, one per outlet for name and address) and is broadcast to
+    the rows through the codes. Known services are also kept as boolean
+    flags, so service conditions are a single array lookup.
+    """
+    
+    TEXT_COLUMNS = ("name", "location", "address", "services")
+    
+    def __init__(self, outlets: List[Dict[str, Any]]):
+        self.outlets = outlets
+        self.values = {}
+        self.codes = {}
+        for column in self.TEXT_COLUMNS:
+            lowered = [str(outlet.get(column) or "").lower().encode("utf-8") for outlet in outlets]
+            self.values[column], self.codes[column] = np.unique(np.array(lowered, dtype=bytes), return_inverse=True)
+        self.flags = {service: self.contains("services", service) for service in SERVICE_PATTERNS}
+        # ORDER BY name compares the stored (not lowercased) names
+        self.by_name = np.argsort(np.array([str(outlet.get("name") or "") for outlet in outlets]), kind="stable")
+    
+    def contains(self, column: str, term: str) -> np.ndarray:
+        if not len(self.outlets):
+            return np.zeros(0, dtype=bool)
+        hits = _str_find(self.values[column], term.lower().encode("utf-8")) >= 0
+        return hits[self.codes[column]]
+    
+    def mask(self, conditions: List[Condition]) -> np.ndarray:
+        """Rows matching any condition (every row when there are none, like a query without WHERE)"""
+        if not conditions:
+            return np.ones(len(self.outlets), dtype=bool)
+        mask = np.zeros(len(self.outlets), dtype=bool)
+        for condition in conditions:
+            for term in condition.terms:
+                flag = self.flags.get(term) if condition.column == "services" else None
+                mask |= flag if flag is not None else self.contains(condition.column, term)
+        return mask
+    
+    def select(self, conditions: List[Condition]) -> List[Dict[str, Any]]:
+        mask = self.mask(conditions)
+        return [self.outlets[i] for i in self.by_name[mask[self.by_name]]]
 
 def search_products(query: str, k: int = 5) -> List[Dict[str, Any]]:
     """Enhanced product search with scoring"""
@@ -234,17 +276,18 @@ class OutletsResponse(BaseModel):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global PRODUCTS, OUTLETS
-    print("[STARTUP] Initializing ZUS Coffee API (Memory-based)...")
+    global PRODUCTS, OUTLETS, OUTLET_STORE
+    logger.info("Initializing ZUS Coffee API (Memory-based)...")
     OUTLETS = load_sample_outlets()
+    OUTLET_STORE = OutletStore(OUTLETS)
     PRODUCTS = load_products_from_csv()
-    print(f"[STARTUP] Loaded {len(OUTLETS)} outlets and {len(PRODUCTS)} products")
-    print("[STARTUP] API initialization complete!")
+    logger.info(f"Loaded {len(OUTLETS)} outlets and {len(PRODUCTS)} products")
+    logger.info("API initialization complete!")
     
     yield
     
     # Shutdown
-    print("[SHUTDOWN] ZUS Coffee API shutting down...")
+    logger.info("ZUS Coffee API shutting down...")
 
 app = FastAPI(
     title="ZUS Coffee API - Railway Deploy",
@@ -290,11 +333,14 @@ async def get_products(query: str = Query(..., description="Search query for pro
 async def get_outlets(query: str = Query(..., description="Natural language query for outlets")):
     """Query ZUS Coffee outlets using intelligent text processing"""
     try:
-        # Convert natural language to SQL
-        sql_query = text2sql(query)
+        # Convert natural language to SQL conditions
+        conditions = parse_conditions(query)
+        sql_query = conditions_to_sql(conditions)
+        if sample_debug(logger):
+            logger.debug("Generated SQL for %r: %s", query, sql_query)
         
-        # Execute query on in-memory data
-        results = execute_sql_memory(sql_query)
+        # Evaluate the same conditions over the columnar in-memory store
+        results = OUTLET_STORE.select(conditions)
         
         return OutletsResponse(
             results=results,
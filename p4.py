@@ -1,123 +1,636 @@
 import sqlite3
 import csv
-from typing import List
-from fastapi import FastAPI, Query
-from pydantic import BaseModel
+import os
+import re
+import threading
+import time
+import heapq
+import secrets
+import json
+import math
+import functools
+from datetime import datetime
+from typing import Iterator, List, NamedTuple, Optional
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
 import requests
-from sentence_transformers import SentenceTransformer
-import faiss
+from importlib.metadata import PackageNotFoundError, version as package_version
+import numpy as np
 from contextlib import asynccontextmanager
+from p4_artifacts import artifact_lock, compute_artifact_key, is_memory_mapped, load_artifacts, save_artifacts
+from p4_batcher import MicroBatcher
+from p4_bm25 import BM25Index, reciprocal_rank_fusion
+from p4_cache import LRUCache
+from p4_executor import BoundedExecutor, ExecutorSaturated
+from p4_filters import ProductColumns, ProductFilter, build_product_columns, filter_mask, parse_price, parse_tags
+from p4_json import FastJSONResponse, encode_json, join_array, with_field
+from p4_logging import dropped_records, get_logger, sample_debug
+from p4_index import (
+    build_faiss_index, configure_search, describe_index, filtered_search_parameters, search_subset,
+    supports_remove, writable_copy
+)
+from p4_geo import EARTH_RADIUS_KM, OutletPoints, bounding_box, geocode, haversine_km, load_postcode_centroids
+from p4_hours import OpenSchedule, local_now, parse_hours, week_position
+from p4_matcher import EntityMatcher
+from p4_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MetricsRegistry
+from p4_outlet_query import OutletQueryPlan, TermGroup, compile_plan, decode_cursor, encode_cursor, render_sql
+from p4_sqlite import SQLiteReadPool, enable_wal
+
+logger = get_logger("p4")
 
 
 class ProductDoc(BaseModel):
     id: str
     title: str
     description: str
+    price: Optional[float] = None
+    availability: str = ""
+    tags: List[str] = []
+
+
+PRODUCT_MAX_K = 50
+
+
+class ProductQuery(BaseModel):
+    query: str
+    k: int = Field(2, ge=1, le=PRODUCT_MAX_K)
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    in_stock: Optional[bool] = None
+    tags: List[str] = []
+
+
+class ProductBatchRequest(BaseModel):
+    queries: List[ProductQuery]
+
+
+class ProductSearchState(NamedTuple):
+    docs: list
+    slots: dict
+    model: object
+    index: object
+    embeds: object
+    bm25: BM25Index
+    columns: ProductColumns
+    fragments: list
+    generation: int
+
+
+class ProductSearchNotReady(Exception):
+    pass
+
 
+PRODUCT_STATE: Optional[ProductSearchState] = None
+PRODUCT_CSV_FILE = os.environ.get("P4_PRODUCT_CSV", "zus_drinkware_products.csv")
+PRODUCT_GENERATION = 0
+PRODUCT_INIT_ATTEMPTS = 0
 
+# Aliases of the fields of PRODUCT_STATE, kept for callers that read the
+# module globals directly. Request paths read PRODUCT_STATE once instead.
 PRODUCT_DOCS = []
+PRODUCT_SLOTS = {}
 EMBEDDING_MODEL = None
 FAISS_INDEX = None
 DOC_EMBEDS = None
+PRODUCT_BM25 = None
+PRODUCT_COLUMNS = None
 
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+ARTIFACT_DIR = os.environ.get("P4_ARTIFACT_DIR", ".p4_cache")
+INDEX_TYPE = os.environ.get("P4_INDEX_TYPE", "flat")
+SHARED_ARTIFACTS = os.environ.get("P4_SHARED_ARTIFACTS", "1") != "0"
+EMBEDDING_BACKEND = os.environ.get("P4_EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_DIR = os.environ.get("P4_ONNX_MODEL_DIR", "onnx/all-MiniLM-L6-v2-int8")
+MAX_BATCH_QUERIES = 64
+HYBRID_SEARCH = os.environ.get("P4_HYBRID_SEARCH", "1") != "0"
+HYBRID_CANDIDATES = 20
+RRF_K = 60
+FILTER_EXACT_SEARCH_MAX = 4096
+PRODUCT_WATCH_INTERVAL = float(os.environ.get("P4_PRODUCT_WATCH_INTERVAL", 0))
+ADMIN_TOKEN = os.environ.get("P4_ADMIN_TOKEN")
+PRODUCT_READY_TIMEOUT = float(os.environ.get("P4_PRODUCT_READY_TIMEOUT", 10))
 
-def ingest_product_docs_from_csv(csv_file="zus_drinkware_products.csv"):
-    global PRODUCT_DOCS, EMBEDDING_MODEL, FAISS_INDEX, DOC_EMBEDS
-    
-    print(f"[INFO] Loading products from {csv_file}...")
-    PRODUCT_DOCS = []
+# Encodes and index searches are CPU-bound, so few workers; SQLite reads are short and plentiful
+PRODUCT_EXECUTOR = BoundedExecutor(
+    "products",
+    max_workers=int(os.environ.get("P4_PRODUCT_WORKERS", 2)),
+    max_queue=int(os.environ.get("P4_PRODUCT_QUEUE_DEPTH", 16))
+)
+OUTLET_EXECUTOR = BoundedExecutor(
+    "outlets",
+    max_workers=int(os.environ.get("P4_OUTLET_WORKERS", 8)),
+    max_queue=int(os.environ.get("P4_OUTLET_QUEUE_DEPTH", 64))
+)
+# Concurrent /products requests arriving within the window share one encode and one index search
+PRODUCT_BATCH_WINDOW_MS = float(os.environ.get("P4_PRODUCT_BATCH_WINDOW_MS", 2))
+PRODUCT_BATCH_MAX = int(os.environ.get("P4_PRODUCT_BATCH_MAX", 16))
+
+PRODUCT_WRITE_LOCK = threading.RLock()
+
+QUERY_CACHE = LRUCache(
+    maxsize=int(os.environ.get("P4_QUERY_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("P4_QUERY_CACHE_TTL", 600))
+)
+
+METRICS = MetricsRegistry()
+HTTP_REQUESTS = METRICS.counter("p4_http_requests_total", "HTTP requests by method, route and status", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = METRICS.histogram("p4_http_request_seconds", "HTTP request latency by route", ("route",))
+STAGE_SECONDS = METRICS.histogram(
+    "p4_stage_seconds", "Time spent in one stage of a request (encode, search, text2sql, sqlite, serialize)", ("stage",)
+)
+
+
+def load_embedding_model():
+    if EMBEDDING_BACKEND == "onnx":
+        from p4_onnx import OnnxEmbedder
+        return OnnxEmbedder(ONNX_MODEL_DIR)
     
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+
+def embedding_model_version(model) -> str:
+    if hasattr(model, "model_version"):
+        return model.model_version
     try:
-        with open(csv_file, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                tags = row.get('tags', '').lower()
-                if any(tag in tags for tag in ['tumbler', 'mug', 'cup', 'flask', 'bottle']):
-                    description = ' '.join(row.get('description', '').split())
-                    
-                    product_doc = ProductDoc(
-                        id=row.get('id', ''),
-                        title=row.get('title', ''),
-                        description=description
-                    )
-                    PRODUCT_DOCS.append(product_doc)
-        
-        print(f"[INFO] Loaded {len(PRODUCT_DOCS)} drinkware products")
+        return f"sentence-transformers-{package_version('sentence-transformers')}"
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def product_text(doc: ProductDoc) -> str:
+    return f"{doc.title}. {doc.description}"
+
+
+def product_fragment(doc: ProductDoc) -> bytes:
+    """doc's entry in /products results, serialized once when the product is loaded"""
+    return encode_json({
+        "id": doc.id,
+        "title": doc.title,
+        "description": doc.description,
+        "price": doc.price,
+        "availability": doc.availability,
+        "tags": doc.tags
+    })
+
+
+def read_product_docs(csv_file: str) -> List[ProductDoc]:
+    docs = []
+    with open(csv_file, 'r', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            tags = row.get('tags', '').lower()
+            if any(tag in tags for tag in ['tumbler', 'mug', 'cup', 'flask', 'bottle']):
+                description = ' '.join(row.get('description', '').split())
+                
+                product_doc = ProductDoc(
+                    id=row.get('id', ''),
+                    title=row.get('title', ''),
+                    description=description,
+                    price=parse_price(row.get('price', '')),
+                    availability=row.get('availability', '').strip().lower(),
+                    tags=parse_tags(row.get('tags', ''))
+                )
+                docs.append(product_doc)
+    return docs
+
+
+def build_product_bm25(docs: List[ProductDoc]) -> BM25Index:
+    return BM25Index([(doc.title, doc.description) if doc is not None else ("", "") for doc in docs])
+
+
+def _publish_product_state(state: Optional[ProductSearchState]):
+    global PRODUCT_STATE, PRODUCT_DOCS, PRODUCT_SLOTS, EMBEDDING_MODEL, FAISS_INDEX, DOC_EMBEDS, PRODUCT_BM25, PRODUCT_COLUMNS
+    
+    PRODUCT_STATE = state
+    PRODUCT_DOCS = state.docs if state else []
+    PRODUCT_SLOTS = state.slots if state else {}
+    EMBEDDING_MODEL = state.model if state else None
+    FAISS_INDEX = state.index if state else None
+    DOC_EMBEDS = state.embeds if state else None
+    PRODUCT_BM25 = state.bm25 if state else None
+    PRODUCT_COLUMNS = state.columns if state else None
+    QUERY_CACHE.clear()
+
+
+def _next_product_generation() -> int:
+    global PRODUCT_GENERATION
+    PRODUCT_GENERATION += 1
+    return PRODUCT_GENERATION
+
+
+def load_or_build_product_artifacts(docs, model, model_version, csv_file):
+    """Return (embeds, index) for docs from the artifact store, encoding them on a miss
+
+    The build runs under a cross-process lock, so when several uvicorn workers
+    start together only one encodes; the rest block and then map its files.
+    With SHARED_ARTIFACTS the builder also re-opens what it wrote, so every
+    worker serves the same read-only page-cache pages instead of private copies.
+    """
+    artifact_key = compute_artifact_key(docs, EMBEDDING_MODEL_NAME, model_version, INDEX_TYPE)
+    load_start = time.perf_counter()
+    
+    with artifact_lock(ARTIFACT_DIR):
+        cached = load_artifacts(ARTIFACT_DIR, artifact_key)
         
-        if not PRODUCT_DOCS:
-            print("[WARNING] No products loaded! Check CSV file and filtering criteria.")
-            return
+        if cached is not None:
+            embeds, index = cached
+            elapsed_ms = (time.perf_counter() - load_start) * 1000
+            logger.info(f"Artifact cache hit ({artifact_key[:12]}): mapped embeddings and index in {elapsed_ms:.1f} ms")
+            return embeds, configure_search(index)
         
-        print("[INFO] Initializing sentence transformer model...")
-        EMBEDDING_MODEL = SentenceTransformer("all-MiniLM-L6-v2")
+        logger.info(f"Artifact cache miss ({artifact_key[:12]}): creating embeddings for products...")
+        embeds = model.encode([product_text(doc) for doc in docs], convert_to_numpy=True)
         
-        print("[INFO] Creating embeddings for products...")
-        texts = []
-        for doc in PRODUCT_DOCS:
-            combined_text = f"{doc.title}. {doc.description}"
-            texts.append(combined_text)
+        logger.info(f"Building FAISS index ({INDEX_TYPE})...")
+        index = build_faiss_index(embeds, INDEX_TYPE)
         
-        DOC_EMBEDS = EMBEDDING_MODEL.encode(texts, convert_to_numpy=True)
+        try:
+            save_artifacts(ARTIFACT_DIR, artifact_key, embeds, index, meta={
+                "model": EMBEDDING_MODEL_NAME,
+                "model_version": model_version,
+                "index_type": describe_index(index),
+                "csv_file": csv_file,
+                "products": len(docs)
+            })
+            if SHARED_ARTIFACTS:
+                embeds, index = load_artifacts(ARTIFACT_DIR, artifact_key)
+                configure_search(index)
+        except OSError as e:
+            logger.warning(f"Could not write artifact cache to {ARTIFACT_DIR}: {e}")
+    
+    elapsed_ms = (time.perf_counter() - load_start) * 1000
+    logger.info(f"Encoded and indexed {len(docs)} products in {elapsed_ms:.1f} ms")
+    return embeds, index
+
+
+def ingest_product_docs_from_csv(csv_file="zus_drinkware_products.csv"):
+    global PRODUCT_CSV_FILE, PRODUCT_INIT_ATTEMPTS
+    
+    with PRODUCT_WRITE_LOCK:
+        logger.info(f"Loading products from {csv_file}...")
+        PRODUCT_CSV_FILE = csv_file
         
-        print("[INFO] Building FAISS index...")
-        dim = DOC_EMBEDS.shape[1]
-        FAISS_INDEX = faiss.IndexFlatL2(dim)
-        FAISS_INDEX.add(DOC_EMBEDS)
+        try:
+            docs = read_product_docs(csv_file)
+            slots = {doc.id: slot for slot, doc in enumerate(docs)}
+            
+            logger.info(f"Loaded {len(docs)} drinkware products")
+            
+            if not docs:
+                logger.warning("No products loaded! Check CSV file and filtering criteria.")
+                return
+            
+            bm25 = build_product_bm25(docs)
+            
+            logger.info(f"Initializing {EMBEDDING_BACKEND} embedding model...")
+            model = load_embedding_model()
+            model_version = embedding_model_version(model)
+            
+            embeds, index = load_or_build_product_artifacts(docs, model, model_version, csv_file)
+            
+            _publish_product_state(ProductSearchState(
+                docs=docs,
+                slots=slots,
+                model=model,
+                index=index,
+                embeds=embeds,
+                bm25=bm25,
+                columns=build_product_columns(docs),
+                fragments=[product_fragment(doc) for doc in docs],
+                generation=_next_product_generation()
+            ))
+            logger.info(f"Vector store initialized with {len(docs)} products ({describe_index(index)})")
+            
+            for i, doc in enumerate(docs[:3]):
+                logger.debug(f"Product {i+1}: {doc.title[:50]}...")
+                
+        except FileNotFoundError:
+            logger.error(f"CSV file {csv_file} not found!")
+        except Exception as e:
+            logger.error(f"Failed to load products: {e}")
+        finally:
+            PRODUCT_INIT_ATTEMPTS += 1
+
+
+def ensure_product_state(timeout: float = None) -> Optional[ProductSearchState]:
+    """Return the published search state, loading it at most once across concurrent callers
+
+    Callers that arrive while another thread is loading wait up to timeout
+    seconds (forever when None) and raise ProductSearchNotReady after that.
+    A failed load is not retried by the callers that were waiting on it.
+    """
+    state = PRODUCT_STATE
+    if state is not None:
+        return state
+    
+    attempt = PRODUCT_INIT_ATTEMPTS
+    if not PRODUCT_WRITE_LOCK.acquire(timeout=-1 if timeout is None else timeout):
+        raise ProductSearchNotReady("Product search system is still initializing")
+    try:
+        if PRODUCT_STATE is None and PRODUCT_INIT_ATTEMPTS == attempt:
+            logger.info("Initializing product search system...")
+            ingest_product_docs_from_csv(PRODUCT_CSV_FILE)
+        return PRODUCT_STATE
+    finally:
+        PRODUCT_WRITE_LOCK.release()
+
+
+def _apply_index_delta(state, docs, embeds, remove_slots, add_slots, add_vectors):
+    if is_memory_mapped(state.index):
+        logger.info(
+            f"Replacing the memory-mapped FAISS index ({state.index.ntotal} vectors) with a private copy "
+            "to apply a catalog update; this process no longer shares it with the other workers"
+        )
+    if supports_remove(state.index):
+        index = writable_copy(state.index)
+        if remove_slots:
+            index.remove_ids(np.array(remove_slots, dtype="int64"))
+        if add_slots:
+            index.add_with_ids(np.asarray(add_vectors, dtype="float32"), np.array(add_slots, dtype="int64"))
+        return index
+    
+    live_slots = [slot for slot, doc in enumerate(docs) if doc is not None]
+    return build_faiss_index(embeds[live_slots], INDEX_TYPE, ids=live_slots)
+
+
+def _apply_product_changes(state: ProductSearchState, upserts: List[ProductDoc], delete_ids: List[str]):
+    """state with delete_ids removed and upserts inserted or replaced, plus the counts; (None, counts) when nothing changed
+
+    Deletes are applied before upserts, and the index gets a single delta for
+    both, so a caller can publish the whole change as one snapshot.
+    """
+    current_docs = list(state.docs)
+    slots = dict(state.slots)
+    fragments = list(state.fragments)
+    
+    removed_slots = [slots.pop(product_id) for product_id in dict.fromkeys(delete_ids) if product_id in slots]
+    for slot in removed_slots:
+        current_docs[slot] = None
+        fragments[slot] = None
+    
+    changed = list({doc.id: doc for doc in upserts if doc.id not in slots or current_docs[slots[doc.id]] != doc}.values())
+    counts = {"inserted": 0, "updated": 0, "deleted": len(removed_slots)}
+    if not changed and not removed_slots:
+        return None, counts
+    
+    # Price/stock/tag edits only touch the metadata columns; text edits need new vectors
+    reencode_ids = {
+        doc.id for doc in changed
+        if doc.id not in slots or product_text(current_docs[slots[doc.id]]) != product_text(doc)
+    }
+    
+    updated_slots = []
+    replaced_slots = []
+    reencode_slots = []
+    for doc in changed:
+        slot = slots.get(doc.id)
+        if slot is None:
+            slot = len(current_docs)
+            slots[doc.id] = slot
+            current_docs.append(None)
+            fragments.append(None)
+        else:
+            updated_slots.append(slot)
+            if doc.id in reencode_ids:
+                replaced_slots.append(slot)
+        current_docs[slot] = doc
+        fragments[slot] = product_fragment(doc)
+        if doc.id in reencode_ids:
+            reencode_slots.append(slot)
+    
+    embeds, index, vectors = state.embeds, state.index, None
+    if reencode_slots:
+        vectors = state.model.encode([product_text(current_docs[slot]) for slot in reencode_slots], convert_to_numpy=True)
+        embeds = np.zeros((len(current_docs), vectors.shape[1]), dtype="float32")
+        embeds[:len(state.embeds)] = state.embeds
+        embeds[reencode_slots] = vectors
+    if reencode_slots or removed_slots:
+        index = _apply_index_delta(state, current_docs, embeds, removed_slots + replaced_slots, reencode_slots, vectors)
+    
+    counts["inserted"] = len(changed) - len(updated_slots)
+    counts["updated"] = len(updated_slots)
+    return state._replace(
+        docs=current_docs,
+        slots=slots,
+        index=index,
+        embeds=embeds,
+        bm25=build_product_bm25(current_docs),
+        columns=build_product_columns(current_docs),
+        fragments=fragments,
+        generation=_next_product_generation()
+    ), counts
+
+
+def _loaded_product_state() -> ProductSearchState:
+    state = PRODUCT_STATE
+    if state is None:
+        raise RuntimeError("Product search system is not initialized")
+    return state
+
+
+def upsert_products(docs: List[ProductDoc]) -> dict:
+    """Insert new products and replace changed ones by ProductDoc.id, encoding only those rows"""
+    with PRODUCT_WRITE_LOCK:
+        state, counts = _apply_product_changes(_loaded_product_state(), docs, [])
+        counts = {"inserted": counts["inserted"], "updated": counts["updated"]}
+        if state is not None:
+            _publish_product_state(state)
+            logger.info(f"Upserted products: {counts}")
+        return counts
+
+
+def delete_products(ids: List[str]) -> dict:
+    """Remove products by ProductDoc.id without touching the rest of the index"""
+    with PRODUCT_WRITE_LOCK:
+        state, counts = _apply_product_changes(_loaded_product_state(), [], ids)
+        if state is not None:
+            _publish_product_state(state)
+            logger.info(f"Deleted {counts['deleted']} products")
+        return {"deleted": counts["deleted"]}
+
+
+def reload_products_from_csv(csv_file: str = None) -> dict:
+    """Diff the CSV against the loaded catalog and apply only the changed rows
+
+    Deletions and upserts are published as one snapshot, so readers never see
+    the catalog with rows removed but their replacements not yet added.
+    """
+    csv_file = csv_file or PRODUCT_CSV_FILE
+    with PRODUCT_WRITE_LOCK:
+        new_docs = read_product_docs(csv_file)
+        new_ids = {doc.id for doc in new_docs}
+        state = _loaded_product_state()
+        live_docs = {doc.id: doc for doc in state.docs if doc is not None}
         
-        print(f"[SUCCESS] Vector store initialized with {len(PRODUCT_DOCS)} products")
+        state, counts = _apply_product_changes(
+            state,
+            [doc for doc in new_docs if live_docs.get(doc.id) != doc],
+            [product_id for product_id in live_docs if product_id not in new_ids]
+        )
+        if state is not None:
+            _publish_product_state(state)
         
-        for i, doc in enumerate(PRODUCT_DOCS[:3]):
-            print(f"[DEBUG] Product {i+1}: {doc.title[:50]}...")
-            
-    except FileNotFoundError:
-        print(f"[ERROR] CSV file {csv_file} not found!")
-        EMBEDDING_MODEL = None
-        FAISS_INDEX = None
-        DOC_EMBEDS = None
-    except Exception as e:
-        print(f"[ERROR] Failed to load products: {e}")
-        EMBEDDING_MODEL = None
-        FAISS_INDEX = None
-        DOC_EMBEDS = None
+        counts["unchanged"] = len(new_ids) - counts["inserted"] - counts["updated"]
+        logger.info(f"Reloaded products from {csv_file}: {counts}")
+        return counts
+
+
+def watch_product_csv(stop_event: threading.Event, interval: float):
+    """Poll the product CSV and hot-reload only the rows that changed"""
+    last_seen = None
+    while not stop_event.wait(interval):
+        try:
+            stat = os.stat(PRODUCT_CSV_FILE)
+        except OSError:
+            continue
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if last_seen is not None and signature != last_seen and PRODUCT_STATE is not None:
+            try:
+                reload_products_from_csv()
+            except Exception as e:
+                logger.error(f"Product hot reload failed: {e}")
+        last_seen = signature
 
 
 def ingest_product_docs_from_web(
     url="https://shop.zuscoffee.com/collections/drinkware",
 ):
-    print("[INFO] Web scraping is challenging due to JavaScript rendering.")
-    print("[INFO] Using CSV file as primary data source...")
+    logger.info("Web scraping is challenging due to JavaScript rendering.")
+    logger.info("Using CSV file as primary data source...")
     ingest_product_docs_from_csv()
 
 
-def search_products(query: str, k: int = 2) -> List[ProductDoc]:
-    global EMBEDDING_MODEL, FAISS_INDEX, PRODUCT_DOCS
+def search_products(query: str, k: int = 2, product_filter: ProductFilter = None) -> List[ProductDoc]:
+    return search_products_batch([query], [k], [product_filter])[0]
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _search_product_index(state: ProductSearchState, query_vecs, k: int, mask=None):
+    """index.search restricted to the slots in mask; small selections are scanned exactly"""
+    if mask is None:
+        return state.index.search(query_vecs, k)
     
-    if EMBEDDING_MODEL is None or FAISS_INDEX is None or not PRODUCT_DOCS:
-        print("[INFO] Initializing product search system...")
-        ingest_product_docs_from_csv()
-        
-        if EMBEDDING_MODEL is None or FAISS_INDEX is None or not PRODUCT_DOCS:
-            print("[ERROR] Failed to initialize product search system")
-            return []
+    selected = np.flatnonzero(mask)
+    if len(selected) <= FILTER_EXACT_SEARCH_MAX:
+        return search_subset(state.embeds, selected, query_vecs, k)
+    return state.index.search(query_vecs, k, params=filtered_search_parameters(state.index, mask))
+
+
+def search_products_batch(
+    queries: List[str], ks: List[int], filters: List[Optional[ProductFilter]] = None,
+    state: Optional[ProductSearchState] = None
+) -> List[List[ProductDoc]]:
+    """Search each query; state is loaded on demand unless the caller already resolved it"""
+    if not queries:
+        return []
+    
+    state = state or ensure_product_state()
+    if state is None:
+        logger.error("Failed to initialize product search system")
+        return [[] for _ in queries]
     
     try:
-        query_vec = EMBEDDING_MODEL.encode([query], convert_to_numpy=True)
-        distances, indices = FAISS_INDEX.search(query_vec, min(k, len(PRODUCT_DOCS)))
+        docs, generation = state.docs, state.generation
+        bm25 = state.bm25 if HYBRID_SEARCH else None
+        ks = [min(max(k, 0), len(docs)) for k in ks]
+        depths = [min(max(k, HYBRID_CANDIDATES), len(docs)) if bm25 is not None and k > 0 else k for k in ks]
+        keys = [normalize_query(query) for query in queries]
+        
+        filters = [f if f is not None and not f.is_empty() else None for f in filters or [None] * len(queries)]
+        masks = {f: filter_mask(state.columns, f) for f in set(filters) if f is not None}
+        cache_keys = [key if f is None else (key, f) for key, f in zip(keys, filters)]
+        
+        hits_by_row = [None] * len(queries)
+        lexical_by_row = [None] * len(queries)
+        vectors_by_key = {}
+        for row, (query, key, depth) in enumerate(zip(queries, keys, depths)):
+            allowed = masks.get(filters[row])
+            if depth <= 0 or (allowed is not None and not allowed.any()):
+                hits_by_row[row] = []
+                continue
+            if bm25 is not None:
+                decisive = bm25.decisive_hits(query, ks[row], allowed)
+                if decisive:
+                    lexical_by_row[row] = decisive
+                    hits_by_row[row] = []
+                    continue
+            cached = QUERY_CACHE.get(cache_keys[row])
+            if cached is None or cached[0] != generation:
+                continue
+            _, query_vec, cached_hits, exhausted = cached
+            vectors_by_key[key] = query_vec
+            if len(cached_hits) >= depth or exhausted:
+                hits_by_row[row] = cached_hits[:depth]
+        
+        pending_rows = [row for row, hits in enumerate(hits_by_row) if hits is None]
+        if pending_rows:
+            to_encode = list(dict.fromkeys(keys[row] for row in pending_rows if keys[row] not in vectors_by_key))
+            if to_encode:
+                with STAGE_SECONDS.time("encode"):
+                    encoded = state.model.encode(
+                        [queries[keys.index(key)] for key in to_encode], convert_to_numpy=True
+                    )
+                vectors_by_key.update(zip(to_encode, encoded))
+            
+            # One FAISS call per distinct filter, each over that filter's unique queries
+            searches = {}
+            for row in pending_rows:
+                searches.setdefault(filters[row], {})[cache_keys[row]] = keys[row]
+            
+            for product_filter, pending_keys in searches.items():
+                group_rows = [row for row in pending_rows if filters[row] == product_filter]
+                max_k = max(depths[row] for row in group_rows)
+                query_vecs = np.stack([vectors_by_key[key] for key in pending_keys.values()]).astype("float32")
+                with STAGE_SECONDS.time("search"):
+                    distances, indices = _search_product_index(state, query_vecs, max_k, masks.get(product_filter))
+                
+                for i, (cache_key, key) in enumerate(pending_keys.items()):
+                    hits = [(int(idx), float(distance)) for idx, distance in zip(indices[i], distances[i]) if idx >= 0]
+                    QUERY_CACHE.put(cache_key, (generation, vectors_by_key[key], hits, len(hits) < max_k))
+                    for row in group_rows:
+                        if cache_keys[row] == cache_key:
+                            hits_by_row[row] = hits[:depths[row]]
         
         relevance_threshold = 1.5
-        results = []
+        batch_results = []
+        verbose = sample_debug(logger)
         
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if distance < relevance_threshold and idx < len(PRODUCT_DOCS):
-                results.append(PRODUCT_DOCS[idx])
-                print(f"[DEBUG] Found match: {PRODUCT_DOCS[idx].title} (distance: {distance:.3f})")
+        for row, query in enumerate(queries):
+            k = ks[row]
+            if lexical_by_row[row] is not None:
+                ranked = [(idx, "bm25", score) for idx, score in lexical_by_row[row]]
+            else:
+                vector_hits = [
+                    (idx, distance) for idx, distance in hits_by_row[row]
+                    if distance < relevance_threshold and idx < len(docs) and docs[idx] is not None
+                ]
+                if bm25 is None:
+                    ranked = [(idx, "distance", distance) for idx, distance in vector_hits[:k]]
+                else:
+                    lexical_hits = bm25.top(query, depths[row], masks.get(filters[row]))
+                    fused = reciprocal_rank_fusion(
+                        [[idx for idx, _ in vector_hits], [idx for idx, _ in lexical_hits]],
+                        k=RRF_K
+                    )
+                    ranked = [(idx, "rrf", score) for idx, score in fused[:k]]
+            
+            results = [docs[idx] for idx, _, _ in ranked]
+            if verbose:
+                for idx, method, score in ranked:
+                    logger.debug("Found match: %s (%s: %.4f)", docs[idx].title, method, score)
+                logger.debug("Found %d relevant products for query: %r", len(results), query)
+            batch_results.append(results)
         
-        print(f"[INFO] Found {len(results)} relevant products for query: '{query}'")
-        return results
+        return batch_results
         
     except Exception as e:
-        print(f"[ERROR] Search failed: {e}")
-        return []
+        logger.error(f"Search failed: {e}")
+        return [[] for _ in queries]
 
 
 def generate_product_summary(products: List[ProductDoc], query: str) -> str:
@@ -144,14 +657,150 @@ def generate_product_summary(products: List[ProductDoc], query: str) -> str:
 
 # --- Outlets Text2SQL Setup ---
 DB_PATH = "zus_outlets.db"
+OUTLET_SEARCH_LIMIT = 50
+OUTLETS_IN_MEMORY = os.environ.get("P4_OUTLETS_IN_MEMORY", "0") == "1"
+OUTLETS_DB = SQLiteReadPool(DB_PATH, in_memory=OUTLETS_IN_MEMORY)
+POSTCODE_CSV_FILE = os.environ.get("P4_POSTCODE_CSV", "malaysia_postcodes.csv")
+POSTCODE_CENTROIDS = None
+OUTLET_FRAGMENTS = None
+OUTLETS_GENERATION = 0
+OUTLET_CACHE_SIZE = int(os.environ.get("P4_OUTLET_CACHE_SIZE", 1024))
+OUTLET_PLAN_CACHE = LRUCache(maxsize=OUTLET_CACHE_SIZE)
+OUTLET_RESPONSE_CACHE = LRUCache(maxsize=OUTLET_CACHE_SIZE, sizeof=len)
+_NOT_CACHED = object()
+OUTLET_PAGE_MAX = 500
+OUTLET_FETCH_ROWS = 256
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NEARBY_START_RADIUS_KM = 2.0
+NEARBY_MIN_RADIUS_KM = 0.05
+NEARBY_CANDIDATE_LIMIT = 256
+NEARBY_MAX_K = 50
 
 
-def ingest_outlets_from_csv(csv_file="zus_outlets_kl_selangor.csv"):
-    print(f"[INFO] Loading outlets from {csv_file}...")
-    
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
+def create_outlet_fts(c):
+    """External-content FTS5 index over outlets; it stores no copy of the text, only the index"""
+    c.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS outlets_fts USING fts5(
+            name, location, address,
+            content='outlets', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """
+    )
+
+
+def rebuild_outlet_fts(c):
+    c.execute("INSERT INTO outlets_fts(outlets_fts) VALUES('rebuild')")
+
+
+def unindex_outlet_fts(c, outlet_ids: List[int]):
+    """Remove outlets from the FTS index; external content needs the old values, so run it before they change"""
+    c.execute(
+        "INSERT INTO outlets_fts(outlets_fts, rowid, name, location, address) "
+        "SELECT 'delete', id, name, location, address FROM outlets WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(outlet_ids),)
+    )
+
+
+def index_outlet_fts(c, outlet_ids: List[int]):
+    c.execute(
+        "INSERT INTO outlets_fts(rowid, name, location, address) "
+        "SELECT id, name, location, address FROM outlets WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(outlet_ids),)
+    )
+
+
+def create_outlet_hours(c):
+    """Parsed opening hours, one (day, open_min, close_min) range per row, indexed for interval lookups"""
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outlet_hours (
+            outlet_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            open_min INTEGER NOT NULL,
+            close_min INTEGER NOT NULL
+        )
+        """
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outlet_hours_day_open ON outlet_hours (day, open_min, close_min)")
+
+
+def rebuild_outlet_hours(c, outlet_ids: Optional[List[int]] = None):
+    """Re-parse the hours of outlet_ids (every outlet when None); ids no longer in outlets just lose their rows"""
+    if outlet_ids is None:
+        c.execute("DELETE FROM outlet_hours")
+        c.execute("SELECT id, hours FROM outlets")
+    else:
+        c.execute("DELETE FROM outlet_hours WHERE outlet_id IN (SELECT value FROM json_each(?))", (json.dumps(outlet_ids),))
+        c.execute("SELECT id, hours FROM outlets WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(outlet_ids),))
+    rows = [(outlet_id, *hours) for outlet_id, text in c.fetchall() for hours in parse_hours(text)]
+    c.executemany("INSERT INTO outlet_hours (outlet_id, day, open_min, close_min) VALUES (?, ?, ?, ?)", rows)
+
+
+def get_postcode_centroids() -> dict:
+    global POSTCODE_CENTROIDS
+    if POSTCODE_CENTROIDS is None:
+        try:
+            POSTCODE_CENTROIDS = load_postcode_centroids(POSTCODE_CSV_FILE)
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Could not load postcode gazetteer {POSTCODE_CSV_FILE}: {e}")
+            POSTCODE_CENTROIDS = {}
+    return POSTCODE_CENTROIDS
+
+
+def create_outlet_geo(c):
+    """R*Tree over outlet locations: each outlet is a zero-size box, with the exact point kept as auxiliary columns"""
+    c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS outlets_geo USING rtree(id, min_lat, max_lat, min_lon, max_lon, +lat, +lon)")
+
+
+def rebuild_outlet_geo(c, outlet_ids: Optional[List[int]] = None):
+    """Geocode outlet_ids (every outlet when None) from the postcode in the address; unknown postcodes are left out"""
+    if outlet_ids is None:
+        c.execute("DELETE FROM outlets_geo")
+        c.execute("SELECT id, address FROM outlets")
+    else:
+        c.execute("DELETE FROM outlets_geo WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(outlet_ids),))
+        c.execute("SELECT id, address FROM outlets WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(outlet_ids),))
+    outlets = c.fetchall()
+    centroids = get_postcode_centroids()
+    rows = []
+    for outlet_id, address in outlets:
+        point = geocode(address, centroids)
+        if point:
+            lat, lon = point
+            rows.append((outlet_id, lat, lat, lon, lon, lat, lon))
+    c.executemany("INSERT INTO outlets_geo (id, min_lat, max_lat, min_lon, max_lon, lat, lon) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    logger.info(f"Geocoded {len(rows)}/{len(outlets)} outlets from address postcodes")
+
+
+def outlet_fts_query(q: str) -> str:
+    """FTS5 MATCH expression: any query term as a prefix, ASCII terms only when longer than 2 chars
+
+    Terms are runs of letters and digits in any script, split like the
+    unicode61 tokenizer of outlets_fts (which also folds diacritics).
+    """
+    terms = dict.fromkeys(
+        term for term in re.findall(r"[^\W_]+", q.lower()) if len(term) > 2 or not term.isascii()
+    )
+    return " OR ".join(f'"{term}"*' for term in terms)
+
+
+def outlet_fts_sql(q: str) -> str:
+    """Free-text outlet search ranked by bm25() (name matches weigh most), with a highlighted snippet"""
+    match_query = outlet_fts_query(q)
+    if not match_query:
+        return ""
+    return render_sql(*compile_plan(OutletQueryPlan(text=match_query, sort="relevance", limit=OUTLET_SEARCH_LIMIT)))
+
+
+def outlet_key(name: str, address: str) -> str:
+    """Identity of an outlet across re-ingests: name and address with case and whitespace folded"""
+    return " ".join(name.lower().split()) + "|" + " ".join(address.lower().split())
+
+
+def create_outlet_tables(c) -> bool:
+    """Create or migrate the outlets table and its derived tables; True when the derived tables need a full rebuild"""
     c.execute(
         """
         CREATE TABLE IF NOT EXISTS outlets (
@@ -161,7 +810,8 @@ def ingest_outlets_from_csv(csv_file="zus_outlets_kl_selangor.csv"):
             address TEXT,
             hours TEXT,
             services TEXT,
-            direction_link TEXT
+            direction_link TEXT,
+            outlet_key TEXT
         )
         """
     )
@@ -169,16 +819,139 @@ def ingest_outlets_from_csv(csv_file="zus_outlets_kl_selangor.csv"):
     try:
         c.execute("SELECT address FROM outlets LIMIT 1")
     except sqlite3.OperationalError:
-        print("[INFO] Adding missing address column to outlets table...")
+        logger.info("Adding missing address column to outlets table...")
         c.execute("ALTER TABLE outlets ADD COLUMN address TEXT")
     
     try:
         c.execute("SELECT direction_link FROM outlets LIMIT 1")
     except sqlite3.OperationalError:
-        print("[INFO] Adding missing direction_link column to outlets table...")
+        logger.info("Adding missing direction_link column to outlets table...")
         c.execute("ALTER TABLE outlets ADD COLUMN direction_link TEXT")
     
-    c.execute("DELETE FROM outlets")
+    try:
+        c.execute("SELECT outlet_key FROM outlets LIMIT 1")
+    except sqlite3.OperationalError:
+        logger.info("Adding missing outlet_key column to outlets table...")
+        c.execute("ALTER TABLE outlets ADD COLUMN outlet_key TEXT")
+    
+    rebuild_derived = False
+    c.execute("SELECT COUNT(*) FROM outlets WHERE outlet_key IS NULL")
+    if c.fetchone()[0]:
+        # Rows loaded before outlets were keyed cannot be diffed; the load that follows replaces them once
+        logger.info("Replacing unkeyed outlet rows...")
+        c.execute("DELETE FROM outlets")
+        rebuild_derived = True
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_outlets_key ON outlets (outlet_key)")
+    # Covers ORDER BY name, id (the rowid is part of every index entry) for keyset pages
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outlets_name ON outlets (name)")
+    
+    c.execute("SELECT COUNT(*) FROM sqlite_master WHERE name IN ('outlets_fts', 'outlet_hours', 'outlets_geo')")
+    if c.fetchone()[0] < 3:
+        rebuild_derived = True
+    create_outlet_fts(c)
+    create_outlet_hours(c)
+    create_outlet_geo(c)
+    return rebuild_derived
+
+
+def sync_outlets(c, rows: List[tuple]) -> dict:
+    """Make the outlets table hold exactly rows, writing only the difference
+    
+    rows are (name, location, address, hours, services, direction_link). They
+    are staged in a temp shadow table and diffed against outlets on
+    outlet_key; deletes, updates and inserts (with their FTS, hours and geo
+    entries) then go in as one transaction, so WAL readers see the old set
+    until the commit. When nothing differs outlets is not written at all.
+    Returns inserted/updated/deleted/unchanged counts; the caller commits.
+    """
+    rebuild_derived = create_outlet_tables(c)
+    
+    c.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS outlets_incoming (
+            outlet_key TEXT PRIMARY KEY,
+            name TEXT,
+            location TEXT,
+            address TEXT,
+            hours TEXT,
+            services TEXT,
+            direction_link TEXT
+        )
+        """
+    )
+    c.execute("DELETE FROM outlets_incoming")
+    # A repeated key keeps its last row, the same as loading the rows one after another
+    c.executemany(
+        "INSERT OR REPLACE INTO outlets_incoming (outlet_key, name, location, address, hours, services, direction_link) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(outlet_key(row[0], row[2]), *row) for row in rows]
+    )
+    
+    c.execute("SELECT id FROM outlets WHERE outlet_key NOT IN (SELECT outlet_key FROM outlets_incoming)")
+    deleted = [outlet_id for (outlet_id,) in c.fetchall()]
+    c.execute(
+        """
+        SELECT outlets.id FROM outlets JOIN outlets_incoming incoming ON incoming.outlet_key = outlets.outlet_key
+        WHERE outlets.name IS NOT incoming.name OR outlets.location IS NOT incoming.location
+           OR outlets.address IS NOT incoming.address OR outlets.hours IS NOT incoming.hours
+           OR outlets.services IS NOT incoming.services OR outlets.direction_link IS NOT incoming.direction_link
+        """
+    )
+    updated = [outlet_id for (outlet_id,) in c.fetchall()]
+    c.execute("SELECT COUNT(*) FROM outlets_incoming")
+    total = c.fetchone()[0]
+    c.execute("SELECT COUNT(*) FROM outlets_incoming WHERE outlet_key NOT IN (SELECT outlet_key FROM outlets)")
+    inserted = c.fetchone()[0]
+    counts = {"inserted": inserted, "updated": len(updated), "deleted": len(deleted), "unchanged": total - inserted - len(updated)}
+    
+    if inserted or updated or deleted:
+        # Readers see the updated rows from the caller's commit on, before refresh_outlet_readers()
+        discard_outlet_fragments(updated)
+        if not rebuild_derived:
+            unindex_outlet_fts(c, deleted + updated)
+        c.execute("DELETE FROM outlets WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(deleted),))
+        c.execute(
+            """
+            UPDATE outlets SET (name, location, address, hours, services, direction_link) = (
+                SELECT name, location, address, hours, services, direction_link
+                FROM outlets_incoming WHERE outlets_incoming.outlet_key = outlets.outlet_key
+            )
+            WHERE id IN (SELECT value FROM json_each(?))
+            """,
+            (json.dumps(updated),)
+        )
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM outlets")
+        previous_max_id = c.fetchone()[0]
+        c.execute(
+            "INSERT INTO outlets (outlet_key, name, location, address, hours, services, direction_link) "
+            "SELECT outlet_key, name, location, address, hours, services, direction_link FROM outlets_incoming "
+            "WHERE outlet_key NOT IN (SELECT outlet_key FROM outlets) ORDER BY rowid"
+        )
+        # AUTOINCREMENT ids only grow, so the new rows are exactly the ids past the old maximum
+        c.execute("SELECT id FROM outlets WHERE id > ?", (previous_max_id,))
+        changed = deleted + updated + [outlet_id for (outlet_id,) in c.fetchall()]
+        
+        if not rebuild_derived:
+            index_outlet_fts(c, changed)
+            rebuild_outlet_hours(c, changed)
+            rebuild_outlet_geo(c, changed)
+    
+    if rebuild_derived:
+        rebuild_outlet_fts(c)
+        rebuild_outlet_hours(c)
+        rebuild_outlet_geo(c)
+    
+    c.execute("DELETE FROM outlets_incoming")
+    return counts
+
+
+def ingest_outlets_from_csv(csv_file="zus_outlets_kl_selangor.csv") -> dict:
+    """Load the outlet CSV as a diff against the current table; falls back to sample outlets if the CSV fails"""
+    logger.info(f"Loading outlets from {csv_file}...")
+    
+    conn = sqlite3.connect(DB_PATH)
+    enable_wal(conn)
+    c = conn.cursor()
     
     try:
         with open(csv_file, 'r', encoding='utf-8') as file:
@@ -195,35 +968,35 @@ def ingest_outlets_from_csv(csv_file="zus_outlets_kl_selangor.csv"):
                     row.get('direction_link', '').strip()
                 ))
         
-        c.executemany(
-            "INSERT INTO outlets (name, location, address, hours, services, direction_link) VALUES (?, ?, ?, ?, ?, ?)",
-            outlets_data
-        )
-        
+        counts = sync_outlets(c, outlets_data)
         conn.commit()
         
         c.execute("SELECT COUNT(*) FROM outlets")
         count = c.fetchone()[0]
         
-        print(f"[SUCCESS] Loaded {count} outlets into database")
+        logger.info(f"Loaded {count} outlets into database: {counts}")
         
         c.execute("SELECT name, location FROM outlets LIMIT 3")
         samples = c.fetchall()
         for i, (name, location) in enumerate(samples, 1):
-            print(f"[DEBUG] Outlet {i}: {name} ({location})")
+            logger.debug(f"Outlet {i}: {name} ({location})")
+        return counts
             
     except FileNotFoundError:
-        print(f"[ERROR] CSV file {csv_file} not found!")
-        ingest_outlets_from_web_fallback()
+        logger.error(f"CSV file {csv_file} not found!")
+        conn.rollback()
+        return ingest_outlets_from_web_fallback()
     except Exception as e:
-        print(f"[ERROR] Failed to load outlets from CSV: {e}")
-        ingest_outlets_from_web_fallback()
+        logger.error(f"Failed to load outlets from CSV: {e}")
+        conn.rollback()
+        return ingest_outlets_from_web_fallback()
     finally:
         conn.close()
+        refresh_outlet_readers()
 
 
-def ingest_outlets_from_web_fallback():
-    print("[INFO] Using fallback sample data...")
+def ingest_outlets_from_web_fallback() -> dict:
+    logger.info("Using fallback sample data...")
     
     sample_data = [
         ("SS 2", "Petaling Jaya", "SS 2 Petaling Jaya, Selangor", "9AM-9PM", "Dine-in, Takeaway, Delivery", ""),
@@ -237,191 +1010,746 @@ def ingest_outlets_from_web_fallback():
     c = conn.cursor()
     
     try:
-        c.executemany(
-            "INSERT INTO outlets (name, location, address, hours, services, direction_link) VALUES (?, ?, ?, ?, ?, ?)",
-            sample_data
-        )
+        counts = sync_outlets(c, sample_data)
         conn.commit()
-        print(f"[INFO] Added {len(sample_data)} sample outlets as fallback")
+        logger.info(f"Added {len(sample_data)} sample outlets as fallback: {counts}")
+        return counts
     except Exception as e:
-        print(f"[ERROR] Failed to add sample data: {e}")
+        logger.error(f"Failed to add sample data: {e}")
+        conn.rollback()
+        return {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
     finally:
         conn.close()
+        refresh_outlet_readers()
 
 
 def ingest_outlets_from_web(
     url="https://zuscoffee.com/category/store/kuala-lumpur-selangor/",
 ):
-    print("[INFO] Initializing outlets database...")
+    logger.info("Initializing outlets database...")
     ingest_outlets_from_csv()
 
 
-def text2sql(nl_query: str) -> str:
+LIST_ALL_KEYWORDS = ['all', 'show all', 'list all', 'every']
+
+OUTLET_LOCATION_PATTERNS = {
+    'kuala lumpur': ['kl', 'kuala lumpur', 'wilayah persekutuan'],
+    'selangor': ['selangor', 'shah alam', 'petaling jaya', 'pj'],
+    'putrajaya': ['putrajaya'],
+    'klang': ['klang'],
+    'ampang': ['ampang'],
+    'cheras': ['cheras'],
+    'bangsar': ['bangsar'],
+    'mont kiara': ['mont kiara'],
+    'damansara': ['damansara'],
+    'subang': ['subang'],
+    'bangi': ['bangi'],
+    'cyberjaya': ['cyberjaya'],
+    'setapak': ['setapak'],
+    'kepong': ['kepong'],
+    'puchong': ['puchong']
+}
+
+# Earlier entries win when a query mentions more than one service / time of day.
+# Each maps its keywords to the LIKE patterns of the column it filters.
+OUTLET_SERVICE_PATTERNS = [
+    (['delivery', 'deliver'], ('%delivery%',)),
+    (['dine-in', 'dine in', 'sit in'], ('%dine%',)),
+    (['takeaway', 'take away', 'pickup', 'take out'], ('%takeaway%',))
+]
+
+# Hours intents become "open at this minute of the day, on any day" via outlet_hours
+OUTLET_HOURS_PATTERNS = [
+    (['open late', 'late night', '24 hour', '24/7'], 23 * 60),
+    (['morning', 'early', 'breakfast'], 8 * 60)
+]
+
+MALL_KEYWORDS = ['mall', 'shopping', 'centre', 'center', 'plaza', 'complex']
+
+OUTLET_MATCHER: Optional[EntityMatcher] = None
+OUTLET_SCHEDULE: Optional[OpenSchedule] = None
+OUTLET_POINTS: Optional[OutletPoints] = None
+
+
+def build_outlet_matcher(outlet_names: List[str]) -> EntityMatcher:
+    """One automaton over outlet names and every text2sql keyword; values rank competing matches"""
+    entries = [("all", keyword, 0) for keyword in LIST_ALL_KEYWORDS]
+    entries += [("outlet", name, rank) for rank, name in enumerate(outlet_names)]
+    for rank, (location, keywords) in enumerate(OUTLET_LOCATION_PATTERNS.items()):
+        entries += [("location", keyword, (rank, location)) for keyword in keywords]
+    for rank, (keywords, patterns) in enumerate(OUTLET_SERVICE_PATTERNS):
+        entries += [("service", keyword, (rank, patterns)) for keyword in keywords]
+    for rank, (keywords, minute) in enumerate(OUTLET_HOURS_PATTERNS):
+        entries += [("hours", keyword, (rank, minute)) for keyword in keywords]
+    entries += [("mall", keyword, 0) for keyword in MALL_KEYWORDS]
+    return EntityMatcher(entries)
+
+
+def load_outlet_names() -> List[str]:
+    try:
+        c = OUTLETS_DB.connection().cursor()
+        c.execute("SELECT DISTINCT name FROM outlets")
+        return [row[0].lower() for row in c.fetchall() if row[0]]
+    except sqlite3.Error as e:
+        logger.warning(f"Could not read outlet names: {e}")
+        return []
+
+
+def rebuild_outlet_matcher():
+    global OUTLET_MATCHER
+    OUTLET_MATCHER = build_outlet_matcher(load_outlet_names())
+    logger.info(f"Outlet matcher rebuilt with {len(OUTLET_MATCHER)} keywords")
+
+
+def get_outlet_matcher() -> EntityMatcher:
+    if OUTLET_MATCHER is None:
+        rebuild_outlet_matcher()
+    return OUTLET_MATCHER
+
+
+def rebuild_outlet_schedule():
+    global OUTLET_SCHEDULE
+    try:
+        c = OUTLETS_DB.connection().cursor()
+        c.execute("SELECT outlet_id, day, open_min, close_min FROM outlet_hours")
+        OUTLET_SCHEDULE = OpenSchedule(c.fetchall())
+        logger.info(f"Opening-hours bitmap rebuilt for {len(OUTLET_SCHEDULE.outlet_ids)} outlets ({OUTLET_SCHEDULE.nbytes()} bytes)")
+    except sqlite3.Error as e:
+        logger.warning(f"Could not read outlet hours: {e}")
+        OUTLET_SCHEDULE = None
+
+
+def rebuild_outlet_points():
+    global OUTLET_POINTS
+    try:
+        c = OUTLETS_DB.connection().cursor()
+        c.execute("SELECT id, lat, lon FROM outlets_geo")
+        OUTLET_POINTS = OutletPoints(c.fetchall())
+    except sqlite3.Error as e:
+        logger.warning(f"Could not read outlet locations: {e}")
+        OUTLET_POINTS = OutletPoints([])
+
+
+def get_outlet_points() -> OutletPoints:
+    if OUTLET_POINTS is None:
+        rebuild_outlet_points()
+    return OUTLET_POINTS
+
+
+def build_outlet_fragments() -> dict:
+    """format_outlet() of every row serialized once, so /outlets bodies are joined from bytes"""
+    try:
+        rows = iter_sql(OUTLETS_DB.connection(), "SELECT * FROM outlets")
+        return {row["id"]: encode_json(format_outlet(row)) for row in rows}
+    except sqlite3.Error as e:
+        logger.warning(f"Could not serialize outlets: {e}")
+        return {}
+
+
+def rebuild_outlet_fragments():
+    global OUTLET_FRAGMENTS
+    OUTLET_FRAGMENTS = build_outlet_fragments()
+
+
+def discard_outlet_fragments(outlet_ids: List[int]):
+    """Drop the fragments of rows about to change; outlet_fragment() serializes those rows itself until the rebuild"""
+    global OUTLET_FRAGMENTS
+    if OUTLET_FRAGMENTS is None or not outlet_ids:
+        return
+    stale = set(outlet_ids)
+    # A new dict, so requests already holding the old one keep a consistent view
+    OUTLET_FRAGMENTS = {outlet_id: fragment for outlet_id, fragment in OUTLET_FRAGMENTS.items() if outlet_id not in stale}
+
+
+def get_outlet_fragments() -> dict:
+    if OUTLET_FRAGMENTS is None:
+        rebuild_outlet_fragments()
+    return OUTLET_FRAGMENTS
+
+
+def refresh_outlet_readers():
+    """Point readers at freshly written outlet rows and rebuild the in-memory structures over them"""
+    global OUTLETS_GENERATION, OUTLET_FRAGMENTS
+    OUTLETS_DB.refresh()
+    rebuild_outlet_matcher()
+    rebuild_outlet_schedule()
+    rebuild_outlet_points()
+    fragments = build_outlet_fragments()
+    # New fragments go live with the generation bump; cached plans and responses
+    # are keyed by generation, so older entries stop matching
+    OUTLET_FRAGMENTS = fragments
+    OUTLETS_GENERATION += 1
+
+
+def open_filter_key(schedule: Optional[OpenSchedule], moment: datetime) -> tuple:
+    """Small hashable identity of the outlets open at moment: the schedule segment, or (day, minute) without the bitmap
+    
+    Every moment inside one segment has the same open set, so responses keyed
+    on it are shared until the next opening or closing time.
+    """
+    day, minute = week_position(moment)
+    if schedule is not None:
+        return ("segment", schedule.segment(day, minute))
+    return ("at", day, minute)
+
+
+def resolve_open_filter(plan: OutletQueryPlan, schedule: Optional[OpenSchedule], open_key: tuple) -> OutletQueryPlan:
+    """Restrict plan to the outlets open_filter_key() described, from the bitmap when loaded, else the interval index"""
+    if open_key[0] == "segment":
+        return plan._replace(outlet_ids=tuple(schedule.segment_ids(open_key[1])))
+    return plan._replace(open_at=open_key[1:])
+
+
+def plan_outlet_query(nl_query: str) -> Optional[OutletQueryPlan]:
+    """Extract a structured query plan from an outlet question, or None when nothing is searchable"""
     q = nl_query.lower().strip()
     
-    if any(word in q for word in ['all', 'show all', 'list all', 'every']):
-        return "SELECT * FROM outlets ORDER BY name"
+    matches = {}
+    for match in get_outlet_matcher().find_all(q):
+        matches.setdefault(match.category, []).append(match)
     
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT name FROM outlets")
-    outlet_names = [row[0].lower() for row in c.fetchall()]
-    conn.close()
+    if "all" in matches:
+        return OutletQueryPlan(entities=(("all", matches["all"][0].keyword),))
     
-    conditions = []
+    entities = []
+    filters = []
     
-    for outlet_name in outlet_names:
-        if outlet_name in q:
-            conditions.append(f"LOWER(name) LIKE '%{outlet_name}%'")
-            break
+    if "outlet" in matches:
+        outlet = min(matches["outlet"], key=lambda match: match.value)
+        entities.append(("outlet", outlet.keyword))
+        filters.append(TermGroup("outlet", ("name",), (f"%{outlet.keyword}%",)))
     
-    location_patterns = {
-        'kuala lumpur': ['kl', 'kuala lumpur', 'wilayah persekutuan'],
-        'selangor': ['selangor', 'shah alam', 'petaling jaya', 'pj'],
-        'putrajaya': ['putrajaya'],
-        'klang': ['klang'],
-        'ampang': ['ampang'],
-        'cheras': ['cheras'],
-        'bangsar': ['bangsar'],
-        'mont kiara': ['mont kiara'],
-        'damansara': ['damansara'],
-        'subang': ['subang'],
-        'bangi': ['bangi'],
-        'cyberjaya': ['cyberjaya'],
-        'setapak': ['setapak'],
-        'kepong': ['kepong'],
-        'puchong': ['puchong']
-    }
+    if "location" in matches:
+        match = min(matches["location"], key=lambda match: match.value)
+        location = match.value[1]
+        entities.append(("location", location))
+        filters.append(TermGroup("location", ("location", "address"), (f"%{location.split()[0]}%",)))
     
-    for location, keywords in location_patterns.items():
-        if any(keyword in q for keyword in keywords):
-            conditions.append(f"LOWER(location) LIKE '%{location.split()[0]}%' OR LOWER(address) LIKE '%{location.split()[0]}%'")
-            break
+    if "service" in matches:
+        match = min(matches["service"], key=lambda match: match.value[0])
+        entities.append(("service", match.keyword))
+        filters.append(TermGroup("service", ("services",), match.value[1]))
     
-    if any(word in q for word in ['delivery', 'deliver']):
-        conditions.append("LOWER(services) LIKE '%delivery%'")
-    elif any(word in q for word in ['dine-in', 'dine in', 'sit in']):
-        conditions.append("LOWER(services) LIKE '%dine%'")
-    elif any(word in q for word in ['takeaway', 'take away', 'pickup', 'take out']):
-        conditions.append("LOWER(services) LIKE '%takeaway%'")
-    
-    if any(word in q for word in ['open late', 'late night', '24 hour', '24/7']):
-        conditions.append("LOWER(hours) LIKE '%24%' OR LOWER(hours) LIKE '%late%' OR LOWER(hours) LIKE '%11pm%' OR LOWER(hours) LIKE '%12am%'")
-    elif any(word in q for word in ['morning', 'early', 'breakfast']):
-        conditions.append("LOWER(hours) LIKE '%6am%' OR LOWER(hours) LIKE '%7am%' OR LOWER(hours) LIKE '%8am%'")
-    
-    mall_keywords = ['mall', 'shopping', 'centre', 'center', 'plaza', 'complex']
-    if any(keyword in q for keyword in mall_keywords):
-        mall_condition = " OR ".join([f"LOWER(address) LIKE '%{keyword}%'" for keyword in mall_keywords])
-        conditions.append(f"({mall_condition})")
-    
-    if conditions:
-        where_clause = " OR ".join(conditions)
-        sql = f"SELECT * FROM outlets WHERE {where_clause} ORDER BY name"
-    else:
-        search_terms = q.split()
-        fuzzy_conditions = []
-        for term in search_terms:
-            if len(term) > 2:
-                fuzzy_conditions.append(f"(LOWER(name) LIKE '%{term}%' OR LOWER(location) LIKE '%{term}%' OR LOWER(address) LIKE '%{term}%')")
-        
-        if fuzzy_conditions:
-            where_clause = " OR ".join(fuzzy_conditions)
-            sql = f"SELECT * FROM outlets WHERE {where_clause} ORDER BY name"
-        else:
-            return ""
+    open_daily_at = None
+    if "hours" in matches:
+        match = min(matches["hours"], key=lambda match: match.value[0])
+        entities.append(("hours", match.keyword))
+        open_daily_at = match.value[1]
+    
+    if "mall" in matches:
+        entities.append(("mall", matches["mall"][0].keyword))
+        filters.append(TermGroup("mall", ("address",), tuple(f"%{keyword}%" for keyword in MALL_KEYWORDS)))
+    
+    if entities:
+        return OutletQueryPlan(entities=tuple(entities), filters=tuple(filters), open_daily_at=open_daily_at)
+    
+    match_query = outlet_fts_query(q)
+    if not match_query:
+        return None
+    return OutletQueryPlan(text=match_query, sort="relevance", limit=OUTLET_SEARCH_LIMIT)
+
+
+def text2sql(nl_query: str) -> str:
+    """The compiled query for nl_query with its parameters inlined ("" when nothing matched)"""
+    plan = plan_outlet_query(nl_query)
+    if plan is None:
+        return ""
     
-    print(f"[DEBUG] Generated SQL: {sql}")
+    sql = render_sql(*compile_plan(plan))
+    if sample_debug(logger):
+        logger.debug("Generated SQL: %s", sql)
     return sql
 
 
-def execute_sql(sql: str) -> List[dict]:
+def iter_sql_chunks(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> Iterator[List[dict]]:
+    """Rows of sql as lists of dicts, one per fetchmany() of OUTLET_FETCH_ROWS"""
+    c = conn.execute(sql, params)
+    columns = [desc[0] for desc in c.description]
+    for rows in iter(lambda: c.fetchmany(OUTLET_FETCH_ROWS), []):
+        yield [dict(zip(columns, row)) for row in rows]
+
+
+def iter_sql(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> Iterator[dict]:
+    """Rows of sql as dicts, pulled from the cursor OUTLET_FETCH_ROWS at a time"""
+    for rows in iter_sql_chunks(conn, sql, params):
+        yield from rows
+
+
+def execute_sql(sql: str, params: tuple = ()) -> List[dict]:
     if not sql:
         return []
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     try:
-        c.execute(sql)
-        rows = c.fetchall()
-        columns = [desc[0] for desc in c.description]
-        results = [dict(zip(columns, row)) for row in rows]
+        results = list(iter_sql(OUTLETS_DB.connection(), sql, params))
     except Exception:
         results = []
-    conn.close()
     return results
 
 
+def stream_outlets_ndjson(sql: str, params: tuple, page_size: Optional[int] = None) -> Iterator[bytes]:
+    """NDJSON lines for the outlets of sql, sent OUTLET_FETCH_ROWS lines per chunk
+    
+    Uses its own connection, since the response is iterated after the request
+    handler returns. With page_size the query must ask for one extra row; if
+    it exists, a final {"next_cursor": ...} line replaces it.
+    """
+    conn = OUTLETS_DB.connect()
+    fragments = get_outlet_fragments()
+    try:
+        lines = []
+        last = None
+        for count, outlet in enumerate(iter_sql(conn, sql, params)):
+            if page_size is not None and count == page_size:
+                lines.append(encode_json({"next_cursor": encode_cursor(last["name"], last["id"])}) + b"\n")
+                break
+            lines.append(outlet_fragment(outlet, fragments) + b"\n")
+            last = outlet
+            if len(lines) >= OUTLET_FETCH_ROWS:
+                yield b"".join(lines)
+                lines = []
+        if lines:
+            yield b"".join(lines)
+    finally:
+        conn.close()
+
+
+def nearby_outlets(lat: float, lon: float, k: int) -> List[dict]:
+    """k outlets nearest to (lat, lon), closest first, each with its distance_km
+    
+    Queries the R*Tree with the bounding box of a circle around the point.
+    Once the box holds k outlets no farther than the radius, nothing outside
+    can be closer; until then the radius grows to the k-th distance found,
+    or 4x when there are fewer than k. Boxes are capped at
+    NEARBY_CANDIDATE_LIMIT outlets: if the first box is over the cap the
+    area is dense and the radius shrinks, and if a grown box goes over it the
+    point is far from every outlet, so the vectorized OutletPoints scan is
+    cheaper than any box that reaches the nearest ones.
+    """
+    conn = OUTLETS_DB.connection()
+    limit = max(NEARBY_CANDIDATE_LIMIT, k)
+    radius = NEARBY_START_RADIUS_KM
+    grown = False
+    while True:
+        candidates = conn.execute(
+            "SELECT id, lat, lon FROM outlets_geo WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ? LIMIT ?",
+            (*bounding_box(lat, lon, radius), limit + 1)
+        ).fetchall()
+        if len(candidates) > limit:
+            if grown or radius < NEARBY_MIN_RADIUS_KM:
+                nearest = get_outlet_points().nearest(lat, lon, k)
+                break
+            radius /= 4
+            continue
+        grown = True
+        nearest = heapq.nsmallest(k, ((haversine_km(lat, lon, p_lat, p_lon), outlet_id) for outlet_id, p_lat, p_lon in candidates))
+        if (len(nearest) == k and nearest[-1][0] <= radius) or radius >= math.pi * EARTH_RADIUS_KM:
+            break
+        radius = nearest[-1][0] if len(nearest) == k else radius * 4
+    
+    rows = execute_sql("SELECT * FROM outlets WHERE id IN (SELECT value FROM json_each(?))", (json.dumps([outlet_id for _, outlet_id in nearest]),))
+    by_id = {row["id"]: row for row in rows}
+    return [dict(by_id[outlet_id], distance_km=round(distance, 3)) for distance, outlet_id in nearest if outlet_id in by_id]
+
+
 # --- FastAPI App ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    print("[STARTUP] Initializing ZUS Coffee API...")
-    ingest_product_docs_from_csv()
+    logger.info("Initializing ZUS Coffee API...")
+    ingest_product_docs_from_csv(PRODUCT_CSV_FILE)
     ingest_outlets_from_web()
-    print("[STARTUP] API initialization complete!")
+    
+    stop_watcher = threading.Event()
+    if PRODUCT_WATCH_INTERVAL > 0:
+        threading.Thread(
+            target=watch_product_csv, args=(stop_watcher, PRODUCT_WATCH_INTERVAL), daemon=True
+        ).start()
+        logger.info(f"Watching {PRODUCT_CSV_FILE} for changes every {PRODUCT_WATCH_INTERVAL}s")
+    
+    logger.info("API initialization complete!")
     yield
-    # Shutdown (if needed)
+    # Shutdown
+    stop_watcher.set()
 
 app = FastAPI(
     title="ZUS Coffee API",
     description="Product KB and Outlets Text2SQL endpoints",
     version="1.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
+app.add_middleware(MetricsMiddleware, requests=HTTP_REQUESTS, latency=HTTP_REQUEST_SECONDS, exclude=("/metrics",))
+
+
+def offload(method: str, path: str, executor: BoundedExecutor):
+    """Register a sync handler as an async route that runs it on executor instead of Starlette's shared threadpool
+
+    When executor is full the route answers 503 with Retry-After at once.
+    Otherwise the response carries a Server-Timing header with the time spent
+    waiting for a worker (queue) apart from the handler's own time (service).
+    The handler itself is returned unchanged and stays directly callable.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def endpoint(*args, **kwargs):
+            try:
+                result, timing = await executor.run(handler, *args, **kwargs)
+            except ExecutorSaturated as e:
+                raise overloaded(e)
+            return with_server_timing(result, timing)
+        
+        app.add_api_route(path, endpoint, methods=[method])
+        return handler
+    return decorator
+
+
+def overloaded(e: ExecutorSaturated) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def with_server_timing(result, timing, batch_wait: Optional[float] = None) -> Response:
+    """result as a Response whose Server-Timing header splits batch, queue and service time"""
+    if isinstance(result, Response):
+        response = result
+    else:
+        with STAGE_SECONDS.time("serialize"):
+            response = FastJSONResponse(result)
+    metrics = [] if batch_wait is None else [f"batch;dur={batch_wait * 1000:.2f}"]
+    metrics += [f"queue;dur={timing.queue_wait * 1000:.2f}", f"service;dur={timing.service * 1000:.2f}"]
+    response.headers["Server-Timing"] = ", ".join(metrics)
+    return response
+
+
+def require_product_state() -> ProductSearchState:
+    try:
+        state = ensure_product_state(PRODUCT_READY_TIMEOUT)
+        if state is None:
+            raise ProductSearchNotReady("Product search system failed to initialize")
+        return state
+    except ProductSearchNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+
+def product_response_json(state: ProductSearchState, query: str, results: List[ProductDoc]) -> bytes:
+    """/products response body, assembled from the products' pre-serialized fragments"""
+    if results:
+        summary = generate_product_summary(results, query)
+    else:
+        summary = "No relevant drinkware products found for your query."
+    
+    fragments = []
+    for doc in results:
+        slot = state.slots.get(doc.id)
+        # A product replaced since the search ran is serialized from the doc that was found
+        if slot is not None and state.docs[slot] is doc:
+            fragments.append(state.fragments[slot])
+        else:
+            fragments.append(product_fragment(doc))
+    
+    return (
+        b'{"summary":' + encode_json(summary)
+        + b',"results":' + join_array(fragments)
+        + b',"query":' + encode_json(query)
+        + b',"total_found":' + str(len(results)).encode("ascii") + b"}"
+    )
+
+
+def search_product_responses(items: List[tuple]) -> List[bytes]:
+    """product_response_json() for each (query, k, product_filter), searched as one batch"""
+    state = require_product_state()
+    queries = [query for query, _, _ in items]
+    batch_results = search_products_batch(
+        queries, [k for _, k, _ in items], [product_filter for _, _, product_filter in items], state
+    )
+    with STAGE_SECONDS.time("serialize"):
+        return [product_response_json(state, query, results) for query, results in zip(queries, batch_results)]
+
+
+def json_bytes_response(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+
+async def run_product_batch(items: List[tuple]):
+    return await PRODUCT_EXECUTOR.run(search_product_responses, items)
+
+
+PRODUCT_BATCHER = MicroBatcher(run_product_batch, PRODUCT_BATCH_WINDOW_MS / 1000, PRODUCT_BATCH_MAX)
 
 
 @app.get("/products")
-def get_products(
+async def get_products(
     query: str = Query(..., description="User question about drinkware"), 
-    k: int = Query(2, description="Number of top products to return")
+    k: int = Query(2, ge=1, le=PRODUCT_MAX_K, description="Number of top products to return"),
+    min_price: Optional[float] = Query(None, description="Minimum price in RM"),
+    max_price: Optional[float] = Query(None, description="Maximum price in RM"),
+    in_stock: Optional[bool] = Query(None, description="Only products that are (or are not) available"),
+    tag: Optional[List[str]] = Query(None, description="Only products with any of these tags (repeatable)")
 ):
     try:
-        results = search_products(query, k)
-        
-        if not results:
-            return {
-                "summary": "No relevant drinkware products found for your query.",
-                "results": [],
-                "query": query,
-                "total_found": 0
-            }
-        
-        summary = generate_product_summary(results, query)
-        
-        product_results = []
-        for doc in results:
-            product_results.append({
-                "id": doc.id,
-                "title": doc.title,
-                "description": doc.description
-            })
+        product_filter = ProductFilter.create(min_price, max_price, in_stock, tag)
+        body, timing, batch_wait = await PRODUCT_BATCHER.submit((query, k, product_filter))
+        return with_server_timing(json_bytes_response(body), timing, batch_wait)
         
+    except ExecutorSaturated as e:
+        raise overloaded(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Product search failed: {e}")
         return {
-            "summary": summary,
-            "results": product_results,
+            "summary": "An error occurred while searching for products.",
+            "results": [],
             "query": query,
-            "total_found": len(results)
+            "error": str(e),
+            "total_found": 0
         }
+
+
+@offload("POST", "/products/batch", PRODUCT_EXECUTOR)
+def get_products_batch(request: ProductBatchRequest):
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many queries in one batch (max {MAX_BATCH_QUERIES})"
+        )
+    
+    try:
+        bodies = search_product_responses([
+            (item.query, item.k, ProductFilter.create(item.min_price, item.max_price, item.in_stock, item.tags))
+            for item in request.queries
+        ])
+        return json_bytes_response(
+            b'{"results":' + join_array(bodies) + b',"total_queries":' + str(len(bodies)).encode("ascii") + b"}"
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"[ERROR] Product search failed: {e}")
+        logger.error(f"Batch product search failed: {e}")
         return {
-            "summary": "An error occurred while searching for products.",
             "results": [],
-            "query": query,
             "error": str(e),
-            "total_found": 0
+            "total_queries": len(request.queries)
         }
 
 
-@app.get("/outlets")
+@app.post("/admin/products/reload")
+def reload_products(x_admin_token: Optional[str] = Header(None)):
+    # Fail closed: without P4_ADMIN_TOKEN the endpoint is disabled
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set P4_ADMIN_TOKEN")
+    if not secrets.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    
+    try:
+        return reload_products_from_csv()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"CSV file {PRODUCT_CSV_FILE} not found")
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+def format_outlet(outlet: dict) -> dict:
+    formatted_outlet = {
+        "id": outlet.get("id"),
+        "name": outlet.get("name"),
+        "location": outlet.get("location"),
+        "address": outlet.get("address"),
+        "hours": outlet.get("hours"),
+        "services": outlet.get("services")
+    }
+    for optional in ("direction_link", "snippet", "distance_km"):
+        if outlet.get(optional) not in (None, ""):
+            formatted_outlet[optional] = outlet[optional]
+    return formatted_outlet
+
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    return {
+        "product_queries": QUERY_CACHE.stats(),
+        "outlet_plans": OUTLET_PLAN_CACHE.stats(),
+        "outlet_responses": OUTLET_RESPONSE_CACHE.stats(),
+        "outlets_generation": OUTLETS_GENERATION
+    }
+
+
+@app.get("/executors/stats")
+def get_executor_stats():
+    return {
+        "products": PRODUCT_EXECUTOR.stats(),
+        "outlets": OUTLET_EXECUTOR.stats(),
+        "product_batches": PRODUCT_BATCHER.stats()
+    }
+
+
+def count_outlets() -> Optional[int]:
+    try:
+        return OUTLETS_DB.connection().execute("SELECT COUNT(*) FROM outlets").fetchone()[0]
+    except sqlite3.Error:
+        return None
+
+
+def cache_stat(field: str) -> dict:
+    caches = {"product_queries": QUERY_CACHE, "outlet_plans": OUTLET_PLAN_CACHE, "outlet_responses": OUTLET_RESPONSE_CACHE}
+    return {(name,): cache.stats()[field] for name, cache in caches.items()}
+
+
+METRICS.gauge(
+    "p4_product_index_vectors", "Vectors in the product index",
+    lambda: PRODUCT_STATE.index.ntotal if PRODUCT_STATE is not None else None
+)
+METRICS.gauge(
+    "p4_products", "Live products in the catalog",
+    lambda: int(PRODUCT_STATE.columns.live.sum()) if PRODUCT_STATE is not None else None
+)
+METRICS.gauge("p4_outlets", "Outlets in the outlet database", count_outlets)
+METRICS.gauge("p4_cache_hit_ratio", "Hits over lookups since startup, per cache", lambda: cache_stat("hit_ratio"), ("cache",))
+METRICS.gauge("p4_cache_entries", "Entries held, per cache", lambda: cache_stat("size"), ("cache",))
+METRICS.gauge(
+    "p4_executor_in_flight", "Requests running or queued, per executor",
+    lambda: {(executor.name,): executor.in_flight for executor in (PRODUCT_EXECUTOR, OUTLET_EXECUTOR)}, ("executor",)
+)
+METRICS.gauge("p4_log_records_dropped", "Log records dropped because the log queue was full", dropped_records)
+
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@offload("GET", "/outlets/nearby", OUTLET_EXECUTOR)
+def get_nearby_outlets(
+    lat: float = Query(..., ge=-90, le=90, description="Latitude of the user"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude of the user"),
+    k: int = Query(5, ge=1, le=NEARBY_MAX_K, description="Number of outlets to return")
+):
+    try:
+        with STAGE_SECONDS.time("nearby"):
+            results = nearby_outlets(lat, lon, k)
+    except sqlite3.Error as e:
+        logger.error(f"Nearby outlets query failed: {e}")
+        raise HTTPException(status_code=503, detail="Outlet locations are not available yet")
+    return {
+        "results": [format_outlet(outlet) for outlet in results],
+        "lat": lat,
+        "lon": lon,
+        "total_found": len(results)
+    }
+
+
+def json_response_with_query(query: str, body: bytes) -> Response:
+    """Prefix a cached JSON object body with the caller's own "query" field"""
+    return json_bytes_response(b'{"query":' + encode_json(query) + b"," + body[1:])
+
+
+def outlet_fragment(outlet: dict, fragments: dict) -> bytes:
+    fragment = fragments.get(outlet["id"])
+    if fragment is None:
+        return encode_json(format_outlet(outlet))
+    if outlet.get("snippet"):
+        return with_field(fragment, "snippet", outlet["snippet"])
+    return fragment
+
+
+def outlet_results_json(sql: str, params: tuple, page_size: Optional[int], paged: bool) -> bytes:
+    """/outlets response body for a compiled query, minus the "query" echo so phrasings that compile alike share it
+    
+    Rows are serialized as they are fetched, never collected. With page_size
+    the query must ask for one extra row, which only sets next_cursor.
+    total_found counts the outlets in this body: with limit/cursor, the page.
+    """
+    sql_executed = render_sql(sql, params)
+    fragments = get_outlet_fragments()
+    chunks = iter_sql_chunks(OUTLETS_DB.connection(), sql, params)
+    found = 0
+    last = None
+    has_more = False
+    fetch_seconds = 0.0
+    
+    def page_fragments():
+        nonlocal found, last, has_more, fetch_seconds
+        while True:
+            start = time.perf_counter()
+            rows = next(chunks, None)
+            fetch_seconds += time.perf_counter() - start
+            if rows is None:
+                return
+            for row in rows:
+                if page_size is not None and found == page_size:
+                    has_more = True
+                    return
+                found += 1
+                last = row
+                yield outlet_fragment(row, fragments)
+    
+    # Fetching and serializing interleave; the fetches are timed apart as the sqlite stage
+    start = time.perf_counter()
+    results = join_array(page_fragments())
+    if not found:
+        body = encode_json({
+            "results": [],
+            "error": "No outlets found for your query.",
+            "sql_executed": sql_executed,
+            "total_found": 0
+        })
+    else:
+        body = (
+            b'{"results":' + results
+            + b',"sql_executed":' + encode_json(sql_executed)
+            + b',"total_found":' + str(found).encode("ascii")
+        )
+        if paged:
+            next_cursor = encode_cursor(last["name"], last["id"]) if has_more else None
+            body += b',"next_cursor":' + encode_json(next_cursor)
+        body += b"}"
+    STAGE_SECONDS.observe(fetch_seconds, "sqlite")
+    STAGE_SECONDS.observe(time.perf_counter() - start - fetch_seconds, "serialize")
+    return body
+
+
+@offload("GET", "/outlets", OUTLET_EXECUTOR)
 def get_outlets(
-    query: str = Query(..., description="Natural language query about outlets")
+    query: str = Query(..., description="Natural language query about outlets"),
+    open_now: bool = Query(False, description="Only outlets open right now (Malaysia time)"),
+    open_at: Optional[datetime] = Query(None, description="Only outlets open at this time; naive times are Malaysia time"),
+    limit: Optional[int] = Query(
+        None, ge=1, le=OUTLET_PAGE_MAX,
+        description="Page size; the response carries next_cursor, and total_found counts this page only"
+    ),
+    cursor: Optional[str] = Query(None, description=f"next_cursor of the previous page (pages of {OUTLET_PAGE_MAX} without limit)"),
+    accept: Optional[str] = Header(None)
 ):
     try:
-        sql = text2sql(query)
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    generation = OUTLETS_GENERATION
+    try:
+        normalized = normalize_query(query)
+        plan = OUTLET_PLAN_CACHE.get((generation, normalized), _NOT_CACHED)
+        if plan is _NOT_CACHED:
+            with STAGE_SECONDS.time("text2sql"):
+                plan = plan_outlet_query(normalized)
+            OUTLET_PLAN_CACHE.put((generation, normalized), plan)
         
-        if not sql:
+        # Resolved into an id list only on a response cache miss; the key stays small
+        schedule = OUTLET_SCHEDULE
+        open_key = None
+        if plan is not None and (open_now or open_at is not None):
+            open_key = open_filter_key(schedule, open_at or local_now())
+        
+        page_size = None
+        if plan is not None and plan.sort == "name" and (limit is not None or after is not None):
+            # One row past the page tells whether there is a next one
+            page_size = limit or OUTLET_PAGE_MAX
+            plan = plan._replace(after=after, limit=page_size + 1)
+        elif plan is not None and after is not None:
+            raise HTTPException(status_code=400, detail="cursor is only supported for name-ordered results")
+        elif plan is not None and limit is not None:
+            plan = plan._replace(limit=min(plan.limit or limit, limit))
+        
+        if plan is None:
             return {
                 "results": [],
                 "error": "Could not translate query to SQL. Try queries like 'outlets in KL', 'SS 2', or 'all outlets'.",
@@ -437,41 +1765,25 @@ def get_outlets(
                 ]
             }
         
-        results = execute_sql(sql)
-        
-        if not results:
-            return {
-                "results": [],
-                "error": "No outlets found for your query.",
-                "query": query,
-                "sql_executed": sql,
-                "total_found": 0
-            }
+        def compiled():
+            return compile_plan(resolve_open_filter(plan, schedule, open_key) if open_key else plan)
         
-        formatted_results = []
-        for outlet in results:
-            formatted_outlet = {
-                "id": outlet.get("id"),
-                "name": outlet.get("name"),
-                "location": outlet.get("location"),
-                "address": outlet.get("address"),
-                "hours": outlet.get("hours"),
-                "services": outlet.get("services")
-            }
-            if outlet.get("direction_link"):
-                formatted_outlet["direction_link"] = outlet.get("direction_link")
-            
-            formatted_results.append(formatted_outlet)
+        if accept and NDJSON_MEDIA_TYPE in accept:
+            return StreamingResponse(stream_outlets_ndjson(*compiled(), page_size), media_type=NDJSON_MEDIA_TYPE)
         
-        return {
-            "results": formatted_results,
-            "query": query,
-            "sql_executed": sql,
-            "total_found": len(results)
-        }
+        paged = limit is not None or after is not None
+        # entities only describe the question; phrasings that compile alike share an entry
+        cache_key = (generation, plan._replace(entities=()), open_key, page_size, paged)
+        body = OUTLET_RESPONSE_CACHE.get(cache_key)
+        if body is None:
+            body = outlet_results_json(*compiled(), page_size, paged)
+            OUTLET_RESPONSE_CACHE.put(cache_key, body)
+        return json_response_with_query(query, body)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"[ERROR] Outlets query failed: {e}")
+        logger.error(f"Outlets query failed: {e}")
         return {
             "results": [],
             "error": f"An error occurred while processing your query: {str(e)}",
@@ -486,9 +1798,7 @@ def chatbot_call_products(user_query):
     try:
         return resp.json()
     except Exception as e:
-        print(f"[ERROR] Could not decode JSON from /products endpoint. Status: {resp.status_code}")
-        print(f"Response text: {resp.text}")
-        print(f"Exception: {e}")
+        logger.error(f"Could not decode JSON from /products endpoint. Status: {resp.status_code}, response: {resp.text!r}, exception: {e}")
         return {"error": "Invalid response from /products endpoint", "details": str(e), "response_text": resp.text}
 
 
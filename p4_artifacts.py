@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import weakref
+from contextlib import contextmanager
+
+import numpy as np
+import faiss
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+EMBEDS_FILE = "embeds.npy"
+INDEX_FILE = "index.faiss"
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+ARTIFACT_FORMAT = 2
+
+# Indexes whose storage is a read-only mapping of an artifact file
+_MAPPED_INDEXES = weakref.WeakSet()
+
+
+def compute_artifact_key(docs, model_name: str, model_version: str, index_type: str = "flat") -> str:
+    """Content hash of the ingested product rows plus the embedding model and index identity"""
+    digest = hashlib.sha256()
+    digest.update(f"{ARTIFACT_FORMAT}\x1f{model_name}\x1f{model_version}\x1f{index_type}\x1e".encode("utf-8"))
+    for doc in docs:
+        digest.update(f"{doc.id}\x1f{doc.title}\x1f{doc.description}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+
+@contextmanager
+def artifact_lock(artifact_dir: str):
+    """Exclusive lock across processes sharing artifact_dir (no-op where flock is unavailable)"""
+    try:
+        os.makedirs(artifact_dir, exist_ok=True)
+        lock_file = open(os.path.join(artifact_dir, LOCK_FILE), "a")
+    except OSError:
+        yield
+        return
+
+    with lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_artifacts(artifact_dir: str, key: str):
+    """Return (embeds, index) memory-mapped from disk, or None on a cache miss
+
+    The mappings are read-only, so processes loading the same key share their
+    pages. A process that later changes the catalog copies the index into
+    private memory first (see is_memory_mapped) and stops sharing it.
+    """
+    path = os.path.join(artifact_dir, key)
+    embeds_path = os.path.join(path, EMBEDS_FILE)
+    index_path = os.path.join(path, INDEX_FILE)
+    if not (os.path.exists(embeds_path) and os.path.exists(index_path)):
+        return None
+
+    embeds = np.load(embeds_path, mmap_mode="r")
+    mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    try:
+        index = faiss.read_index(index_path, mmap_flag)
+        _MAPPED_INDEXES.add(index)
+    except RuntimeError:
+        index = faiss.read_index(index_path)
+    return embeds, index
+
+
+def is_memory_mapped(index) -> bool:
+    """Whether index was loaded by load_artifacts as a shared read-only mapping"""
+    return index in _MAPPED_INDEXES
+
+
+def save_artifacts(artifact_dir: str, key: str, embeds, index, meta=None):
+    """Write embeddings and index for key, publishing the directory atomically"""
+    os.makedirs(artifact_dir, exist_ok=True)
+    final_path = os.path.join(artifact_dir, key)
+    tmp_path = tempfile.mkdtemp(prefix=f".{key[:12]}-", dir=artifact_dir)
+    try:
+        np.save(os.path.join(tmp_path, EMBEDS_FILE), np.ascontiguousarray(embeds, dtype="float32"))
+        faiss.write_index(index, os.path.join(tmp_path, INDEX_FILE))
+        with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta or {}, f, indent=2)
+        if os.path.exists(final_path):
+            shutil.rmtree(tmp_path)
+            return final_path
+        os.rename(tmp_path, final_path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return final_path
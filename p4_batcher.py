@@ -0,0 +1,76 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Tuple
+
+
+class MicroBatcher:
+    """Coalesces concurrent submit() calls into one run_batch call
+
+    Items submitted within `window` seconds of the first pending one (or until
+    max_batch are pending) are handed to run_batch together; each caller gets
+    back its own element of the result list plus how long it waited for the
+    batch to close. A window of 0 runs every item on its own. If run_batch
+    raises, every caller in that batch sees the exception.
+
+    run_batch is an async callable taking the list of items and returning
+    (results, extra), results aligned with the items and extra passed through
+    to every caller (e.g. executor timings). Not thread-safe: submit() must
+    be awaited on the event loop that owns the batcher's pending items.
+    """
+
+    def __init__(self, run_batch: Callable[[list], Awaitable[Tuple[list, object]]], window: float, max_batch: int):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._pending = []
+        self._timer = None
+        self._running = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item) -> Tuple[object, object, float]:
+        """(result, extra, seconds spent waiting for the batch to close) for item"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        if self.window <= 0 or len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        # The event loop only keeps weak references to tasks
+        task = asyncio.ensure_future(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[tuple]):
+        closed = time.perf_counter()
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results, extra = await self.run_batch([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, submitted), result in zip(batch, results):
+            if not future.done():
+                future.set_result((result, extra, closed - submitted))
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0
+        }
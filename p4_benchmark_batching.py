@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Measure the /products micro-batcher: throughput against latency per batch window.
+
+--clients closed-loop clients each send their next query as soon as the
+previous one is answered, through p4.PRODUCT_BATCHER (the same path as
+GET /products, minus HTTP). For every window in --windows the batcher
+coalesces whatever arrives within it, up to --max-batch queries, into one
+encode and one index search on PRODUCT_EXECUTOR. A window of 0 is the
+unbatched baseline: one encode per request.
+
+The query cache is disabled and queries are phrased so that BM25 never
+answers them alone, so every request reaches the embedding model.
+
+    python p4_benchmark_batching.py --clients 32 --duration 5 --windows 0,1,2,5,10
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+import p4
+from p4_cache import LRUCache
+from p4_executor import ExecutorSaturated
+
+
+TEMPLATES = [
+    "something like the {} for my desk", "a gift similar to {}", "is there a {} for cold drinks",
+    "{} but for hot coffee", "what goes well with {}", "cheaper alternative to {}"
+]
+
+
+def build_queries(count, seed=0):
+    rng = random.Random(seed)
+    titles = [" ".join(doc.title.split()[:3]) for doc in p4.PRODUCT_DOCS if doc is not None]
+    return [rng.choice(TEMPLATES).format(rng.choice(titles).lower()) for _ in range(count)]
+
+
+async def run_clients(queries, clients, duration):
+    latencies, rejected = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def client(offset):
+        nonlocal rejected
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                await p4.PRODUCT_BATCHER.submit((queries[i % len(queries)], 2, None))
+                latencies.append((time.perf_counter() - start) * 1000)
+            except ExecutorSaturated as e:
+                rejected += 1
+                await asyncio.sleep(e.retry_after / 100)
+            i += clients
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(offset) for offset in range(clients)))
+    return latencies, rejected, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent closed-loop clients")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per window setting")
+    parser.add_argument("--windows", default="0,1,2,5,10", help="Comma-separated batch windows in ms")
+    parser.add_argument("--max-batch", type=int, default=p4.PRODUCT_BATCH_MAX, help="Queries per batch at most")
+    args = parser.parse_args()
+
+    p4.ingest_product_docs_from_csv(p4.PRODUCT_CSV_FILE)
+    p4.QUERY_CACHE = LRUCache(maxsize=0)
+    queries = build_queries(1000)
+
+    print(f"\n{args.clients} clients, {p4.PRODUCT_EXECUTOR.max_workers} product workers, max batch {args.max_batch}")
+    print(f"{'window ms':>9} {'req/s':>8} {'batch':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rejected':>9}")
+    for window in [float(w) for w in args.windows.split(",")]:
+        p4.PRODUCT_BATCHER.window = window / 1000
+        p4.PRODUCT_BATCHER.max_batch = args.max_batch
+        p4.PRODUCT_BATCHER.batches = p4.PRODUCT_BATCHER.items = 0
+        latencies, rejected, elapsed = asyncio.run(run_clients(queries, args.clients, args.duration))
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0.0, 0.0, 0.0)
+        batch = p4.PRODUCT_BATCHER.stats()["mean_batch_size"]
+        print(f"{window:>9.1f} {len(latencies) / elapsed:>8.1f} {batch:>6.1f} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f} {rejected:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Compare the torch (SentenceTransformer) and int8 ONNX embedding backends used by p4.
+
+Each backend runs in its own subprocess so resident memory is measured in
+isolation. Reports model load time, RSS after loading and after encoding,
+single-query and batch-of-32 latency, and cosine parity between backends.
+
+    python p4_onnx.py                # export the int8 model once
+    python p4_benchmark_embedding.py --queries 200
+"""
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_texts(csv_file):
+    queries = ["tumbler", "cold drink container", "travel mug", "stainless steel", "ceramic", "OG CUP 2.0 500ml"]
+    with open(csv_file, "r", encoding="utf-8") as f:
+        products = [f"{row['title']}. {' '.join(row['description'].split())}" for row in csv.DictReader(f)]
+    return queries, products
+
+
+def run_child(backend, args):
+    os.environ["P4_EMBEDDING_BACKEND"] = backend
+    baseline_rss = rss_mb()
+    start = time.perf_counter()
+    import p4
+    model = p4.load_embedding_model()
+    load_seconds = time.perf_counter() - start
+    loaded_rss = rss_mb()
+
+    queries, products = load_texts(args.csv)
+    model.encode(queries[:1], convert_to_numpy=True)
+
+    single = []
+    for i in range(args.queries):
+        query = queries[i % len(queries)]
+        t0 = time.perf_counter()
+        model.encode([query], convert_to_numpy=True)
+        single.append((time.perf_counter() - t0) * 1000)
+
+    batch_queries = [queries[i % len(queries)] for i in range(32)]
+    batch = []
+    for _ in range(max(1, args.queries // 32)):
+        t0 = time.perf_counter()
+        model.encode(batch_queries, convert_to_numpy=True)
+        batch.append((time.perf_counter() - t0) * 1000)
+
+    embeds = model.encode(queries + products, convert_to_numpy=True)
+    np.save(args.output, np.asarray(embeds, dtype="float32"))
+
+    print(json.dumps({
+        "backend": backend,
+        "load_s": load_seconds,
+        "rss_baseline_mb": baseline_rss,
+        "rss_loaded_mb": loaded_rss,
+        "rss_final_mb": rss_mb(),
+        "single_p50_ms": float(np.percentile(single, 50)),
+        "single_p95_ms": float(np.percentile(single, 95)),
+        "batch32_p50_ms": float(np.percentile(batch, 50))
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="torch,onnx", help="Comma-separated backends to compare")
+    parser.add_argument("--queries", type=int, default=200, help="Timed single-query encodes per backend")
+    parser.add_argument("--csv", default="zus_drinkware_products.csv", help="Product CSV used for parity texts")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args)
+        return
+
+    results = []
+    embeddings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backends.split(","):
+            output = os.path.join(tmp, f"{backend}.npy")
+            proc = subprocess.run(
+                [sys.executable, __file__, "--child", backend, "--output", output,
+                 "--queries", str(args.queries), "--csv", args.csv],
+                capture_output=True, text=True
+            )
+            if proc.returncode != 0:
+                print(f"FAIL {backend}: {proc.stderr.strip().splitlines()[-1] if proc.stderr else proc.returncode}")
+                continue
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            embeddings[backend] = np.load(output)
+
+    print(f"{'backend':<8} {'load s':>7} {'RSS MB':>8} {'+model MB':>10} {'1q p50':>8} {'1q p95':>8} {'32q p50':>8}")
+    for r in results:
+        print(
+            f"{r['backend']:<8} {r['load_s']:>7.2f} {r['rss_final_mb']:>8.0f} "
+            f"{r['rss_loaded_mb'] - r['rss_baseline_mb']:>10.0f} {r['single_p50_ms']:>8.2f} "
+            f"{r['single_p95_ms']:>8.2f} {r['batch32_p50_ms']:>8.2f}"
+        )
+
+    if "torch" in embeddings and "onnx" in embeddings:
+        a, b = embeddings["torch"], embeddings["onnx"]
+        cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+        print(f"\nCosine parity torch vs onnx: min {cosine.min():.4f}, mean {cosine.mean():.4f} over {len(cosine)} texts")
+
+
+if __name__ == "__main__":
+    main()
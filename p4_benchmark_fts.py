@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Compare the free-text outlet search of text2sql before and after the FTS5 index.
+
+  like - the previous OR-chain of LOWER(col) LIKE '%term%' ordered by name
+         (a full table scan with three LOWER() calls per row and term)
+  fts  - outlets_fts MATCH with bm25() ordering and snippet() highlighting
+
+The outlet CSV is multiplied into a temporary database of --rows synthetic
+outlets (names and addresses get a numeric suffix so rows stay distinct).
+
+    python p4_benchmark_fts.py --rows 50000 --repeat 20
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+import p4
+from p4_sqlite import SQLiteReadPool
+
+
+QUERIES = ["sunway pyramid", "jalan ipoh", "taman desa", "pavilion bukit jalil", "seksyen 13", "menara", "xyzzy"]
+
+
+def like_sql(q):
+    conditions = [
+        f"(LOWER(name) LIKE '%{term}%' OR LOWER(location) LIKE '%{term}%' OR LOWER(address) LIKE '%{term}%')"
+        for term in q.split() if len(term) > 2
+    ]
+    return f"SELECT * FROM outlets WHERE {' OR '.join(conditions)} ORDER BY name"
+
+
+def prepare_database(path, rows):
+    p4.DB_PATH = path
+    p4.OUTLETS_DB = SQLiteReadPool(path)
+    p4.ingest_outlets_from_csv()
+
+    conn = sqlite3.connect(path)
+    base = conn.execute("SELECT COUNT(*) FROM outlets").fetchone()[0]
+    copy = 0
+    while conn.execute("SELECT COUNT(*) FROM outlets").fetchone()[0] < rows:
+        copy += 1
+        conn.execute(
+            "INSERT INTO outlets (name, location, address, hours, services, direction_link) "
+            "SELECT name || ' ' || ?1, location, address || ' Lot ' || ?1, hours, services, direction_link "
+            "FROM outlets WHERE id <= ?2 LIMIT ?3",
+            (copy, base, rows - conn.execute("SELECT COUNT(*) FROM outlets").fetchone()[0])
+        )
+    p4.rebuild_outlet_fts(conn.cursor())
+    conn.commit()
+    conn.execute("VACUUM")
+    total = conn.execute("SELECT COUNT(*) FROM outlets").fetchone()[0]
+    conn.close()
+    p4.OUTLETS_DB.refresh()
+    return total
+
+
+def measure(conn, sql, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = conn.execute(sql).fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return len(rows), np.percentile(latencies, [50, 95])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000, help="Synthetic outlet count")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per query and mode")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        total = prepare_database(os.path.join(tmp, "outlets.db"), args.rows)
+        conn = p4.OUTLETS_DB.connection()
+
+        print(f"\n{total} outlets")
+        print(f"{'query':<22} {'mode':<5} {'rows':>6} {'p50 ms':>9} {'p95 ms':>9}")
+        for query in QUERIES:
+            for mode, sql in (("like", like_sql(query)), ("fts", p4.outlet_fts_sql(query))):
+                count, (p50, p95) = measure(conn, sql, args.repeat)
+                print(f"{query:<22} {mode:<5} {count:>6} {p50:>9.2f} {p95:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Measure /outlets/nearby lookups against a linear scan.
+
+  scan  - haversine distance to every geocoded outlet, then the k smallest
+  rtree - p4.nearby_outlets(): R*Tree box queries over a growing radius,
+          falling back to the vectorized OutletPoints scan for far points
+
+The outlet CSV is multiplied into a temporary database of --rows synthetic
+outlets, each placed up to ~3 km from its postcode centroid so that points
+do not coincide. Query points are drawn around Klang Valley plus a few far
+away ones (Penang, Johor Bahru) that force the radius to grow.
+
+    python p4_benchmark_geo.py --rows 50000 --repeat 200 --k 5
+"""
+
+import argparse
+import heapq
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+import p4
+from p4_geo import haversine_km
+from p4_sqlite import SQLiteReadPool
+
+
+FAR_POINTS = [(5.4141, 100.3288), (1.4927, 103.7414)]
+
+
+def prepare_database(path, rows, seed=0):
+    p4.DB_PATH = path
+    p4.OUTLETS_DB = SQLiteReadPool(path)
+    p4.ingest_outlets_from_csv()
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    base = conn.execute("SELECT id, lat, lon FROM outlets_geo").fetchall()
+    next_id = conn.execute("SELECT MAX(id) FROM outlets").fetchone()[0] + 1
+    outlets, points = [], []
+    for outlet_id in range(next_id, next_id + rows - len(base)):
+        source_id, lat, lon = rng.choice(base)
+        lat, lon = lat + rng.uniform(-0.03, 0.03), lon + rng.uniform(-0.03, 0.03)
+        outlets.append((outlet_id, f"Synthetic {outlet_id}", f"Copy of outlet {source_id}"))
+        points.append((outlet_id, lat, lat, lon, lon, lat, lon))
+    conn.executemany("INSERT INTO outlets (id, name, address) VALUES (?, ?, ?)", outlets)
+    conn.executemany("INSERT INTO outlets_geo (id, min_lat, max_lat, min_lon, max_lon, lat, lon) VALUES (?, ?, ?, ?, ?, ?, ?)", points)
+    conn.commit()
+    total = conn.execute("SELECT COUNT(*) FROM outlets_geo").fetchone()[0]
+    conn.close()
+    p4.refresh_outlet_readers()
+    return total
+
+
+def scan_nearest(points, lat, lon, k):
+    return heapq.nsmallest(k, ((haversine_km(lat, lon, p_lat, p_lon), outlet_id) for outlet_id, p_lat, p_lon in points))
+
+
+def measure(fn, queries, repeat):
+    latencies = []
+    for i in range(repeat):
+        lat, lon = queries[i % len(queries)]
+        start = time.perf_counter()
+        fn(lat, lon)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, [50, 95, 99])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000, help="Synthetic outlet count")
+    parser.add_argument("--repeat", type=int, default=200, help="Timed lookups per mode")
+    parser.add_argument("--k", type=int, default=5, help="Outlets per lookup")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    queries = [(rng.uniform(2.9, 3.3), rng.uniform(101.4, 101.8)) for _ in range(50)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        total = prepare_database(os.path.join(tmp, "outlets.db"), args.rows)
+        points = p4.OUTLETS_DB.connection().execute("SELECT id, lat, lon FROM outlets_geo").fetchall()
+
+        for lat, lon in queries[:10] + FAR_POINTS:
+            expected = [round(d, 3) for d, _ in scan_nearest(points, lat, lon, args.k)]
+            assert [outlet["distance_km"] for outlet in p4.nearby_outlets(lat, lon, args.k)] == expected
+
+        print(f"\n{total} geocoded outlets, k={args.k}")
+        print(f"{'mode':<6} {'points':<6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for label, sample in (("local", queries), ("far", FAR_POINTS)):
+            for mode, fn in (
+                ("scan", lambda lat, lon: scan_nearest(points, lat, lon, args.k)),
+                ("rtree", lambda lat, lon: p4.nearby_outlets(lat, lon, args.k))
+            ):
+                p50, p95, p99 = measure(fn, sample, args.repeat)
+                print(f"{mode:<6} {label:<6} {p50:>9.3f} {p95:>9.3f} {p99:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
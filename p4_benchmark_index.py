@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark the FAISS index types selectable through P4_INDEX_TYPE on synthetic catalogs.
+
+Reports recall@k against the exact IndexFlatL2 baseline, single-query latency
+percentiles, build (train + add) time and serialized index size.
+
+    python p4_benchmark_index.py --sizes 10000,100000 --dim 384 --queries 500
+"""
+
+import argparse
+import time
+
+import numpy as np
+import faiss
+
+from p4_index import INDEX_TYPES, build_faiss_index, describe_index, index_memory_bytes
+
+
+def synthetic_catalog(num_vectors, dim, num_clusters=256, seed=0):
+    """Unit-norm vectors drawn around random centroids, like sentence embeddings of a product catalog"""
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((num_clusters, dim)).astype("float32")
+    assignments = rng.integers(0, num_clusters, size=num_vectors)
+    vectors = centroids[assignments] + 0.6 * rng.standard_normal((num_vectors, dim)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def recall_at_k(found, expected):
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+    return hits / expected.size
+
+
+def benchmark(index, queries, k):
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, indices = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(indices[0])
+    return np.array(found), np.percentile(latencies, [50, 95, 99])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated catalog sizes")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding dimension (all-MiniLM-L6-v2 is 384)")
+    parser.add_argument("--queries", type=int, default=200, help="Number of timed queries per index")
+    parser.add_argument("--k", type=int, default=10, help="Neighbours per query")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="Comma-separated index types")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)
+    index_types = args.types.split(",")
+
+    print(f"{'size':>9} {'index':<10} {'faiss class':<14} {'build s':>9} {'MB':>9} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        vectors = synthetic_catalog(size + args.queries, args.dim)
+        catalog, queries = vectors[:size], vectors[size:]
+
+        baseline = build_faiss_index(catalog, "flat")
+        _, expected = baseline.search(queries, args.k)
+
+        for index_type in index_types:
+            start = time.perf_counter()
+            index = build_faiss_index(catalog, index_type)
+            build_seconds = time.perf_counter() - start
+
+            found, (p50, p95, p99) = benchmark(index, queries, args.k)
+            size_mb = index_memory_bytes(index) / 1e6
+            print(
+                f"{size:>9} {index_type:<10} {describe_index(index):<14} {build_seconds:>9.2f} {size_mb:>9.1f} "
+                f"{recall_at_k(found, expected):>9.3f} {p50:>8.3f} {p95:>8.3f} {p99:>8.3f}"
+            )
+            del index
+        print()
+
+
+if __name__ == "__main__":
+    main()
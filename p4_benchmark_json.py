@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Measure response serialization for large /products and "all outlets" bodies.
+
+  products, k hits:
+    default   - a dict per ProductDoc, then jsonable_encoder + JSONResponse
+                (FastAPI's path for a returned dict, what /products did before)
+    fragments - p4.product_response_json(): per-product JSON serialized at
+                ingest, joined as bytes
+  outlets, every row:
+    dicts     - format_outlet() per row, then json.dumps of the whole body
+    fragments - p4.outlet_results_json()'s assembly from OUTLET_FRAGMENTS
+
+Only serialization is timed; search and SQL are done once up front. Products
+and outlets are the CSVs repeated up to --products / --outlets rows. The
+fragment timings use orjson when it is installed (see the header line).
+
+    python p4_benchmark_json.py --products 5000 --outlets 20000 --repeat 50
+"""
+
+import argparse
+import csv
+import json
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import p4
+import p4_json
+
+
+def build_products(count):
+    docs = p4.read_product_docs(p4.PRODUCT_CSV_FILE)
+    return [
+        docs[i % len(docs)].model_copy(update={"id": str(10 ** 12 + i), "title": f"{docs[i % len(docs)].title} #{i}"})
+        for i in range(count)
+    ]
+
+
+def build_outlets(count):
+    with open("zus_outlets_kl_selangor.csv", encoding="utf-8") as f:
+        base = list(csv.DictReader(f))
+    return [
+        dict(base[i % len(base)], id=i + 1, name=f"{base[i % len(base)]['name']} {i // len(base)}")
+        for i in range(count)
+    ]
+
+
+def products_default(query, results):
+    content = {
+        "summary": p4.generate_product_summary(results, query),
+        "results": [
+            {
+                "id": doc.id,
+                "title": doc.title,
+                "description": doc.description,
+                "price": doc.price,
+                "availability": doc.availability,
+                "tags": doc.tags
+            }
+            for doc in results
+        ],
+        "query": query,
+        "total_found": len(results)
+    }
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def outlets_dicts(rows, sql_executed):
+    content = {"results": [p4.format_outlet(row) for row in rows], "sql_executed": sql_executed, "total_found": len(rows)}
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def outlets_fragments(rows, sql_executed, fragments):
+    return (
+        b'{"results":' + p4_json.join_array(p4.outlet_fragment(row, fragments) for row in rows)
+        + b',"sql_executed":' + p4_json.encode_json(sql_executed)
+        + b',"total_found":' + str(len(rows)).encode("ascii") + b"}"
+    )
+
+
+def measure(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, [50, 95])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=5000, help="Synthetic product count")
+    parser.add_argument("--outlets", type=int, default=20000, help="Synthetic outlet count")
+    parser.add_argument("--ks", default="10,100,1000,5000", help="Comma-separated product hit counts")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed runs per case")
+    args = parser.parse_args()
+
+    docs = build_products(args.products)
+    state = SimpleNamespace(
+        docs=docs, slots={doc.id: slot for slot, doc in enumerate(docs)}, fragments=[p4.product_fragment(doc) for doc in docs]
+    )
+    rows = build_outlets(args.outlets)
+    fragments = {row["id"]: p4_json.encode_json(p4.format_outlet(row)) for row in rows}
+    sql_executed = "SELECT * FROM outlets ORDER BY outlets.name, outlets.id"
+
+    print(f"\nfragments encoded with {'orjson' if p4_json.orjson is not None else 'json'}")
+    print(f"{'case':<22} {'mode':<10} {'KiB':>8} {'p50 ms':>9} {'p95 ms':>9}")
+    for k in [int(k) for k in args.ks.split(",") if int(k) <= len(docs)]:
+        results, query = docs[:k], "tumbler for cold drinks"
+        before, after = products_default(query, results), p4.product_response_json(state, query, results)
+        assert json.loads(before) == json.loads(after)
+        for mode, fn in (("default", lambda: products_default(query, results)),
+                         ("fragments", lambda: p4.product_response_json(state, query, results))):
+            p50, p95 = measure(fn, args.repeat)
+            print(f"{f'products k={k}':<22} {mode:<10} {len(after) / 1024:>8.0f} {p50:>9.3f} {p95:>9.3f}")
+
+    before, after = outlets_dicts(rows, sql_executed), outlets_fragments(rows, sql_executed, fragments)
+    assert json.loads(before) == json.loads(after)
+    for mode, fn in (("dicts", lambda: outlets_dicts(rows, sql_executed)),
+                     ("fragments", lambda: outlets_fragments(rows, sql_executed, fragments))):
+        p50, p95 = measure(fn, args.repeat)
+        print(f"{f'all {len(rows)} outlets':<22} {mode:<10} {len(after) / 1024:>8.0f} {p50:>9.3f} {p95:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Measure outlet queries in the memory-only Railway app (app_railway.py).
+
+  rows    - the text2sql conditions checked outlet by outlet in Python
+            (a dict scan, what a correct execute_sql_memory would do)
+  columns - OutletStore: vectorized masks over dictionary-encoded NumPy columns
+
+Outlets come from the scraped CSV, repeated up to --rows with a numeric
+suffix on names and a lot number on addresses (so both stay distinct), with
+services drawn from the sample outlets' combinations. Both modes are checked
+against SQLite running the generated SQL before timing.
+
+    python p4_benchmark_railway.py --rows 100000 --repeat 20
+"""
+
+import argparse
+import csv
+import random
+import sqlite3
+import time
+
+import numpy as np
+
+import app_railway
+
+
+QUERIES = [
+    "outlets in KL", "delivery", "mall outlets near pavilion", "zus coffee in selangor",
+    "dine in at a shopping centre", "all outlets", "outlets in penang"
+]
+SERVICES = ["dine-in,takeaway", "dine-in,delivery", "dine-in,takeaway,delivery", "Coffee, Food, Beverages"]
+
+
+def build_outlets(rows, seed=0):
+    rng = random.Random(seed)
+    with open("zus_outlets_kl_selangor.csv", encoding="utf-8") as f:
+        base = list(csv.DictReader(f))
+    return [
+        {
+            "id": i + 1,
+            "name": f"ZUS Coffee {base[i % len(base)]['name']} {i // len(base)}",
+            "location": base[i % len(base)]["location"],
+            "address": f"Lot {i // len(base)}, {base[i % len(base)]['address']}",
+            "hours": base[i % len(base)]["hours"],
+            "services": rng.choice(SERVICES)
+        }
+        for i in range(rows)
+    ]
+
+
+def select_rows(outlets, conditions):
+    matches = [
+        outlet for outlet in outlets
+        if not conditions or any(
+            term in str(outlet.get(condition.column) or "").lower()
+            for condition in conditions for term in condition.terms
+        )
+    ]
+    return sorted(matches, key=lambda outlet: outlet["name"])
+
+
+def select_sqlite(outlets, sql):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE outlets (id INTEGER PRIMARY KEY, name TEXT, location TEXT, address TEXT, hours TEXT, services TEXT)")
+    conn.executemany("INSERT INTO outlets VALUES (:id, :name, :location, :address, :hours, :services)", outlets)
+    return [row[0] for row in conn.execute(sql.replace("SELECT *", "SELECT id"))]
+
+
+def measure(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, [50, 95])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="Synthetic outlet count")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per query and mode")
+    args = parser.parse_args()
+
+    outlets = build_outlets(args.rows)
+    start = time.perf_counter()
+    store = app_railway.OutletStore(outlets)
+    print(f"\n{len(outlets)} outlets, store built in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    print(f"{'query':<30} {'mode':<8} {'rows':>7} {'p50 ms':>9} {'p95 ms':>9}")
+    for query in QUERIES:
+        conditions = app_railway.parse_conditions(query)
+        expected = select_sqlite(outlets, app_railway.conditions_to_sql(conditions))
+        assert [outlet["id"] for outlet in store.select(conditions)] == expected
+        assert [outlet["id"] for outlet in select_rows(outlets, conditions)] == expected
+
+        for mode, fn in (("rows", lambda: select_rows(outlets, conditions)), ("columns", lambda: store.select(conditions))):
+            p50, p95 = measure(fn, args.repeat)
+            print(f"{query:<30} {mode:<8} {len(expected):>7} {p50:>9.2f} {p95:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
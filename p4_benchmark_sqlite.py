@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Compare requests/sec of the /outlets database path with different connection strategies.
+
+  connect - open and close a connection per query (text2sql + execute_sql each
+            connected separately, the behaviour before SQLiteReadPool)
+  pool    - per-thread read-only connections to the WAL database file
+  memory  - per-thread connections to an in-memory copy loaded via the backup API
+
+Every simulated request runs the outlet-name lookup from text2sql plus the
+generated query, like one /outlets call. The database is copied to a temp
+directory (optionally multiplied to --rows outlets) so the repo copy is untouched.
+
+    python p4_benchmark_sqlite.py --threads 1,8 --seconds 5
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import p4
+from p4_sqlite import SQLiteReadPool
+
+
+QUERIES = [
+    "outlets in Petaling Jaya", "SS 2", "KLCC", "outlets with delivery",
+    "stores in Selangor", "open late in Kuala Lumpur", "mall outlets in Cheras", "all outlets"
+]
+
+
+def prepare_database(path, rows):
+    p4.DB_PATH = path
+    p4.OUTLETS_DB = SQLiteReadPool(path)
+    p4.ingest_outlets_from_csv()
+    conn = sqlite3.connect(path)
+    base = conn.execute("SELECT COUNT(*) FROM outlets").fetchone()[0]
+    copies = 0
+    while rows and base * (copies + 2) <= rows:
+        copies += 1
+        conn.execute(
+            "INSERT INTO outlets (name, location, address, hours, services, direction_link) "
+            "SELECT name || ' ' || ?, location, address, hours, services, direction_link FROM outlets WHERE id <= ?",
+            (copies, base)
+        )
+    conn.commit()
+    total = conn.execute("SELECT COUNT(*) FROM outlets").fetchone()[0]
+    conn.close()
+    return total
+
+
+def connect_per_call(sql):
+    conn = sqlite3.connect(p4.DB_PATH)
+    conn.execute("SELECT DISTINCT name FROM outlets").fetchall()
+    conn.close()
+    conn = sqlite3.connect(p4.DB_PATH)
+    rows = conn.execute(sql).fetchall()
+    conn.close()
+    return rows
+
+
+def pooled(pool):
+    def run(sql):
+        conn = pool.connection()
+        conn.execute("SELECT DISTINCT name FROM outlets").fetchall()
+        return conn.execute(sql).fetchall()
+    return run
+
+
+def measure(run, statements, threads, seconds):
+    stop = time.perf_counter() + seconds
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        local = []
+        i = offset
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            run(statements[i % len(statements)])
+            local.append((time.perf_counter() - start) * 1000)
+            i += 1
+        with lock:
+            latencies.extend(local)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, range(threads)))
+    return len(latencies) / seconds, np.percentile(latencies, [50, 95])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", default="1,8", help="Comma-separated client thread counts")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Duration of each measurement")
+    parser.add_argument("--rows", type=int, default=0, help="Multiply the outlet table to about this many rows")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        total = prepare_database(os.path.join(tmp, "outlets.db"), args.rows)
+        statements = [sql for sql in (p4.text2sql(query) for query in QUERIES) if sql]
+        modes = {
+            "connect": connect_per_call,
+            "pool": pooled(SQLiteReadPool(p4.DB_PATH)),
+            "memory": pooled(SQLiteReadPool(p4.DB_PATH, in_memory=True))
+        }
+
+        print(f"\n{total} outlets, {len(statements)} query shapes")
+        print(f"{'mode':<8} {'threads':>7} {'req/s':>10} {'p50 ms':>8} {'p95 ms':>8}")
+        for threads in (int(t) for t in args.threads.split(",")):
+            for mode, run in modes.items():
+                rate, (p50, p95) = measure(run, statements, threads, args.seconds)
+                print(f"{mode:<8} {threads:>7} {rate:>10.0f} {p50:>8.3f} {p95:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Measure per-worker memory of `uvicorn p4:app --workers N` with and without shared artifacts.
+
+  private - every worker encodes the catalog and holds its own embeddings/index
+            (artifact store disabled, the behaviour before P4_SHARED_ARTIFACTS)
+  shared  - one worker builds the artifacts, every worker maps the same files
+
+RSS counts shared pages once per process; PSS splits them between the
+processes mapping them, so sum(PSS) is the real footprint. Linux only.
+
+    python p4_benchmark_workers.py --workers 4 --products 20000
+"""
+
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def synthetic_catalog(path, products, source="zus_drinkware_products.csv"):
+    with open(source, "r", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    drinkware = [row for row in rows if row.get("tags")]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=rows[0].keys())
+        writer.writeheader()
+        for i in range(products):
+            row = dict(drinkware[i % len(drinkware)])
+            row["id"] = str(10 ** 12 + i)
+            row["title"] = f"{row['title']} #{i}"
+            writer.writerow(row)
+
+
+def children(pid):
+    result = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == pid:
+                result.append(int(entry))
+        except (OSError, IndexError):
+            continue
+    return result
+
+
+def memory_kb(pid):
+    usage = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].rstrip(":") in ("Rss", "Pss", "Shared_Clean"):
+                usage[parts[0].rstrip(":")] = int(parts[1])
+    return usage
+
+
+def run_mode(mode, args, csv_path, artifact_dir):
+    env = dict(os.environ, P4_PRODUCT_CSV=csv_path)
+    if mode == "private":
+        env["P4_ARTIFACT_DIR"] = "/dev/null/p4-artifacts-disabled"
+        env["P4_SHARED_ARTIFACTS"] = "0"
+    else:
+        env["P4_ARTIFACT_DIR"] = artifact_dir
+        env["P4_SHARED_ARTIFACTS"] = "1"
+
+    log_path = os.path.join(os.path.dirname(csv_path), f"{mode}.log")
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "p4:app", "--host", "127.0.0.1",
+             "--port", str(args.port), "--workers", str(args.workers)],
+            env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+    try:
+        deadline = time.time() + args.timeout
+        while time.time() < deadline:
+            with open(log_path, "r") as log:
+                if log.read().count("API initialization complete") >= args.workers:
+                    break
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited early, see {log_path}")
+            time.sleep(1)
+        else:
+            raise RuntimeError(f"workers did not start within {args.timeout}s, see {log_path}")
+
+        time.sleep(2)
+        workers = [pid for pid in children(server.pid) if "Pss" in memory_kb(pid)]
+        usage = [memory_kb(pid) for pid in workers]
+        usage = sorted(usage, key=lambda u: u["Rss"], reverse=True)[:args.workers]
+        return usage
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn worker processes")
+    parser.add_argument("--products", type=int, default=20000, help="Synthetic catalog size (0 = use the real CSV)")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the temporary server")
+    parser.add_argument("--timeout", type=int, default=1800, help="Seconds to wait for all workers to start")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "products.csv")
+        if args.products:
+            synthetic_catalog(csv_path, args.products)
+        else:
+            csv_path = os.path.abspath("zus_drinkware_products.csv")
+
+        print(f"{'mode':<8} {'worker':>6} {'RSS MB':>8} {'PSS MB':>8} {'shared MB':>10}")
+        for mode in ("private", "shared"):
+            usage = run_mode(mode, args, csv_path, os.path.join(tmp, "artifacts"))
+            for i, u in enumerate(usage, 1):
+                print(f"{mode:<8} {i:>6} {u['Rss'] / 1024:>8.0f} {u['Pss'] / 1024:>8.0f} {u['Shared_Clean'] / 1024:>10.0f}")
+            total_pss = sum(u["Pss"] for u in usage) / 1024
+            print(f"{mode:<8} {'total':>6} {'':>8} {total_pss:>8.0f}\n")
+
+
+if __name__ == "__main__":
+    main()
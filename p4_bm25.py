@@ -0,0 +1,88 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+STOPWORDS = {
+    "a", "an", "and", "any", "do", "for", "have", "i", "in", "is", "me",
+    "my", "of", "on", "or", "show", "the", "to", "want", "with", "you"
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens that keep sizes and versions intact ("500ml", "2.0")"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over (title, description) pairs with an inverted index"""
+
+    def __init__(self, documents: Sequence[Tuple[str, str]], k1: float = 1.5, b: float = 0.75, title_weight: int = 2):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.title_terms: List[set] = []
+        self.doc_lengths: List[int] = []
+
+        for doc_idx, (title, description) in enumerate(documents):
+            title_tokens = tokenize(title)
+            tokens = title_tokens * title_weight + tokenize(description)
+            self.title_terms.append(set(title_tokens))
+            self.doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings[term].append((doc_idx, tf))
+
+        self.num_docs = len(self.doc_lengths)
+        self.avg_doc_length = sum(self.doc_lengths) / self.num_docs if self.num_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (self.num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def scores(self, query: str) -> Dict[int, float]:
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_idx, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_idx] / self.avg_doc_length)
+                scores[doc_idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def top(self, query: str, n: int, allowed=None) -> List[Tuple[int, float]]:
+        """Best n documents for query, restricted to doc ids where allowed[doc_idx] is true"""
+        if n <= 0:
+            return []
+        scores = self.scores(query).items()
+        if allowed is not None:
+            scores = [(doc_idx, score) for doc_idx, score in scores if allowed[doc_idx]]
+        ranked = sorted(scores, key=lambda item: (-item[1], item[0]))
+        return ranked[:n]
+
+    def decisive_hits(self, query: str, k: int, allowed=None) -> List[Tuple[int, float]]:
+        """Top-k lexical hits when each one names every query term in its title, else []
+
+        Exact SKU/size queries ("OG CUP 2.0", "500ml tumbler") are answered
+        this way without touching the embedding model.
+        """
+        terms = set(tokenize(query))
+        if not terms or k <= 0:
+            return []
+        ranked = self.top(query, k, allowed)
+        if len(ranked) < k:
+            return []
+        if all(terms <= self.title_terms[doc_idx] for doc_idx, _ in ranked):
+            return ranked
+        return []
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked id lists with RRF: score(d) = sum(1 / (k + rank))"""
+    fused: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_idx in enumerate(ranking, start=1):
+            fused[doc_idx] += 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))
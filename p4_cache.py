@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe bounded LRU cache with optional TTL and hit/miss/eviction counters
+
+    With sizeof (value -> bytes) the cache also tracks the total size of what
+    it holds, reported as nbytes.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None, sizeof=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.nbytes = 0
+
+    def _size(self, entry) -> int:
+        return self.sizeof(entry[0]) if self.sizeof else 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.nbytes -= self._size(entry)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            previous = self._data.get(key)
+            if previous is not None:
+                self.nbytes -= self._size(previous)
+            self._data[key] = (value, expires_at)
+            self.nbytes += self._size(self._data[key])
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                _, evicted = self._data.popitem(last=False)
+                self.nbytes -= self._size(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "nbytes": self.nbytes
+            }
+
+    def __len__(self):
+        return len(self._data)
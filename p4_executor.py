@@ -0,0 +1,114 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+
+class ExecutorSaturated(Exception):
+    """Raised instead of queueing when a BoundedExecutor already holds max_workers + max_queue calls"""
+
+    def __init__(self, name: str, in_flight: int, retry_after: int):
+        super().__init__(f"The {name} workload is at capacity ({in_flight} requests in flight), retry in {retry_after}s")
+        self.name = name
+        self.in_flight = in_flight
+        self.retry_after = retry_after
+
+
+class Timing(NamedTuple):
+    """Seconds a call waited for a worker and then ran on it"""
+    queue_wait: float
+    service: float
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+class BoundedExecutor:
+    """Thread pool with admission control and separate queue-wait / service-time accounting
+
+    At most max_workers calls run at once and at most max_queue more wait for
+    a worker; anything beyond that is rejected straight away with
+    ExecutorSaturated rather than queued until the client gives up. The last
+    `samples` timings are kept for percentiles in stats().
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, samples: int = 1024):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"p4-{name}")
+        self._lock = threading.Lock()
+        self._timings = deque(maxlen=samples)
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _retry_after(self) -> int:
+        """Seconds until the calls queued now should have started, from recent service times"""
+        services = [timing.service for timing in self._timings]
+        mean_service = sum(services) / len(services) if services else 1.0
+        queued = max(0, self.in_flight - self.max_workers)
+        return max(1, math.ceil(queued * mean_service / self.max_workers))
+
+    def _admit(self):
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ExecutorSaturated(self.name, self.in_flight, self._retry_after())
+            self.in_flight += 1
+
+    async def run(self, fn, *args, **kwargs):
+        """(fn(*args, **kwargs), Timing) with fn run on a worker thread
+
+        A caller that is cancelled while waiting does not cancel fn; the slot is
+        released when fn finishes either way.
+        """
+        self._admit()
+        submitted = time.perf_counter()
+        timing = None
+
+        def call():
+            nonlocal timing
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timing = Timing(started - submitted, time.perf_counter() - started)
+                with self._lock:
+                    self.in_flight -= 1
+                    self.completed += 1
+                    self._timings.append(timing)
+
+        try:
+            future = self._pool.submit(call)
+        except RuntimeError:
+            with self._lock:
+                self.in_flight -= 1
+            raise
+        result = await asyncio.wrap_future(future)
+        return result, timing
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = [timing.queue_wait * 1000 for timing in self._timings]
+            services = [timing.service * 1000 for timing in self._timings]
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.max_workers),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "queue_wait_ms": {"p50": _percentile(waits, 50), "p95": _percentile(waits, 95)},
+                "service_ms": {"p50": _percentile(services, 50), "p95": _percentile(services, 95)}
+            }
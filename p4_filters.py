@@ -0,0 +1,85 @@
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+PRICE_PATTERN = re.compile(r"[0-9]+(?:\.[0-9]+)?")
+IN_STOCK_VALUES = {"available", "in stock", "in_stock", "instock"}
+
+
+def parse_price(value: str) -> Optional[float]:
+    """Price in RM from strings like "79.00", "RM 1,299.90"; None when absent"""
+    match = PRICE_PATTERN.search((value or "").replace(",", ""))
+    return float(match.group()) if match else None
+
+
+def parse_tags(value: str) -> List[str]:
+    return [tag.strip().lower() for tag in (value or "").split(",") if tag.strip()]
+
+
+def is_in_stock(availability: str) -> bool:
+    return (availability or "").strip().lower() in IN_STOCK_VALUES
+
+
+class ProductFilter(NamedTuple):
+    """Metadata constraints for a product search; tags match when a product has any of them"""
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    in_stock: Optional[bool] = None
+    tags: Tuple[str, ...] = ()
+
+    @classmethod
+    def create(cls, min_price=None, max_price=None, in_stock=None, tags=None) -> "ProductFilter":
+        return cls(min_price, max_price, in_stock, tuple(sorted({tag.strip().lower() for tag in tags or () if tag.strip()})))
+
+    def is_empty(self) -> bool:
+        return self.min_price is None and self.max_price is None and self.in_stock is None and not self.tags
+
+
+class ProductColumns(NamedTuple):
+    """Per-slot metadata columns aligned with the FAISS ids of ProductSearchState"""
+    live: np.ndarray
+    price: np.ndarray
+    in_stock: np.ndarray
+    tags: Dict[str, np.ndarray]
+
+
+def build_product_columns(docs) -> ProductColumns:
+    num_slots = len(docs)
+    live = np.zeros(num_slots, dtype=bool)
+    price = np.full(num_slots, np.nan, dtype="float32")
+    in_stock = np.zeros(num_slots, dtype=bool)
+    tags: Dict[str, np.ndarray] = {}
+
+    for slot, doc in enumerate(docs):
+        if doc is None:
+            continue
+        live[slot] = True
+        if doc.price is not None:
+            price[slot] = doc.price
+        in_stock[slot] = is_in_stock(doc.availability)
+        for tag in doc.tags:
+            if tag not in tags:
+                tags[tag] = np.zeros(num_slots, dtype=bool)
+            tags[tag][slot] = True
+
+    return ProductColumns(live=live, price=price, in_stock=in_stock, tags=tags)
+
+
+def filter_mask(columns: ProductColumns, product_filter: ProductFilter) -> np.ndarray:
+    """Boolean mask over slots that satisfy product_filter (unknown prices never match a price bound)"""
+    mask = columns.live.copy()
+    if product_filter.min_price is not None:
+        mask &= columns.price >= product_filter.min_price
+    if product_filter.max_price is not None:
+        mask &= columns.price <= product_filter.max_price
+    if product_filter.in_stock is not None:
+        mask &= columns.in_stock == product_filter.in_stock
+    if product_filter.tags:
+        tagged = np.zeros_like(mask)
+        for tag in product_filter.tags:
+            if tag in columns.tags:
+                tagged |= columns.tags[tag]
+        mask &= tagged
+    return mask
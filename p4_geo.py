@@ -0,0 +1,87 @@
+import csv
+import math
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371.0088
+POSTCODE = re.compile(r"(?<!\d)(\d{5})(?!\d)")
+
+
+class Centroid(NamedTuple):
+    area: str
+    state: str
+    lat: float
+    lon: float
+
+
+def load_postcode_centroids(csv_file: str) -> Dict[str, Centroid]:
+    """postcode -> approximate centroid, from the bundled gazetteer CSV"""
+    with open(csv_file, "r", encoding="utf-8") as f:
+        return {
+            row["postcode"].strip(): Centroid(row["area"].strip(), row["state"].strip(), float(row["lat"]), float(row["lon"]))
+            for row in csv.DictReader(f)
+        }
+
+
+def extract_postcode(address: str) -> Optional[str]:
+    """Last 5-digit number in a Malaysian address; postcodes come after the street and unit numbers"""
+    postcodes = POSTCODE.findall(address or "")
+    return postcodes[-1] if postcodes else None
+
+
+def geocode(address: str, centroids: Dict[str, Centroid]) -> Optional[Tuple[float, float]]:
+    centroid = centroids.get(extract_postcode(address))
+    return (centroid.lat, centroid.lon) if centroid else None
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """(min_lat, max_lat, min_lon, max_lon) enclosing every point within radius_km of (lat, lon)"""
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - delta_lat, lat + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        # The circle reaches a pole, so it spans every longitude
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    delta_lon = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+    if delta_lon >= 180 or lon - delta_lon < -180 or lon + delta_lon > 180:
+        # Wrapping the antimeridian would need two boxes; one full-width box is still correct
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lon - delta_lon, lon + delta_lon
+
+
+class OutletPoints:
+    """Every geocoded outlet as flat coordinate arrays, for an exact vectorized k-nearest scan
+
+    The R*Tree answers nearby queries by looking at a few boxes; this is the
+    fallback for points far from every outlet, where any box that reaches the
+    nearest ones also holds most of the others.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, float, float]]):
+        rows = np.array(list(rows), dtype=np.float64).reshape(-1, 3)
+        self.ids = rows[:, 0].astype(np.int64)
+        self.lat = np.radians(rows[:, 1])
+        self.lon = np.radians(rows[:, 2])
+        self.cos_lat = np.cos(self.lat)
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Tuple[float, int]]:
+        """(distance_km, outlet_id) of the k nearest outlets, closest first"""
+        if not len(self.ids):
+            return []
+        lat, lon = math.radians(lat), math.radians(lon)
+        a = np.sin((self.lat - lat) / 2) ** 2 + math.cos(lat) * self.cos_lat * np.sin((self.lon - lon) / 2) ** 2
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        top = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        top = top[np.argsort(distances[top], kind="stable")]
+        return [(float(distances[i]), int(self.ids[i])) for i in top]
+
+    def __len__(self):
+        return len(self.ids)
@@ -0,0 +1,149 @@
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Malaysia has no daylight saving time, so a fixed offset avoids depending on tzdata
+OUTLET_TIMEZONE = timezone(timedelta(hours=8), "MYT")
+
+DAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+ALL_DAYS = tuple(range(7))
+DAY_GROUPS = {
+    "daily": ALL_DAYS, "everyday": ALL_DAYS, "every day": ALL_DAYS,
+    "weekdays": (0, 1, 2, 3, 4), "weekday": (0, 1, 2, 3, 4),
+    "weekends": (5, 6), "weekend": (5, 6)
+}
+ALWAYS_OPEN = re.compile(r"24\s*(?:hours|hrs|h)\b|24/7|open 24")
+
+DAY_TOKEN = r"\b(?:mon(?:day)?|tue(?:s|sday)?|wed(?:nesday)?|thu(?:r|rs|rsday)?|fri(?:day)?|sat(?:urday)?|sun(?:day)?)\b\.?"
+DAY_PATTERN = re.compile(
+    rf"(?P<start>{DAY_TOKEN})(?:\s*(?:-|–|—|to|until)\s*(?P<end>{DAY_TOKEN}))?"
+    r"|\b(?P<group>every day|everyday|daily|weekdays?|weekends?)\b"
+)
+TIME = r"(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?"
+TIME_RANGE = re.compile(rf"{TIME}\s*(?:-|–|—|to|until)\s*{TIME}")
+
+HoursRow = Tuple[int, int, int]
+
+
+def _days(text: str) -> Tuple[int, ...]:
+    days = []
+    for match in DAY_PATTERN.finditer(text):
+        if match.group("group"):
+            days.extend(DAY_GROUPS[match.group("group")])
+            continue
+        start = DAY_NAMES.index(match.group("start")[:3])
+        end = DAY_NAMES.index(match.group("end")[:3]) if match.group("end") else start
+        days.extend((start + offset) % 7 for offset in range((end - start) % 7 + 1))
+    return tuple(dict.fromkeys(days))
+
+
+def _minutes(hour: str, minute: Optional[str], meridiem: Optional[str]) -> Optional[int]:
+    hour, minute = int(hour), int(minute or 0)
+    if minute >= 60:
+        return None
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem.startswith("p") else 0)
+    elif hour > 24:
+        return None
+    return min(hour * 60 + minute, MINUTES_PER_DAY)
+
+
+def _time_range(match) -> Optional[Tuple[int, int]]:
+    open_h, open_m, open_meridiem, close_h, close_m, close_meridiem = match.groups()
+    if open_meridiem is None and close_meridiem is not None:
+        # "9-5pm" opens in the morning, "1-5pm" in the afternoon
+        open_meridiem = close_meridiem if int(open_h) % 12 < int(close_h) % 12 else "am"
+    if close_meridiem is None and open_meridiem is not None:
+        close_meridiem = "pm" if open_meridiem.startswith("a") else "am"
+    open_min = _minutes(open_h, open_m, open_meridiem)
+    close_min = _minutes(close_h, close_m, close_meridiem)
+    if open_min is None or close_min is None:
+        return None
+    return open_min, close_min
+
+
+def parse_hours(text: str) -> List[HoursRow]:
+    """Normalized (day, open_min, close_min) ranges for free-text opening hours
+
+    Days are 0=Monday..6=Sunday and close_min is exclusive. Ranges that run
+    past midnight are split at it ("Fri 6pm-2am" also opens Sat 00:00-02:00).
+    Text without a recognisable time ("Not specified") gives no rows.
+    """
+    text = (text or "").lower()
+    if ALWAYS_OPEN.search(text):
+        return [(day, 0, MINUTES_PER_DAY) for day in ALL_DAYS]
+
+    rows = []
+    previous_end = 0
+    for match in TIME_RANGE.finditer(text):
+        days = _days(text[previous_end:match.start()]) or ALL_DAYS
+        previous_end = match.end()
+        times = _time_range(match)
+        if times is None:
+            continue
+        open_min, close_min = times
+        for day in days:
+            if close_min > open_min:
+                rows.append((day, open_min, close_min))
+            elif close_min == open_min:
+                rows.append((day, 0, MINUTES_PER_DAY))
+            else:
+                rows.append((day, open_min, MINUTES_PER_DAY))
+                if close_min > 0:
+                    rows.append(((day + 1) % 7, 0, close_min))
+    return sorted(set(rows))
+
+
+def week_position(moment: datetime) -> Tuple[int, int]:
+    """(day, minute) of moment in outlet local time; naive datetimes are taken as local already"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(OUTLET_TIMEZONE)
+    return moment.weekday(), moment.hour * 60 + moment.minute
+
+
+def local_now() -> datetime:
+    return datetime.now(OUTLET_TIMEZONE)
+
+
+class OpenSchedule:
+    """Which outlets are open at every minute of the week, as packed bitmaps
+
+    The open set only changes where some outlet opens or closes, so the week
+    is cut at those boundaries and each stretch stores one bitmap over the
+    outlets; open_ids() is a binary search plus an unpack. Rebuilding from the
+    outlet_hours rows is a few vectorized NumPy passes.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, int, int, int]]):
+        rows = np.array(list(rows), dtype=np.int64).reshape(-1, 4)
+        self.outlet_ids, positions = np.unique(rows[:, 0], return_inverse=True)
+        starts = rows[:, 1] * MINUTES_PER_DAY + rows[:, 2]
+        ends = rows[:, 1] * MINUTES_PER_DAY + rows[:, 3]
+        self.boundaries = np.unique(np.concatenate([[0, MINUTES_PER_WEEK], starts, ends]))
+
+        changes = np.zeros((len(self.boundaries), len(self.outlet_ids)), dtype=np.int16)
+        np.add.at(changes, (np.searchsorted(self.boundaries, starts), positions), 1)
+        np.add.at(changes, (np.searchsorted(self.boundaries, ends), positions), -1)
+        self.bitmaps = np.packbits(np.cumsum(changes, axis=0) > 0, axis=1)
+
+    def segment(self, day: int, minute: int) -> int:
+        """Index of the stretch of the week holding (day, minute); the open set is the same throughout it"""
+        return int(np.searchsorted(self.boundaries, day * MINUTES_PER_DAY + minute, side="right") - 1)
+
+    def segment_ids(self, segment: int) -> List[int]:
+        mask = np.unpackbits(self.bitmaps[segment], count=len(self.outlet_ids)).astype(bool)
+        return self.outlet_ids[mask].tolist()
+
+    def open_ids(self, day: int, minute: int) -> List[int]:
+        return self.segment_ids(self.segment(day, minute))
+
+    def nbytes(self) -> int:
+        return int(self.bitmaps.nbytes + self.boundaries.nbytes + self.outlet_ids.nbytes)
@@ -0,0 +1,145 @@
+import math
+
+import numpy as np
+import faiss
+
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+
+IVF_NPROBE = 8
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+PQ_NBITS = 8
+PQ_MIN_NBITS = 4
+# k-means wants ~39 training points per centroid (FAISS warns below that)
+MIN_POINTS_PER_CENTROID = 39
+
+
+def default_nlist(num_vectors: int) -> int:
+    """~4*sqrt(N) inverted lists, capped so each list gets at least 39 training points"""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def default_pq_m(dim: int) -> int:
+    """Largest sub-quantizer count that divides dim with at least 8 dims per sub-vector"""
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def default_pq_nbits(num_vectors: int) -> int:
+    """Bits per PQ code, lowered below PQ_NBITS until each of the 2**nbits centroids gets 39 training points"""
+    nbits = PQ_NBITS
+    while nbits > PQ_MIN_NBITS and num_vectors < MIN_POINTS_PER_CENTROID * 2 ** nbits:
+        nbits -= 1
+    return nbits
+
+
+def resolve_index_type(index_type: str, num_vectors: int) -> str:
+    """Downgrade to a simpler index when the catalog is too small to train the requested one"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {', '.join(INDEX_TYPES)}")
+    if index_type == "ivf_pq" and num_vectors < MIN_POINTS_PER_CENTROID * 2 ** PQ_MIN_NBITS:
+        index_type = "ivf_flat"
+    if index_type == "ivf_flat" and num_vectors < MIN_POINTS_PER_CENTROID:
+        index_type = "flat"
+    return index_type
+
+
+def build_faiss_index(embeds, index_type: str = "flat", ids=None, nlist: int = None, pq_m: int = None):
+    """Build (and train, where needed) an L2 index of the requested type over embeds
+
+    Vectors are stored under ids (default 0..N-1) so rows can later be
+    removed or replaced without renumbering the rest of the catalog. PQ
+    codes get fewer than PQ_NBITS bits on catalogs too small to train 256
+    centroids per sub-quantizer.
+    """
+    num_vectors, dim = embeds.shape
+    index_type = resolve_index_type(index_type, num_vectors)
+    ids = np.arange(num_vectors, dtype="int64") if ids is None else np.asarray(ids, dtype="int64")
+
+    if index_type == "flat":
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    elif index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, HNSW_M)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index = faiss.IndexIDMap2(hnsw)
+    else:
+        nlist = nlist or default_nlist(num_vectors)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m or default_pq_m(dim), default_pq_nbits(num_vectors))
+        index.train(embeds)
+
+    index.add_with_ids(embeds, ids)
+    configure_search(index)
+    return index
+
+
+def base_index(index):
+    """The underlying index with any IndexIDMap wrapper removed"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def supports_remove(index) -> bool:
+    return not isinstance(base_index(index), faiss.IndexHNSW)
+
+
+def writable_copy(index):
+    """Deep copy that owns its storage (clone_index would still share memory-mapped codes)"""
+    return configure_search(faiss.deserialize_index(faiss.serialize_index(index)))
+
+
+def configure_search(index):
+    """Apply query-time knobs (nprobe / efSearch), which are not always persisted"""
+    base = base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(IVF_NPROBE, base.nlist)
+    elif isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def filtered_search_parameters(index, mask):
+    """SearchParameters restricting a search to the ids set in a boolean mask over 0..len(mask)-1
+
+    The selector is applied inside FAISS while scanning (through the IndexIDMap
+    translation where present), so filtered-out vectors never use up k.
+    """
+    bitmap = np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+    base = base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    elif isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    params.referenced_objects = [bitmap, selector]
+    return params
+
+
+def search_subset(embeds, ids, queries, k: int):
+    """Exact L2 search over embeds[ids] only, returning (distances, ids) like index.search"""
+    ids = np.asarray(ids, dtype="int64")
+    k = min(k, len(ids))
+    if k <= 0:
+        return np.zeros((len(queries), 0), dtype="float32"), np.zeros((len(queries), 0), dtype="int64")
+    subset = np.ascontiguousarray(embeds[ids], dtype="float32")
+    distances, positions = faiss.knn(np.ascontiguousarray(queries, dtype="float32"), subset, k)
+    return distances, np.where(positions >= 0, ids[positions], -1)
+
+
+def describe_index(index) -> str:
+    return type(base_index(index)).__name__
+
+
+def index_memory_bytes(index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
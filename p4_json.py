@@ -0,0 +1,43 @@
+import json
+from typing import Iterable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_json(content) -> bytes:
+    """Compact UTF-8 JSON, with orjson when it is installed
+
+    Both paths give the bytes FastAPI's JSONResponse would for plain dicts,
+    lists, strings and numbers; only NaN and infinity differ (orjson writes
+    null, json refuses them).
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def join_array(fragments: Iterable[bytes]) -> bytes:
+    """JSON array of already serialized values"""
+    return b"[" + b",".join(fragments) + b"]"
+
+
+def with_field(fragment: bytes, key: str, value) -> bytes:
+    """A serialized non-empty JSON object with one more key appended"""
+    return fragment[:-1] + b"," + encode_json(key) + b":" + encode_json(value) + b"}"
+
+
+class FastJSONResponse(Response):
+    """JSONResponse rendered by encode_json(); content that only jsonable_encoder understands still works"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        try:
+            return encode_json(content)
+        except TypeError:
+            return encode_json(jsonable_encoder(content))
@@ -0,0 +1,102 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+
+LOG_LEVEL = os.environ.get("P4_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("P4_LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.environ.get("P4_LOG_QUEUE_SIZE", 10000))
+# Share of requests whose per-request DEBUG detail is written when DEBUG is enabled
+LOG_SAMPLE_RATE = float(os.environ.get("P4_LOG_SAMPLE_RATE", 0.01))
+
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, and any extra={...} fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_FIELDS)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking or raising
+
+    The caller's thread only formats the message and enqueues it; the writes
+    happen on the QueueListener thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _start():
+    global _listener, _handler
+    stream = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _listener = logging.handlers.QueueListener(_handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    # Flush what is still queued when the interpreter exits
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for one of the apps, writing through the shared queue at P4_LOG_LEVEL
+
+    Child loggers ("p4.metrics") propagate to their app's logger and need no
+    set-up of their own.
+    """
+    logger = logging.getLogger(name)
+    with _lock:
+        if _listener is None:
+            _start()
+        if _handler not in logger.handlers:
+            logger.addHandler(_handler)
+            logger.setLevel(LOG_LEVEL)
+            logger.propagate = False
+    return logger
+
+
+def sample_debug(logger: logging.Logger, rate: float = None) -> bool:
+    """Whether this request should write its DEBUG detail: DEBUG is on and the request is sampled
+
+    Decide once per request and reuse the answer, so a sampled request logs
+    all of its lines and the others skip even building the messages.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+    rate = LOG_SAMPLE_RATE if rate is None else rate
+    return rate >= 1 or random.random() < rate
+
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler is not None else 0
@@ -0,0 +1,69 @@
+from collections import deque
+from typing import Iterable, List, NamedTuple, Tuple
+
+
+class Match(NamedTuple):
+    category: str
+    keyword: str
+    value: object
+    start: int
+    end: int
+
+
+class EntityMatcher:
+    """Aho-Corasick automaton over (category, keyword, value) entries
+
+    find_all() reports every keyword occurrence in a text in a single pass,
+    so matching cost depends on the query length and not on how many
+    outlet names or keywords were loaded. Keywords match as plain
+    (lowercased) substrings, the same as `keyword in text`.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str, object]]):
+        self.transitions = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        self.size = 0
+
+        for category, keyword, value in entries:
+            keyword = keyword.lower()
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self.transitions[state].get(char)
+                if next_state is None:
+                    next_state = len(self.transitions)
+                    self.transitions[state][char] = next_state
+                    self.transitions.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append((category, keyword, value))
+            self.size += 1
+
+        # Breadth-first so every fail link points at an already finished (shallower) state
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.transitions[fallback].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def find_all(self, text: str) -> List[Match]:
+        matches = []
+        state = 0
+        for position, char in enumerate(text.lower()):
+            while state and char not in self.transitions[state]:
+                state = self.fail[state]
+            state = self.transitions[state].get(char, 0)
+            for category, keyword, value in self.outputs[state]:
+                matches.append(Match(category, keyword, value, position + 1 - len(keyword), position + 1))
+        return matches
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Int8 ONNX Runtime backend for the product embedding model.
+
+Export once (needs torch + sentence-transformers + onnx):
+
+    python p4_onnx.py --output onnx/all-MiniLM-L6-v2-int8
+
+then serve with P4_EMBEDDING_BACKEND=onnx, which only needs onnxruntime and tokenizers.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+MODEL_FILE = "model.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+CONFIG_FILE = "embedder_config.json"
+
+
+class OnnxEmbedder:
+    """Drop-in replacement for SentenceTransformer.encode backed by an exported ONNX model"""
+
+    def __init__(self, model_dir: str, num_threads: int = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config.get("pad_token_id", 0), pad_token=self.config.get("pad_token", "[PAD]"))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        model_path = os.path.join(model_dir, MODEL_FILE)
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+
+        with open(model_path, "rb") as f:
+            self.model_version = f"onnx-int8-{hashlib.sha256(f.read()).hexdigest()[:16]}"
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            encodings = self.tokenizer.encode_batch(list(sentences[start:start + batch_size]))
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feed["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+            token_embeddings = self.session.run(None, feed)[0]
+            batches.append(self._pool(token_embeddings, attention_mask))
+
+        dim = self.config.get("dimension", 0)
+        embeddings = np.concatenate(batches) if batches else np.zeros((0, dim), dtype="float32")
+        return embeddings[0] if single else embeddings
+
+    def _pool(self, token_embeddings, attention_mask):
+        if self.config.get("pooling", "mean") == "cls":
+            pooled = token_embeddings[:, 0]
+        else:
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config.get("normalize", True):
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype("float32")
+
+
+def export_onnx_model(output_dir: str, model_name: str = "all-MiniLM-L6-v2", keep_fp32: bool = False):
+    """Export a SentenceTransformer's encoder to ONNX and quantize its weights to int8"""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    pooling_config = model[1].get_config_dict()
+    pooling = pooling_config.get("pooling_mode") or ("cls" if pooling_config.get("pooling_mode_cls_token") else "mean")
+    if pooling not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling mode for ONNX export: {pooling}")
+    encoder = model[0].auto_model.eval()
+
+    class EncoderOutput(torch.nn.Module):
+        def __init__(self, encoder):
+            super().__init__()
+            self.encoder = encoder
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.encoder(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+            ).last_hidden_state
+
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_path = os.path.join(output_dir, "model-fp32.onnx")
+    sample = model.tokenizer(["ZUS drinkware"], return_tensors="pt")
+    token_type_ids = sample.get("token_type_ids", torch.zeros_like(sample["input_ids"]))
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ("input_ids", "attention_mask", "token_type_ids", "last_hidden_state")}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            EncoderOutput(encoder),
+            (sample["input_ids"], sample["attention_mask"], token_type_ids),
+            fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False
+        )
+
+    quantize_dynamic(fp32_path, os.path.join(output_dir, MODEL_FILE), weight_type=QuantType.QInt8)
+    if not keep_fp32:
+        os.remove(fp32_path)
+
+    model.tokenizer.backend_tokenizer.save(os.path.join(output_dir, TOKENIZER_FILE))
+    config = {
+        "model_name": model_name,
+        "max_seq_length": model.max_seq_length,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "pooling": pooling,
+        "normalize": any(type(module).__name__ == "Normalize" for module in model),
+        "pad_token": model.tokenizer.pad_token,
+        "pad_token_id": model.tokenizer.pad_token_id
+    }
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+    print(f"[SUCCESS] Exported int8 ONNX model for {model_name} to {output_dir}")
+    return output_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="SentenceTransformer model to export")
+    parser.add_argument("--output", default="onnx/all-MiniLM-L6-v2-int8", help="Output directory")
+    parser.add_argument("--keep-fp32", action="store_true", help="Keep the unquantized export alongside")
+    args = parser.parse_args()
+    export_onnx_model(args.output, args.model, args.keep_fp32)
@@ -0,0 +1,146 @@
+import base64
+import binascii
+import json
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+
+OUTLET_FTS_WEIGHTS = "10.0, 2.0, 1.0"
+SNIPPET_START = "<mark>"
+SNIPPET_END = "</mark>"
+SNIPPET_TOKENS = 12
+SORT_ORDERS = ("name", "relevance")
+
+
+class TermGroup(NamedTuple):
+    """One filter: a row matches when any of columns is LIKE any of patterns"""
+    field: str
+    columns: Tuple[str, ...]
+    patterns: Tuple[str, ...]
+
+
+class OutletQueryPlan(NamedTuple):
+    """Structured intent of an outlet question
+
+    filters are ANDed together (each TermGroup is an OR within itself), text
+    is an optional FTS5 MATCH expression, and entities records what was
+    recognised in the question as (category, keyword) pairs. The opening-hours
+    constraints are ANDed as well: open_at is a (day, minute) of the week,
+    open_daily_at a minute of the day on any day, and outlet_ids an explicit
+    id set (already resolved, e.g. from an OpenSchedule). after is a keyset
+    cursor (name, id): only rows ordered after it, for name-sorted pages.
+    """
+    entities: Tuple[Tuple[str, str], ...] = ()
+    filters: Tuple[TermGroup, ...] = ()
+    text: Optional[str] = None
+    open_at: Optional[Tuple[int, int]] = None
+    open_daily_at: Optional[int] = None
+    outlet_ids: Optional[Tuple[int, ...]] = None
+    after: Optional[Tuple[str, int]] = None
+    sort: str = "name"
+    limit: Optional[int] = None
+
+    def shape(self) -> tuple:
+        """Everything that affects the SQL text; plans with one shape share a prepared statement"""
+        return (
+            tuple((group.columns, len(group.patterns)) for group in self.filters),
+            self.text is not None,
+            self.open_at is not None,
+            self.open_daily_at is not None,
+            self.outlet_ids is not None,
+            self.after is not None,
+            self.sort,
+            self.limit is not None
+        )
+
+
+@lru_cache(maxsize=256)
+def _compile_shape(shape: tuple) -> str:
+    filter_shape, has_text, has_open_at, has_open_daily_at, has_outlet_ids, has_after, sort, has_limit = shape
+    if sort not in SORT_ORDERS or (sort == "relevance" and not has_text):
+        raise ValueError(f"Unsupported sort order '{sort}' for this plan")
+    if has_after and sort != "name":
+        raise ValueError("Keyset cursors are only supported for name order")
+
+    where = []
+    if has_text:
+        sql = (
+            f"SELECT outlets.*, "
+            f"snippet(outlets_fts, -1, '{SNIPPET_START}', '{SNIPPET_END}', '...', {SNIPPET_TOKENS}) AS snippet "
+            f"FROM outlets_fts JOIN outlets ON outlets.id = outlets_fts.rowid"
+        )
+        where.append("outlets_fts MATCH ? AND rank MATCH ?")
+    else:
+        sql = "SELECT * FROM outlets"
+
+    for columns, num_patterns in filter_shape:
+        where.append("(" + " OR ".join(f"outlets.{column} LIKE ?" for column in columns for _ in range(num_patterns)) + ")")
+    if has_open_at:
+        where.append("outlets.id IN (SELECT outlet_id FROM outlet_hours WHERE day = ? AND open_min <= ? AND close_min > ?)")
+    if has_open_daily_at:
+        where.append("outlets.id IN (SELECT outlet_id FROM outlet_hours WHERE open_min <= ? AND close_min > ?)")
+    if has_outlet_ids:
+        # One placeholder for any number of ids keeps the statement shape stable
+        where.append("outlets.id IN (SELECT value FROM json_each(?))")
+    if has_after:
+        where.append("(outlets.name, outlets.id) > (?, ?)")
+
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    # id breaks name ties so that (name, id) is a total order for keyset pages
+    sql += " ORDER BY rank" if sort == "relevance" else " ORDER BY outlets.name, outlets.id"
+    if has_limit:
+        sql += " LIMIT ?"
+    return sql
+
+
+def compile_plan(plan: OutletQueryPlan) -> Tuple[str, tuple]:
+    """Parameterized (sql, params) for plan; the SQL text is cached per plan shape"""
+    sql = _compile_shape(plan.shape())
+    params = []
+    if plan.text is not None:
+        params += [plan.text, f"bm25({OUTLET_FTS_WEIGHTS})"]
+    for group in plan.filters:
+        params += [pattern for _ in group.columns for pattern in group.patterns]
+    if plan.open_at is not None:
+        day, minute = plan.open_at
+        params += [day, minute, minute]
+    if plan.open_daily_at is not None:
+        params += [plan.open_daily_at, plan.open_daily_at]
+    if plan.outlet_ids is not None:
+        params.append(json.dumps(list(plan.outlet_ids)))
+    if plan.after is not None:
+        params += list(plan.after)
+    if plan.limit is not None:
+        params.append(plan.limit)
+    return sql, tuple(params)
+
+
+def render_sql(sql: str, params: tuple) -> str:
+    """Inline params as SQL literals, for logs and callers that expect one SQL string"""
+    parts = sql.split("?")
+    if len(parts) != len(params) + 1:
+        raise ValueError("Parameter count does not match the SQL placeholders")
+    rendered = [parts[0]]
+    for value, part in zip(params, parts[1:]):
+        if isinstance(value, str):
+            rendered.append("'" + value.replace("'", "''") + "'")
+        else:
+            rendered.append(str(value))
+        rendered.append(part)
+    return "".join(rendered)
+
+
+def encode_cursor(name: str, outlet_id: int) -> str:
+    """Opaque page cursor for the row (name, id); decode_cursor() inverts it"""
+    return base64.urlsafe_b64encode(json.dumps([name, outlet_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        name, outlet_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}") from None
+    if not isinstance(name, str) or not isinstance(outlet_id, int):
+        raise ValueError("Invalid cursor")
+    return name, outlet_id
@@ -0,0 +1,108 @@
+import itertools
+import sqlite3
+import threading
+
+
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KB = 16 * 1024
+CACHED_STATEMENTS = 256
+
+_memory_db_ids = itertools.count(1)
+
+
+def enable_wal(conn: sqlite3.Connection):
+    """Switch a writable database to WAL so readers never block on (or behind) the ingest writer"""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+
+class SQLiteReadPool:
+    """Per-thread, read-only, long-lived connections to one SQLite database
+
+    Each thread keeps its connection (and sqlite3's prepared-statement cache)
+    for its lifetime instead of connecting per query. With in_memory=True the
+    file is copied with the backup API into a shared-cache in-memory database
+    and readers are served from that copy. Call refresh() after writing to
+    the file so readers reopen on (or reload) the new contents.
+    """
+
+    def __init__(self, db_path: str, in_memory: bool = False, mmap_size: int = MMAP_SIZE,
+                 cache_size_kb: int = CACHE_SIZE_KB, cached_statements: int = CACHED_STATEMENTS):
+        self.db_path = db_path
+        self.in_memory = in_memory
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.cached_statements = cached_statements
+        self.generation = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory_uri = None
+        self._memory_anchor = None
+
+    def _uri(self) -> str:
+        if self.in_memory:
+            with self._lock:
+                if self._memory_uri is None:
+                    self._load_memory_copy()
+                return self._memory_uri
+        return f"file:{self.db_path}?mode=ro"
+
+    def _load_memory_copy(self):
+        uri = f"file:p4_readpool_{id(self)}_{next(_memory_db_ids)}?mode=memory&cache=shared"
+        anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        source = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            source.backup(anchor)
+        finally:
+            source.close()
+        # The anchor keeps the shared in-memory database alive between reader connections
+        previous = self._memory_anchor
+        self._memory_uri, self._memory_anchor = uri, anchor
+        if previous is not None:
+            previous.close()
+
+    def connect(self) -> sqlite3.Connection:
+        """A new read-only connection owned (and closed) by the caller
+
+        For cursors that outlive one call, such as a streamed response, which
+        must not be closed underneath by refresh() or shared with the thread's
+        other queries.
+        """
+        conn = sqlite3.connect(self._uri(), uri=True, check_same_thread=False, cached_statements=self.cached_statements)
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        if not self.in_memory:
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.generation == self.generation:
+            return conn
+        if conn is not None:
+            conn.close()
+
+        generation = self.generation
+        conn = self.connect()
+        self._local.conn = conn
+        self._local.generation = generation
+        return conn
+
+    def refresh(self):
+        """Make every thread reconnect on its next query (reloading the in-memory copy first)"""
+        with self._lock:
+            if self.in_memory and self._memory_uri is not None:
+                self._load_memory_copy()
+            self.generation += 1
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        with self._lock:
+            if self._memory_anchor is not None:
+                self._memory_anchor.close()
+            self._memory_uri = self._memory_anchor = None
+            self.generation += 1
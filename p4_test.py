@@ -0,0 +1,1176 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+import app_railway
+import p4
+import p4_artifacts
+import p4_json
+from p4_artifacts import is_memory_mapped
+from p4_batcher import MicroBatcher
+from p4_bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+from p4_cache import LRUCache
+from p4_executor import BoundedExecutor, ExecutorSaturated
+from p4_filters import ProductFilter, build_product_columns, filter_mask, parse_price
+from p4_geo import extract_postcode, haversine_km
+from p4_hours import parse_hours
+from p4_index import (
+    INDEX_TYPES, build_faiss_index, default_pq_nbits, describe_index, filtered_search_parameters, resolve_index_type
+)
+from p4_logging import DroppingQueueHandler, JsonFormatter
+from p4_matcher import EntityMatcher
+from p4_metrics import MetricsMiddleware, MetricsRegistry
+from p4_outlet_query import compile_plan, render_sql
+from p4_sqlite import SQLiteReadPool
+
+
+class FakeEncoder:
+    """Deterministic bag-of-words encoder standing in for SentenceTransformer."""
+
+    dim = 64
+
+    def __init__(self, *args, **kwargs):
+        self.encode_calls = 0
+
+    def encode(self, texts, convert_to_numpy=True, **kwargs):
+        self.encode_calls += 1
+        vectors = np.zeros((len(texts), self.dim), dtype="float32")
+        for row, text in enumerate(texts):
+            for token in re.findall(r"\w+", text.lower()):
+                vectors[row, zlib.crc32(token.encode()) % self.dim] += 1.0
+            norm = np.linalg.norm(vectors[row])
+            if norm:
+                vectors[row] /= norm
+        return vectors
+
+
+class ProductIngestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.artifact_dir = tempfile.mkdtemp()
+        patcher = patch.multiple(p4, load_embedding_model=FakeEncoder, ARTIFACT_DIR=self.artifact_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.artifact_dir, ignore_errors=True)
+
+
+class TestProductArtifactCache(ProductIngestTestCase):
+    def test_second_ingest_loads_from_cache(self):
+        """Test that an unchanged CSV reuses the stored embeddings instead of re-encoding."""
+        p4.ingest_product_docs_from_csv()
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 1)
+        first_embeds = np.array(p4.DOC_EMBEDS)
+
+        p4.ingest_product_docs_from_csv()
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 0)
+        np.testing.assert_array_equal(np.array(p4.DOC_EMBEDS), first_embeds)
+        self.assertEqual(p4.FAISS_INDEX.ntotal, len(p4.PRODUCT_DOCS))
+
+    def test_changed_rows_miss_the_cache(self):
+        """Test that editing a product row produces a new artifact key."""
+        p4.ingest_product_docs_from_csv()
+        csv_copy = os.path.join(self.artifact_dir, "products.csv")
+        with open("zus_drinkware_products.csv", encoding="utf-8") as src:
+            content = src.read().replace("OG CUP 2.0", "OG CUP 3.0", 1)
+        with open(csv_copy, "w", encoding="utf-8") as dst:
+            dst.write(content)
+
+        p4.ingest_product_docs_from_csv(csv_copy)
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 1)
+
+    def test_concurrent_builders_encode_once(self):
+        """Test that builders racing on one artifact key wait on the lock and encode only once."""
+        docs = p4.read_product_docs("zus_drinkware_products.csv")
+        encoder = FakeEncoder()
+        encode = encoder.encode
+        encoder.encode = lambda texts, **kwargs: (time.sleep(0.2), encode(texts, **kwargs))[1]
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                p4.load_or_build_product_artifacts(docs, encoder, "fake", "zus_drinkware_products.csv")
+            ))
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(encoder.encode_calls, 1)
+        self.assertEqual([index.ntotal for _, index in results], [len(docs)] * 3)
+
+    def test_second_process_maps_the_saved_artifacts(self):
+        """Test that another process loads the saved embeddings and index read-only without encoding."""
+        docs = p4.read_product_docs("zus_drinkware_products.csv")
+        embeds, index = p4.load_or_build_product_artifacts(docs, FakeEncoder(), "fake", "zus_drinkware_products.csv")
+        self.assertIsInstance(embeds, np.memmap)
+        self.assertTrue(is_memory_mapped(index))
+
+        script = (
+            "import json, p4\n"
+            "from p4_artifacts import is_memory_mapped\n"
+            "class NoEncoder:\n"
+            "    def encode(self, *args, **kwargs):\n"
+            "        raise AssertionError('re-encoded')\n"
+            "docs = p4.read_product_docs('zus_drinkware_products.csv')\n"
+            "embeds, index = p4.load_or_build_product_artifacts(docs, NoEncoder(), 'fake', 'zus_drinkware_products.csv')\n"
+            "print(json.dumps([embeds.flags.writeable, is_memory_mapped(index), index.ntotal]))\n"
+        )
+        env = {**os.environ, "P4_ARTIFACT_DIR": self.artifact_dir, "P4_LOG_LEVEL": "WARNING"}
+        output = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(json.loads(output.stdout.splitlines()[-1]), [False, True, len(docs)])
+
+    def test_format_or_index_type_change_rebuilds(self):
+        """Test that bumping ARTIFACT_FORMAT or switching P4_INDEX_TYPE misses the cache and re-encodes."""
+        p4.ingest_product_docs_from_csv()
+        with patch.object(p4_artifacts, "ARTIFACT_FORMAT", p4_artifacts.ARTIFACT_FORMAT + 1):
+            p4.ingest_product_docs_from_csv()
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 1)
+
+        with patch.object(p4, "INDEX_TYPE", "hnsw"):
+            p4.ingest_product_docs_from_csv()
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 1)
+        self.assertEqual(p4.describe_index(p4.FAISS_INDEX), "IndexHNSWFlat")
+
+    def test_first_update_copies_the_mapped_index(self):
+        """Test that updating a catalog served from mapped artifacts logs the switch to a private copy."""
+        p4.ingest_product_docs_from_csv()
+        self.assertTrue(is_memory_mapped(p4.FAISS_INDEX))
+        with self.assertLogs(p4.logger, logging.INFO) as logs:
+            p4.delete_products([p4.PRODUCT_DOCS[0].id])
+        self.assertTrue(any("private copy" in line for line in logs.output))
+        self.assertFalse(is_memory_mapped(p4.FAISS_INDEX))
+
+
+class TestProductBatchSearch(ProductIngestTestCase):
+    def test_batch_matches_single_queries_with_one_encode(self):
+        """Test that a batch encodes once and returns the same hits as single searches."""
+        p4.ingest_product_docs_from_csv()
+        queries = ["tumbler", "ceramic cup", "frozee cold cup"]
+        expected = [p4.search_products(query, k) for query, k in zip(queries, [1, 3, 2])]
+
+        p4.QUERY_CACHE.clear()
+        p4.EMBEDDING_MODEL.encode_calls = 0
+        batch = p4.search_products_batch(queries, [1, 3, 2])
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 1)
+        self.assertEqual(batch, expected)
+        self.assertLessEqual(len(batch[0]), 1)
+
+    def test_non_positive_k_returns_nothing(self):
+        """Test that k <= 0 yields no products from search, /products and /products/batch instead of slicing from the end."""
+        p4.ingest_product_docs_from_csv()
+        self.assertEqual(p4.PRODUCT_BM25.top("tumbler", -2), [])
+        params = {"min_price": None, "max_price": None, "in_stock": None, "tag": None}
+        for k in (0, -2):
+            with self.subTest(k=k):
+                self.assertEqual(p4.search_products("something for cold drinks", k), [])
+                body = json.loads(asyncio.run(p4.get_products(query="something for cold drinks", k=k, **params)).body)
+                self.assertEqual((body["results"], body["total_found"]), ([], 0))
+
+                request = p4.ProductBatchRequest.model_construct(
+                    queries=[p4.ProductQuery.model_construct(query="something for cold drinks", k=k, min_price=None, max_price=None, in_stock=None, tags=[])]
+                )
+                body = json.loads(p4.get_products_batch(request).body)
+                self.assertEqual(body["results"][0]["results"], [])
+
+
+    def test_out_of_range_k_is_rejected(self):
+        """Test that /products and /products/batch answer 422 for k outside 1..PRODUCT_MAX_K before searching."""
+        client = TestClient(p4.app)
+        with patch.object(p4, "search_product_responses") as search:
+            for k in (0, -2, p4.PRODUCT_MAX_K + 1):
+                with self.subTest(k=k):
+                    self.assertEqual(client.get("/products", params={"query": "tumbler", "k": k}).status_code, 422)
+                    response = client.post("/products/batch", json={"queries": [{"query": "tumbler", "k": k}]})
+                    self.assertEqual(response.status_code, 422)
+        search.assert_not_called()
+
+
+class TestQueryCache(ProductIngestTestCase):
+    def test_lru_evicts_oldest_and_expires_entries(self):
+        """Test LRU eviction order, TTL expiry and the counters they update."""
+        cache = LRUCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        with patch("p4_cache.time.monotonic", side_effect=[0.0, 11.0]):
+            expiring = LRUCache(maxsize=2, ttl=10)
+            expiring.put("a", 1)
+            self.assertIsNone(expiring.get("a"))
+        self.assertEqual(expiring.stats()["expirations"], 1)
+
+    def test_sizeof_tracks_bytes_held(self):
+        """Test that nbytes follows puts, replacements and evictions."""
+        cache = LRUCache(maxsize=2, sizeof=len)
+        cache.put("a", b"xxxx")
+        cache.put("b", b"yy")
+        cache.put("a", b"z")
+        self.assertEqual(cache.stats()["nbytes"], 3)
+        cache.put("c", b"123456")
+        self.assertEqual(cache.stats()["nbytes"], 7)
+
+    def test_repeated_query_skips_encode_until_reingest(self):
+        """Test that normalized repeat queries hit the cache and ingest invalidates it."""
+        p4.ingest_product_docs_from_csv()
+        first = p4.search_products("Ceramic  Mug", 3)
+        p4.EMBEDDING_MODEL.encode_calls = 0
+
+        self.assertEqual(p4.search_products("ceramic mug", 2), first[:2])
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 0)
+
+        p4.ingest_product_docs_from_csv()
+        self.assertEqual(len(p4.QUERY_CACHE), 0)
+        p4.search_products("ceramic mug", 2)
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 1)
+
+
+class TestHybridSearch(ProductIngestTestCase):
+    def test_tokenize_keeps_sizes_and_versions(self):
+        """Test that SKU-style tokens survive tokenization."""
+        self.assertEqual(tokenize("OG CUP 2.0 With Screw-On Lid 500ml (17oz)"),
+                         ["og", "cup", "2.0", "screw", "lid", "500ml", "17oz"])
+
+    def test_rrf_rewards_agreement_between_rankings(self):
+        """Test that documents ranked by both retrievers come first."""
+        fused = reciprocal_rank_fusion([[3, 1, 2], [1, 4]])
+        self.assertEqual([idx for idx, _ in fused], [1, 3, 4, 2])
+
+    def test_decisive_sku_query_skips_encode(self):
+        """Test that an exact SKU match is answered lexically without the embedding model."""
+        p4.ingest_product_docs_from_csv()
+        p4.EMBEDDING_MODEL.encode_calls = 0
+        results = p4.search_products("OG CUP 2.0", 1)
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 0)
+        self.assertTrue(results[0].title.startswith("OG CUP 2.0"))
+
+    def test_non_decisive_query_is_fused(self):
+        """Test that vague queries still go through the encoder."""
+        index = BM25Index([("All-Can Tumbler 600ml", "keeps drinks cold"), ("OG Ceramic Mug", "hot coffee")])
+        self.assertEqual(index.decisive_hits("cold drink", 1), [])
+        p4.ingest_product_docs_from_csv()
+        p4.EMBEDDING_MODEL.encode_calls = 0
+        p4.search_products("something for cold drinks", 2)
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 1)
+
+
+class TestIncrementalProductUpdates(ProductIngestTestCase):
+    def setUp(self):
+        super().setUp()
+        p4.ingest_product_docs_from_csv()
+        p4.EMBEDDING_MODEL.encode_calls = 0
+        self.mug = next(doc for doc in p4.PRODUCT_DOCS if "Mug" in doc.title)
+
+    def test_upsert_encodes_only_changed_rows(self):
+        """Test that upserting one new and one edited product encodes just those two."""
+        edited = self.mug.model_copy(update={"title": "OG Ceramic Thermos Mug"})
+        new = p4.ProductDoc(id="42", title="Limited Edition Thermos Flask", description="Vacuum flask")
+
+        counts = p4.upsert_products([edited, new] + [doc for doc in p4.PRODUCT_DOCS[:3]])
+        self.assertEqual(counts, {"inserted": 1, "updated": 1})
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 1)
+        self.assertEqual(p4.FAISS_INDEX.ntotal, len(p4.PRODUCT_DOCS))
+        self.assertIn(new, p4.search_products("thermos flask", 3))
+
+    def test_upsert_reserializes_the_changed_product(self):
+        """Test that a response is assembled from fragments that follow upserts."""
+        edited = self.mug.model_copy(update={"price": 123.0, "title": "OG Ceramic Mug (Édition)"})
+        p4.upsert_products([edited])
+        state = p4.PRODUCT_STATE
+        body = json.loads(p4.product_response_json(state, "mug", [edited]))
+        self.assertEqual(body["results"], [{**edited.model_dump(), "price": 123.0}])
+        self.assertEqual((body["query"], body["total_found"]), ("mug", 1))
+        self.assertIn(state.fragments[state.slots[edited.id]], p4.product_response_json(state, "mug", [edited]))
+
+    def test_delete_removes_product_from_results(self):
+        """Test that deleted products disappear from both vector and lexical hits."""
+        self.assertIn(self.mug, p4.search_products("ceramic mug", 3))
+        self.assertEqual(p4.delete_products([self.mug.id, "missing"]), {"deleted": 1})
+        self.assertNotIn(self.mug, p4.search_products("ceramic mug", 3))
+        self.assertEqual(p4.FAISS_INDEX.ntotal, len(p4.PRODUCT_DOCS) - 1)
+
+    def test_reload_applies_only_the_csv_delta(self):
+        """Test that reloading a CSV with one row removed reports a single delete."""
+        csv_copy = os.path.join(self.artifact_dir, "products.csv")
+        with open("zus_drinkware_products.csv", encoding="utf-8") as src:
+            rows = list(csv.DictReader(src))
+        with open(csv_copy, "w", encoding="utf-8", newline="") as dst:
+            writer = csv.DictWriter(dst, fieldnames=rows[0].keys())
+            writer.writeheader()
+            writer.writerows(row for row in rows if row["id"] != self.mug.id)
+
+        counts = p4.reload_products_from_csv(csv_copy)
+        self.assertEqual(counts["deleted"], 1)
+        self.assertEqual((counts["inserted"], counts["updated"]), (0, 0))
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 0)
+
+    def test_reload_publishes_one_snapshot(self):
+        """Test that a reload with both deletes and edits swaps PRODUCT_STATE exactly once."""
+        csv_copy = os.path.join(self.artifact_dir, "products.csv")
+        with open("zus_drinkware_products.csv", encoding="utf-8") as src:
+            rows = list(csv.DictReader(src))
+        edited_id = next(row["id"] for row in rows if row["id"] != self.mug.id)
+        with open(csv_copy, "w", encoding="utf-8", newline="") as dst:
+            writer = csv.DictWriter(dst, fieldnames=rows[0].keys())
+            writer.writeheader()
+            for row in rows:
+                if row["id"] == edited_id:
+                    row = {**row, "title": row["title"] + " Limited Edition"}
+                if row["id"] != self.mug.id:
+                    writer.writerow(row)
+
+        published = []
+        publish = p4._publish_product_state
+        with patch.object(p4, "_publish_product_state", lambda state: (published.append(state), publish(state))):
+            counts = p4.reload_products_from_csv(csv_copy)
+        self.assertEqual((counts["deleted"], counts["updated"]), (1, 1))
+        self.assertEqual(len(published), 1)
+        self.assertNotIn(self.mug.id, p4.PRODUCT_SLOTS)
+        self.assertTrue(p4.PRODUCT_DOCS[p4.PRODUCT_SLOTS[edited_id]].title.endswith("Limited Edition"))
+
+    def test_reload_endpoint_requires_a_configured_token(self):
+        """Test that /admin/products/reload is refused when P4_ADMIN_TOKEN is unset or does not match."""
+        with patch.object(p4, "reload_products_from_csv") as reload:
+            with patch.object(p4, "ADMIN_TOKEN", None):
+                for token in (None, "", "anything"):
+                    with self.assertRaises(HTTPException) as raised:
+                        p4.reload_products(x_admin_token=token)
+                    self.assertEqual(raised.exception.status_code, 403)
+            with patch.object(p4, "ADMIN_TOKEN", "secret"):
+                with self.assertRaises(HTTPException):
+                    p4.reload_products(x_admin_token="wrong")
+                p4.reload_products(x_admin_token="secret")
+        self.assertEqual(reload.call_count, 1)
+
+
+class TestProductFilters(ProductIngestTestCase):
+    def setUp(self):
+        super().setUp()
+        p4.ingest_product_docs_from_csv()
+
+    def test_filter_mask_combines_columns(self):
+        """Test price bounds, stock and any-of tag matching on the parsed columns."""
+        docs = [
+            p4.ProductDoc(id="1", title="a", description="", price=29.9, availability="available", tags=["mug"]),
+            p4.ProductDoc(id="2", title="b", description="", price=79.0, availability="sold out", tags=["tumbler"]),
+            None,
+            p4.ProductDoc(id="4", title="d", description="", tags=["tumbler", "all day"])
+        ]
+        columns = build_product_columns(docs)
+        self.assertEqual(filter_mask(columns, ProductFilter.create(max_price=50)).tolist(), [True, False, False, False])
+        self.assertEqual(filter_mask(columns, ProductFilter.create(in_stock=False)).tolist(), [False, True, False, True])
+        self.assertEqual(filter_mask(columns, ProductFilter.create(tags=["Tumbler", "mug"])).tolist(), [True, True, False, True])
+        self.assertEqual(parse_price("RM 1,299.90"), 1299.9)
+
+    def test_filtered_search_fills_k_from_matching_products(self):
+        """Test that filters are applied inside the search, so k matching products come back."""
+        query = "tumbler for cold drinks"
+        self.assertTrue(any(doc.price > 60 for doc in p4.search_products(query, 3)))
+
+        product_filter = ProductFilter.create(max_price=60, in_stock=True, tags=["tumbler"])
+        results = p4.search_products(query, 3, product_filter)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(doc.price <= 60 and "tumbler" in doc.tags for doc in results))
+
+        with patch.object(p4, "FILTER_EXACT_SEARCH_MAX", 0):
+            p4.QUERY_CACHE.clear()
+            self.assertEqual(p4.search_products(query, 3, product_filter), results)
+
+    def test_price_update_skips_encode(self):
+        """Test that a metadata-only upsert refreshes the columns without re-encoding."""
+        mug = next(doc for doc in p4.PRODUCT_DOCS if "Ceramic Mug" in doc.title)
+        p4.EMBEDDING_MODEL.encode_calls = 0
+        self.assertEqual(p4.upsert_products([mug.model_copy(update={"price": 999.0})]), {"inserted": 0, "updated": 1})
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 0)
+        self.assertEqual([doc.id for doc in p4.search_products("mug", 3, ProductFilter.create(min_price=500))], [mug.id])
+
+    def test_filters_do_not_share_cache_entries(self):
+        """Test that a filtered query is cached separately from the unfiltered one."""
+        unfiltered = p4.search_products("cold cup", 3)
+        mugs = p4.search_products("cold cup", 3, ProductFilter.create(tags=["mug"]))
+        self.assertTrue(mugs)
+        self.assertTrue(all("mug" in doc.tags for doc in mugs))
+        self.assertEqual(p4.search_products("cold cup", 3), unfiltered)
+        self.assertEqual(p4.search_products("cold cup", 3, ProductFilter.create(min_price=1000)), [])
+
+
+class TestFaissIndexTypes(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        centroids = rng.standard_normal((16, 32)).astype("float32")
+        self.embeds = centroids[rng.integers(0, 16, size=1000)] + 0.3 * rng.standard_normal((1000, 32)).astype("float32")
+        self.embeds /= np.linalg.norm(self.embeds, axis=1, keepdims=True)
+
+    def test_each_index_type_builds_and_searches(self):
+        """Test that every P4_INDEX_TYPE trains, finds a stored vector, and keeps filtered searches inside the subset."""
+        expected = {"flat": "IndexFlatL2", "ivf_flat": "IndexIVFFlat", "hnsw": "IndexHNSWFlat", "ivf_pq": "IndexIVFPQ"}
+        queries = self.embeds[:20]
+        mask = np.zeros(len(self.embeds), dtype=bool)
+        mask[::3] = True
+        for index_type in INDEX_TYPES:
+            with self.subTest(index_type=index_type):
+                index = build_faiss_index(self.embeds, index_type)
+                self.assertEqual(describe_index(index), expected[index_type])
+                self.assertEqual(index.ntotal, len(self.embeds))
+
+                _, indices = index.search(queries, 5)
+                self.assertTrue(all(row in indices[row] for row in range(len(queries))))
+
+                _, indices = index.search(queries, 5, params=filtered_search_parameters(index, mask))
+                found = indices[indices >= 0]
+                self.assertGreater(len(found), 0)
+                self.assertTrue(mask[found].all())
+
+    def test_small_catalogs_downgrade(self):
+        """Test that catalogs too small to train fall back from ivf_pq to fewer PQ bits, ivf_flat, then flat."""
+        self.assertEqual(resolve_index_type("ivf_pq", 10000), "ivf_pq")
+        self.assertEqual((default_pq_nbits(10000), default_pq_nbits(5000), default_pq_nbits(700)), (8, 7, 4))
+        self.assertEqual(resolve_index_type("ivf_pq", 600), "ivf_flat")
+        self.assertEqual(resolve_index_type("ivf_pq", 30), "flat")
+        self.assertEqual(resolve_index_type("ivf_flat", 30), "flat")
+        self.assertEqual(resolve_index_type("hnsw", 5), "hnsw")
+        self.assertEqual(describe_index(build_faiss_index(self.embeds[:30], "ivf_pq")), "IndexFlatL2")
+        self.assertEqual(build_faiss_index(self.embeds[:700], "ivf_pq").pq.nbits, 4)
+        with self.assertRaises(ValueError):
+            resolve_index_type("lsh", 1000)
+
+
+class TestProductMicroBatching(ProductIngestTestCase):
+    def test_batcher_flushes_on_size_and_fans_out_errors(self):
+        """Test that max_batch closes a batch early and a failing batch fails every caller in it."""
+        calls = []
+
+        async def run_batch(items):
+            calls.append(items)
+            if "boom" in items:
+                raise RuntimeError("boom")
+            return [item.upper() for item in items], "extra"
+
+        async def scenario():
+            batcher = MicroBatcher(run_batch, window=10, max_batch=2)
+            results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"))
+            failed = await asyncio.gather(batcher.submit("c"), batcher.submit("boom"), return_exceptions=True)
+            return results, failed
+
+        results, failed = asyncio.run(scenario())
+        self.assertEqual([(result, extra) for result, extra, _ in results], [("A", "extra"), ("B", "extra")])
+        self.assertTrue(all(isinstance(error, RuntimeError) for error in failed))
+        self.assertEqual(calls, [["a", "b"], ["c", "boom"]])
+
+    def test_concurrent_requests_share_one_encode(self):
+        """Test that /products requests inside one window are encoded together and get their own results."""
+        p4.ingest_product_docs_from_csv()
+        queries = ["something for cold drinks", "a mug for hot coffee", "bottle to carry around"]
+        expected = [p4.search_products(query, 2) for query in queries]
+        p4.QUERY_CACHE.clear()
+        p4.EMBEDDING_MODEL.encode_calls = 0
+
+        params = {"k": 2, "min_price": None, "max_price": None, "in_stock": None, "tag": None}
+
+        async def burst():
+            return await asyncio.gather(*(p4.get_products(query=query, **params) for query in queries))
+
+        with patch.object(p4.PRODUCT_BATCHER, "window", 0.05):
+            responses = asyncio.run(burst())
+        self.assertEqual(p4.EMBEDDING_MODEL.encode_calls, 1)
+        for query, results, response in zip(queries, expected, responses):
+            body = json.loads(response.body)
+            self.assertEqual(body["query"], query)
+            self.assertEqual([item["id"] for item in body["results"]], [doc.id for doc in results])
+            self.assertIn("batch;dur=", response.headers["Server-Timing"])
+
+
+class TestProductInitialization(ProductIngestTestCase):
+    def setUp(self):
+        super().setUp()
+        p4._publish_product_state(None)
+
+    def test_concurrent_callers_share_one_load(self):
+        """Test that a burst of searches against an empty state triggers a single ingest."""
+        loads = []
+
+        def slow_loader():
+            loads.append(threading.get_ident())
+            time.sleep(0.2)
+            return FakeEncoder()
+
+        with patch.object(p4, "load_embedding_model", slow_loader):
+            threads = [threading.Thread(target=p4.search_products, args=("tumbler",)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertIsNotNone(p4.PRODUCT_STATE)
+        self.assertIs(p4.FAISS_INDEX, p4.PRODUCT_STATE.index)
+
+    def test_waiters_time_out_while_loading(self):
+        """Test that callers give up with ProductSearchNotReady instead of queueing forever."""
+        release = threading.Event()
+
+        def blocked_loader():
+            release.wait()
+            return FakeEncoder()
+
+        with patch.object(p4, "load_embedding_model", blocked_loader):
+            loader = threading.Thread(target=p4.ensure_product_state)
+            loader.start()
+            time.sleep(0.05)
+            with self.assertRaises(p4.ProductSearchNotReady):
+                p4.ensure_product_state(timeout=0.05)
+            release.set()
+            loader.join()
+
+        self.assertIsNotNone(p4.ensure_product_state(timeout=0.05))
+
+    def test_failed_load_answers_503_after_one_attempt(self):
+        """Test that a /products request after a failed ingest retries the load once and answers 503."""
+        loads = []
+
+        def failing_loader():
+            loads.append(1)
+            raise RuntimeError("model unavailable")
+
+        params = {"k": 2, "min_price": None, "max_price": None, "in_stock": None, "tag": None}
+        with patch.object(p4, "load_embedding_model", failing_loader):
+            with self.assertRaises(HTTPException) as raised:
+                asyncio.run(p4.get_products(query="tumbler", **params))
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertIn("Retry-After", raised.exception.headers)
+
+
+def get_outlets(query, **params):
+    """Call the /outlets handler directly with FastAPI's defaults for the parameters not given."""
+    defaults = {"open_now": False, "open_at": None, "limit": None, "cursor": None, "accept": None}
+    response = p4.get_outlets(query=query, **{**defaults, **params})
+    if isinstance(response, Response) and not isinstance(response, StreamingResponse):
+        return json.loads(response.body)
+    return response
+
+
+class OutletDatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        db_path = os.path.join(self.db_dir, "outlets.db")
+        patcher = patch.multiple(p4, DB_PATH=db_path, OUTLETS_DB=SQLiteReadPool(db_path))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.db_dir, ignore_errors=True)
+        p4.ingest_outlets_from_csv()
+
+
+class TestOutletConnectionPool(OutletDatabaseTestCase):
+    def test_thread_reuses_one_read_only_connection(self):
+        """Test that queries on a thread share a connection that refuses writes."""
+        conn = p4.OUTLETS_DB.connection()
+        self.assertTrue(p4.execute_sql("SELECT * FROM outlets"))
+        self.assertIs(p4.OUTLETS_DB.connection(), conn)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(p4.execute_sql("DELETE FROM outlets"), [])
+        self.assertTrue(p4.execute_sql("SELECT * FROM outlets"))
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(p4.OUTLETS_DB.connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+
+    def test_in_memory_copy_follows_reingest(self):
+        """Test that the backup-API serving copy matches the file and reloads after ingest."""
+        sql = p4.text2sql("outlets in Petaling Jaya")
+        expected = p4.execute_sql(sql)
+        with patch.object(p4, "OUTLETS_DB", SQLiteReadPool(p4.DB_PATH, in_memory=True)):
+            self.assertEqual(p4.execute_sql(sql), expected)
+            p4.ingest_outlets_from_csv(os.path.join(self.db_dir, "missing.csv"))
+            self.assertEqual(len(p4.execute_sql("SELECT * FROM outlets")), 5)
+
+
+class TestOutletDiffIngest(OutletDatabaseTestCase):
+    def test_unchanged_csv_does_not_write(self):
+        """Test that re-ingesting the same CSV reports no changes and commits nothing."""
+        reader = sqlite3.connect(p4.DB_PATH)
+        self.addCleanup(reader.close)
+        version = reader.execute("PRAGMA data_version").fetchone()[0]
+        counts = p4.ingest_outlets_from_csv()
+        self.assertEqual(counts["unchanged"], 255)
+        self.assertEqual((counts["inserted"], counts["updated"], counts["deleted"]), (0, 0, 0))
+        self.assertEqual(reader.execute("PRAGMA data_version").fetchone()[0], version)
+
+    def test_only_changed_rows_are_written(self):
+        """Test that an edit, a removal and an addition keep every other outlet's id and index entries."""
+        ids = {row["name"]: row["id"] for row in p4.execute_sql("SELECT id, name FROM outlets")}
+        with open("zus_outlets_kl_selangor.csv", encoding="utf-8") as src:
+            rows = list(csv.DictReader(src))
+        edited, removed = rows[0]["name"], rows[1]["name"]
+        rows[0]["hours"] = "Daily 8am-10pm"
+        del rows[1]
+        rows.append({**rows[-1], "name": "Xyzzyville Kiosk", "address": "1 Jalan Xyzzy, 47300 Petaling Jaya"})
+        csv_copy = os.path.join(self.db_dir, "outlets.csv")
+        with open(csv_copy, "w", encoding="utf-8", newline="") as dst:
+            writer = csv.DictWriter(dst, fieldnames=rows[0].keys())
+            writer.writeheader()
+            writer.writerows(rows)
+
+        counts = p4.ingest_outlets_from_csv(csv_copy)
+        self.assertEqual(counts, {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 253})
+        after = {row["name"]: row["id"] for row in p4.execute_sql("SELECT id, name FROM outlets")}
+        self.assertNotIn(removed, after)
+        self.assertEqual({name: after[name] for name in ids if name != removed}, {name: ids[name] for name in ids if name != removed})
+        self.assertEqual([row["name"] for row in p4.execute_sql(p4.outlet_fts_sql("xyzzyville"))], ["Xyzzyville Kiosk"])
+        stale = p4.execute_sql("SELECT rowid FROM outlets_fts WHERE outlets_fts MATCH ?", (p4.outlet_fts_query(removed),))
+        self.assertNotIn(ids[removed], [row["rowid"] for row in stale])
+        self.assertEqual(len(p4.execute_sql("SELECT * FROM outlet_hours WHERE outlet_id = ?", (ids[edited],))), 7)
+        self.assertEqual(len(p4.execute_sql("SELECT * FROM outlets_geo WHERE id = ?", (after["Xyzzyville Kiosk"],))), 1)
+
+
+class TestOutletMatcher(OutletDatabaseTestCase):
+    def test_automaton_reports_overlapping_keywords(self):
+        """Test that one pass finds every keyword, including ones nested in others."""
+        matcher = EntityMatcher([("k", "he", 1), ("k", "she", 2), ("k", "hers", 3), ("k", "his", 4)])
+        found = [(m.keyword, m.start) for m in matcher.find_all("UsHers")]
+        self.assertEqual(sorted(found), [("he", 2), ("hers", 2), ("she", 1)])
+
+    def test_matcher_is_rebuilt_on_ingest(self):
+        """Test that a freshly ingested outlet name is recognised by text2sql."""
+        self.assertNotIn("outlets.name LIKE", p4.text2sql("zyxel plaza kiosk"))
+        csv_copy = os.path.join(self.db_dir, "outlets.csv")
+        with open("zus_outlets_kl_selangor.csv", encoding="utf-8") as src, open(csv_copy, "w", encoding="utf-8") as dst:
+            dst.write(src.read() + 'Zyxel Kiosk,Selangor,"1 Jalan Zyxel, Selangor",Not specified,"Coffee, Delivery",\n')
+
+        p4.ingest_outlets_from_csv(csv_copy)
+        sql = p4.text2sql("coffee at zyxel kiosk with delivery")
+        self.assertIn("outlets.name LIKE '%zyxel kiosk%'", sql)
+        self.assertIn("outlets.services LIKE '%delivery%'", sql)
+        self.assertEqual(len(p4.execute_sql(sql)), 1)
+
+
+class TestOutletQueryPlan(OutletDatabaseTestCase):
+    def test_filter_groups_are_anded(self):
+        """Test that location and service narrow each other instead of forming a union."""
+        plan = p4.plan_outlet_query("delivery outlets in Cheras")
+        self.assertEqual([group.field for group in plan.filters], ["location", "service"])
+        sql, params = compile_plan(plan)
+        self.assertEqual(params, ("%cheras%", "%cheras%", "%delivery%"))
+        self.assertIn(") AND (", sql)
+        self.assertEqual(p4.execute_sql(sql, params), [])
+        self.assertTrue(p4.execute_sql(*compile_plan(p4.plan_outlet_query("outlets in Cheras"))))
+
+    def test_same_shape_reuses_compiled_sql(self):
+        """Test that plans differing only in values compile to one SQL text."""
+        first, first_params = compile_plan(p4.plan_outlet_query("outlets in Cheras"))
+        second, second_params = compile_plan(p4.plan_outlet_query("outlets in Kepong"))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first_params, second_params)
+        self.assertNotIn("kepong", second)
+
+    def test_quotes_are_bound_not_spliced(self):
+        """Test that a quote in a free-text query cannot change the SQL."""
+        sql, params = compile_plan(p4.plan_outlet_query("o'brien'; drop table outlets"))
+        self.assertNotIn("brien", sql)
+        self.assertEqual(p4.execute_sql(sql, params), [])
+        self.assertTrue(p4.execute_sql("SELECT * FROM outlets"))
+        self.assertEqual(render_sql("SELECT ?", ("it's",)), "SELECT 'it''s'")
+
+
+class TestOutletFullTextSearch(OutletDatabaseTestCase):
+    def test_free_text_is_ranked_and_highlighted(self):
+        """Test that free-text queries go through FTS5, best name match first, with a snippet."""
+        sql = p4.text2sql("sunwy metro sunway")
+        self.assertIn("outlets_fts MATCH", sql)
+        results = p4.execute_sql(sql)
+        self.assertTrue(results)
+        self.assertIn("Sunway", results[0]["name"])
+        self.assertIn("<mark>", results[0]["snippet"])
+
+    def test_index_follows_reingest(self):
+        """Test that the FTS index is rebuilt with the table."""
+        self.assertEqual(p4.execute_sql(p4.outlet_fts_sql("xyzzyville")), [])
+        csv_copy = os.path.join(self.db_dir, "outlets.csv")
+        with open(csv_copy, "w", encoding="utf-8") as dst:
+            dst.write('name,location,address,hours,services,direction_link\n'
+                      'Xyzzyville Kiosk,Selangor,"1 Jalan Xyzzy, Selangor",Not specified,"Coffee",\n')
+
+        p4.ingest_outlets_from_csv(csv_copy)
+        self.assertEqual([row["name"] for row in p4.execute_sql(p4.outlet_fts_sql("xyzzyville"))], ["Xyzzyville Kiosk"])
+
+    def test_non_ascii_names_are_searchable(self):
+        """Test that accented and CJK query terms reach FTS5 and match, with or without the accents."""
+        csv_copy = os.path.join(self.db_dir, "outlets.csv")
+        with open(csv_copy, "w", encoding="utf-8") as dst:
+            dst.write('name,location,address,hours,services,direction_link\n'
+                      'Café Lumière,Selangor,"1 Jalan Xyzzy, Selangor",Not specified,"Coffee",\n'
+                      'ZUS 咖啡 茨厂街,Kuala Lumpur,"2 Jalan Petaling, Kuala Lumpur",Not specified,"Coffee",\n')
+        p4.ingest_outlets_from_csv(csv_copy)
+
+        self.assertEqual(p4.outlet_fts_query("café_lumière"), '"café"* OR "lumière"*')
+        for query, name in (("lumière", "Café Lumière"), ("lumiere", "Café Lumière"), ("咖啡", "ZUS 咖啡 茨厂街")):
+            with self.subTest(query=query):
+                self.assertEqual([outlet["name"] for outlet in get_outlets(query)["results"]], [name])
+
+
+class TestOutletFragments(OutletDatabaseTestCase):
+    def sync(self, edit):
+        """Run sync_outlets over the current rows with edit applied to each, and commit"""
+        conn = sqlite3.connect(p4.DB_PATH)
+        self.addCleanup(conn.close)
+        rows = conn.execute("SELECT name, location, address, hours, services, direction_link FROM outlets").fetchall()
+        p4.sync_outlets(conn.cursor(), [edit(list(row)) for row in rows])
+        conn.commit()
+
+    def test_updated_outlets_are_never_served_from_stale_fragments(self):
+        """Test that /outlets returns edited and renamed outlets both before and after the readers are refreshed."""
+        p4.get_outlet_fragments()
+        sunway = get_outlets("sunway")["results"][0]
+
+        def edit(row):
+            if row[0] == sunway["name"]:
+                row[4] = "Dine-in, Refill Station"
+            if row[0] == "Suria KLCC":
+                row[0] = "Suria KLCC Park"
+            return row
+
+        self.sync(edit)
+        for refreshed in (False, True):
+            with self.subTest(refreshed=refreshed):
+                if refreshed:
+                    p4.refresh_outlet_readers()
+                p4.OUTLET_RESPONSE_CACHE.clear()
+                updated = next(outlet for outlet in get_outlets("sunway")["results"] if outlet["id"] == sunway["id"])
+                self.assertEqual(updated["services"], "Dine-in, Refill Station")
+                self.assertIn("Suria KLCC Park", [outlet["name"] for outlet in get_outlets("all outlets")["results"]])
+
+
+class TestOutletResponseCache(OutletDatabaseTestCase):
+    def test_repeat_query_skips_sql_and_keeps_its_own_echo(self):
+        """Test that a rephrased repeat is served from cached bytes with its own query field."""
+        first = get_outlets("outlets in Petaling Jaya")
+        with patch.object(p4, "iter_sql", side_effect=AssertionError("SQL executed on a cache hit")):
+            response = p4.get_outlets(query="  Outlets in  PETALING Jaya", open_now=False, open_at=None, limit=None, cursor=None, accept=None)
+        second = json.loads(response.body)
+        self.assertEqual(second["query"], "  Outlets in  PETALING Jaya")
+        self.assertEqual({**second, "query": first["query"]}, first)
+        self.assertGreater(p4.OUTLET_RESPONSE_CACHE.stats()["nbytes"], len(response.body) // 2)
+
+    def test_ingest_invalidates_cached_responses(self):
+        """Test that a re-ingest bumps the generation so cached responses are not served."""
+        self.assertTrue(get_outlets("outlets in Petaling Jaya")["results"])
+        generation = p4.OUTLETS_GENERATION
+        p4.ingest_outlets_from_csv(os.path.join(self.db_dir, "missing.csv"))
+        self.assertGreater(p4.OUTLETS_GENERATION, generation)
+        self.assertEqual([outlet["name"] for outlet in get_outlets("outlets in Petaling Jaya")["results"]], ["1 Utama", "SS 2", "Sunway Pyramid"])
+
+    def test_fragments_match_formatted_rows(self):
+        """Test that bodies joined from pre-serialized outlets equal the formatted rows, snippets included."""
+        for query in ("all outlets", "sunwy metro sunway"):
+            sql, params = compile_plan(p4.plan_outlet_query(query))
+            body = json.loads(p4.outlet_results_json(sql, params, None, False))
+            self.assertEqual(body["results"], [p4.format_outlet(row) for row in p4.execute_sql(sql, params)])
+        self.assertIn("<mark>", body["results"][0]["snippet"])
+
+    def test_encode_json_fallback_matches_orjson(self):
+        """Test that the json fallback writes the same bytes as orjson for response-shaped content."""
+        content = {"name": "ZUS Coffee – Café \"Bangsar\"", "price": 79.9, "tags": ["mug", "all day"], "stock": None, "open": True}
+        with patch("p4_json.orjson", None):
+            fallback = p4_json.encode_json(content)
+        self.assertEqual(json.loads(fallback), content)
+        if p4_json.orjson is not None:
+            self.assertEqual(p4_json.encode_json(content), fallback)
+
+
+class TestOutletPagination(OutletDatabaseTestCase):
+    def test_keyset_pages_cover_every_outlet_once(self):
+        """Test that following next_cursor walks the full name-ordered list without gaps or repeats."""
+        expected = [row["id"] for row in p4.execute_sql("SELECT id FROM outlets ORDER BY name, id")]
+        seen, cursor = [], None
+        while True:
+            page = get_outlets("all outlets", limit=40, cursor=cursor)
+            seen += [outlet["id"] for outlet in page["results"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+        self.assertEqual(page["total_found"], len(expected) % 40)
+
+    def test_ndjson_stream_matches_json_page(self):
+        """Test that the NDJSON mode streams the same page, ending with the next cursor."""
+        page = get_outlets("outlets in Petaling Jaya", limit=5)
+        response = get_outlets("outlets in Petaling Jaya", limit=5, accept="application/x-ndjson")
+        self.assertIsInstance(response, StreamingResponse)
+        self.assertEqual(response.media_type, "application/x-ndjson")
+
+        plan = p4.plan_outlet_query("outlets in Petaling Jaya")._replace(limit=6)
+        lines = [json.loads(line) for chunk in p4.stream_outlets_ndjson(*compile_plan(plan), 5) for line in chunk.splitlines()]
+        self.assertEqual(lines[:-1], page["results"])
+        self.assertEqual(lines[-1], {"next_cursor": page["next_cursor"]})
+
+    def test_pages_fetch_one_extra_row_even_without_limit(self):
+        """Test that a cursor without limit pages by OUTLET_PAGE_MAX and total_found counts the page."""
+        first = get_outlets("all outlets", limit=3)
+        self.assertTrue(first["sql_executed"].endswith("LIMIT 4"))
+        self.assertEqual(first["total_found"], 3)
+
+        fetched = []
+        iter_chunks = p4.iter_sql_chunks
+        with patch.object(p4, "OUTLET_PAGE_MAX", 10), \
+                patch.object(p4, "iter_sql_chunks", lambda *args: (fetched.extend(rows) or rows for rows in iter_chunks(*args))):
+            page = get_outlets("all outlets", cursor=first["next_cursor"])
+        self.assertEqual((len(page["results"]), page["total_found"], len(fetched)), (10, 10, 11))
+        self.assertIsNotNone(page["next_cursor"])
+
+    def test_invalid_cursor_is_rejected(self):
+        """Test that a malformed cursor is a 400, not an empty page."""
+        with self.assertRaises(HTTPException) as raised:
+            get_outlets("all outlets", limit=5, cursor="not-a-cursor")
+        self.assertEqual(raised.exception.status_code, 400)
+
+
+class TestOutletOpeningHours(OutletDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        csv_copy = os.path.join(self.db_dir, "outlets.csv")
+        with open(csv_copy, "w", encoding="utf-8") as dst:
+            dst.write('name,location,address,hours,services,direction_link\n'
+                      'Early Kiosk,Selangor,"1 Jalan Awal, Selangor",Mon-Fri 7am-3pm,"Coffee",\n'
+                      'Night Kiosk,Selangor,"2 Jalan Malam, Selangor",Daily 6pm-2am,"Coffee",\n'
+                      'Mall Kiosk,Selangor,"3 Jalan Mall, Selangor",10AM-10PM,"Coffee",\n'
+                      'Mystery Kiosk,Selangor,"4 Jalan Rahsia, Selangor",Not specified,"Coffee",\n')
+        p4.ingest_outlets_from_csv(csv_copy)
+
+    def open_names(self, moment):
+        response = get_outlets("all outlets", open_at=moment)
+        return sorted(outlet["name"] for outlet in response["results"])
+
+    def test_parse_hours_normalizes_ranges(self):
+        """Test day ranges, am/pm inference and overnight splitting."""
+        self.assertEqual(parse_hours("Not specified"), [])
+        self.assertEqual(parse_hours("Sat-Sun 9-5pm"), [(5, 540, 1020), (6, 540, 1020)])
+        self.assertEqual(parse_hours("Sun 6pm-2am"), [(0, 0, 120), (6, 1080, 1440)])
+        self.assertEqual(len(parse_hours("Open 24 hours")), 7)
+
+    def test_open_at_filters_by_local_time(self):
+        """Test that only outlets open at the requested moment are returned."""
+        self.assertEqual(self.open_names(datetime(2024, 1, 1, 8, 0)), ["Early Kiosk"])
+        self.assertEqual(self.open_names(datetime(2024, 1, 6, 8, 0)), [])
+        self.assertEqual(self.open_names(datetime(2024, 1, 6, 1, 30)), ["Night Kiosk"])
+        self.assertEqual(self.open_names(datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)), ["Mall Kiosk", "Night Kiosk"])
+
+    def test_bitmap_matches_interval_index(self):
+        """Test that the in-memory schedule and the outlet_hours SQL agree at every boundary."""
+        schedule = p4.OUTLET_SCHEDULE
+        plan = p4.plan_outlet_query("all outlets")
+        for boundary in schedule.boundaries[:-1]:
+            moment = (int(boundary) // (24 * 60), int(boundary) % (24 * 60))
+            rows = p4.execute_sql(*compile_plan(plan._replace(open_at=moment)))
+            self.assertEqual(sorted(row["id"] for row in rows), sorted(schedule.open_ids(*moment)))
+
+    def test_open_filter_responses_are_cached_per_schedule_segment(self):
+        """Test that open-at queries inside one schedule segment share a cached response keyed without the id list."""
+        early, later = datetime(2024, 1, 1, 8, 0), datetime(2024, 1, 1, 9, 30)
+        key = p4.open_filter_key(p4.OUTLET_SCHEDULE, early)
+        self.assertEqual(key, p4.open_filter_key(p4.OUTLET_SCHEDULE, later))
+        self.assertEqual(key, ("segment", key[1]))
+
+        self.assertEqual(self.open_names(early), ["Early Kiosk"])
+        with patch.object(p4, "iter_sql_chunks", side_effect=AssertionError("SQL executed on a cache hit")):
+            self.assertEqual(self.open_names(later), ["Early Kiosk"])
+        self.assertEqual(self.open_names(datetime(2024, 1, 1, 10, 30)), ["Early Kiosk", "Mall Kiosk"])
+
+    def test_hours_intent_uses_parsed_hours(self):
+        """Test that 'open late' finds outlets from their parsed hours, not the raw text."""
+        results = p4.execute_sql(p4.text2sql("outlets open late"))
+        self.assertEqual([row["name"] for row in results], ["Night Kiosk"])
+
+
+class TestNearbyOutlets(OutletDatabaseTestCase):
+    def test_postcode_is_taken_from_the_end_of_the_address(self):
+        """Test that unit and street numbers are not mistaken for the postcode."""
+        self.assertEqual(extract_postcode("Lot 12345, Jalan SS 2/24, 47300 Petaling Jaya"), "47300")
+        self.assertIsNone(extract_postcode("Suria KLCC, Kuala Lumpur"))
+        self.assertAlmostEqual(haversine_km(3.1390, 101.6869, 3.0738, 101.5183), 20.1, delta=0.1)
+
+    def test_nearest_outlets_match_a_full_scan(self):
+        """Test that the growing R*Tree search returns the same outlets as sorting every distance."""
+        rows = p4.execute_sql("SELECT id, lat, lon FROM outlets_geo")
+        self.assertGreater(len(rows), 200)
+        # A small candidate limit sends dense and far-away points down the shrink and scan paths
+        for limit in (p4.NEARBY_CANDIDATE_LIMIT, 8):
+            for lat, lon, k in [(3.1390, 101.6869, 5), (3.0738, 101.5183, 12), (1.3521, 103.8198, 3), (3.8077, 103.3260, 1)]:
+                expected = sorted(haversine_km(lat, lon, row["lat"], row["lon"]) for row in rows)[:k]
+                with patch.object(p4, "NEARBY_CANDIDATE_LIMIT", limit):
+                    results = p4.nearby_outlets(lat, lon, k)
+                self.assertEqual(len(results), k)
+                self.assertEqual([round(d, 3) for d in expected], [outlet["distance_km"] for outlet in results])
+
+    def test_endpoint_reports_distances(self):
+        """Test that /outlets/nearby returns k outlets ordered by distance."""
+        response = p4.get_nearby_outlets(lat=3.1577, lon=101.7119, k=3)
+        distances = [outlet["distance_km"] for outlet in response["results"]]
+        self.assertEqual(response["total_found"], 3)
+        self.assertEqual(distances, sorted(distances))
+
+
+def route_endpoint(path):
+    return next(route.endpoint for route in p4.app.routes if getattr(route, "path", None) == path)
+
+
+class TestAdmissionControl(OutletDatabaseTestCase):
+    def test_executor_rejects_past_its_queue_depth(self):
+        """Test that a full BoundedExecutor rejects at once and splits queue wait from service time."""
+        executor = BoundedExecutor("test", max_workers=1, max_queue=1)
+        self.addCleanup(executor.shutdown)
+        release = threading.Event()
+
+        async def burst():
+            running = asyncio.ensure_future(executor.run(release.wait))
+            queued = asyncio.ensure_future(executor.run(time.sleep, 0.01))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(ExecutorSaturated) as raised:
+                await executor.run(time.sleep, 0)
+            self.assertGreaterEqual(raised.exception.retry_after, 1)
+            release.set()
+            return await running, await queued
+
+        (_, running_timing), (_, queued_timing) = asyncio.run(burst())
+        self.assertGreaterEqual(running_timing.service, 0.04)
+        self.assertGreaterEqual(queued_timing.queue_wait, 0.04)
+        stats = executor.stats()
+        self.assertEqual((stats["completed"], stats["rejected"], stats["in_flight"]), (2, 1, 0))
+
+    def test_saturated_route_sheds_load_with_retry_after(self):
+        """Test that /outlets answers 503 with Retry-After when its executor is full, and Server-Timing otherwise."""
+        endpoint = route_endpoint("/outlets")
+        params = {"query": "outlets in KL", "open_now": False, "open_at": None, "limit": None, "cursor": None, "accept": None}
+        response = asyncio.run(endpoint(**params))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response.headers["Server-Timing"], r"queue;dur=[\d.]+, service;dur=[\d.]+")
+
+        capacity = p4.OUTLET_EXECUTOR.max_workers + p4.OUTLET_EXECUTOR.max_queue
+        with patch.object(p4.OUTLET_EXECUTOR, "in_flight", capacity):
+            with self.assertRaises(HTTPException) as raised:
+                asyncio.run(endpoint(**params))
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertIn("Retry-After", raised.exception.headers)
+        self.assertGreaterEqual(p4.get_executor_stats()["outlets"]["rejected"], 1)
+
+
+class TestMetrics(OutletDatabaseTestCase):
+    def test_histogram_merges_thread_shards(self):
+        """Test that observations from several threads add up into cumulative buckets."""
+        registry = MetricsRegistry()
+        histogram = registry.histogram("test_seconds", "Test latency", ("stage",), buckets=(0.01, 0.1))
+        threads = [threading.Thread(target=lambda: [histogram.observe(v, "a") for v in (0.005, 0.01, 0.5)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        lines = registry.render().splitlines()
+        self.assertIn('test_seconds_bucket{stage="a",le="0.01"} 8', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="0.1"} 8', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="+Inf"} 12', lines)
+        self.assertIn('test_seconds_count{stage="a"} 12', lines)
+
+    def test_middleware_labels_by_route_template(self):
+        """Test that requests are counted per matched route, and unknown paths share one label."""
+        registry = MetricsRegistry()
+        requests = registry.counter("test_requests_total", "Requests", ("method", "route", "status"))
+        latency = registry.histogram("test_request_seconds", "Latency", ("route",))
+
+        async def inner(scope, receive, send):
+            if scope["path"] == "/outlets":
+                scope["route"] = SimpleNamespace(path="/outlets")
+            await send({"type": "http.response.start", "status": 200 if "route" in scope else 404})
+
+        async def send(message):
+            pass
+
+        middleware = MetricsMiddleware(inner, requests, latency)
+        for path in ("/outlets", "/wp-login.php", "/.env"):
+            asyncio.run(middleware({"type": "http", "method": "GET", "path": path}, None, send))
+        lines = registry.render().splitlines()
+        self.assertIn('test_requests_total{method="GET",route="/outlets",status="200"} 1', lines)
+        self.assertIn('test_requests_total{method="GET",route="unmatched",status="404"} 2', lines)
+
+    def test_metrics_endpoint_reports_stages_and_gauges(self):
+        """Test that an outlet query records text2sql, sqlite and serialize stages next to the gauges."""
+        get_outlets("outlets in petaling jaya with delivery for metrics")
+        body = p4.get_metrics().body.decode("utf-8")
+        for stage in ("text2sql", "sqlite", "serialize"):
+            self.assertRegex(body, rf'p4_stage_seconds_count{{stage="{stage}"}} [1-9]')
+        self.assertRegex(body, r"p4_outlets [1-9]\d*")
+        self.assertIn('p4_cache_hit_ratio{cache="outlet_plans"}', body)
+
+
+class TestLogging(ProductIngestTestCase):
+    def test_per_request_debug_lines_are_sampled(self):
+        """Test that search only writes its per-hit DEBUG lines for sampled requests."""
+        p4.ingest_product_docs_from_csv()
+        level = p4.logger.level
+        self.addCleanup(p4.logger.setLevel, level)
+        p4.logger.setLevel(logging.DEBUG)
+
+        with patch("p4_logging.LOG_SAMPLE_RATE", 1.0), self.assertLogs(p4.logger, logging.DEBUG) as logs:
+            p4.QUERY_CACHE.clear()
+            p4.search_products("something for cold drinks", 2)
+        self.assertTrue(any("Found match" in line for line in logs.output))
+
+        with patch("p4_logging.LOG_SAMPLE_RATE", 0.0), self.assertNoLogs(p4.logger, logging.DEBUG):
+            p4.QUERY_CACHE.clear()
+            p4.search_products("something for cold drinks", 2)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        """Test that a full log queue drops records, and the JSON format keeps extra fields."""
+        handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+        for i in range(3):
+            handler.handle(logging.LogRecord("p4", logging.INFO, __file__, 0, "record %d", (i,), None))
+        self.assertEqual((handler.queue.qsize(), handler.dropped), (1, 2))
+
+        record = logging.LogRecord("p4", logging.INFO, __file__, 0, "Search took %d ms", (12,), None)
+        record.query = "tumbler"
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual((entry["message"], entry["query"], entry["level"]), ("Search took 12 ms", "tumbler", "INFO"))
+
+
+class TestRailwayOutletStore(unittest.TestCase):
+    def setUp(self):
+        with open("zus_outlets_kl_selangor.csv", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        services = ["dine-in,takeaway", "dine-in,Delivery", "Coffee, Food, Beverages"]
+        self.outlets = app_railway.load_sample_outlets() + [
+            {"id": i + 6, "name": row["name"], "location": row["location"], "address": row["address"],
+             "hours": row["hours"], "services": services[i % len(services)]}
+            for i, row in enumerate(rows)
+        ]
+        self.store = app_railway.OutletStore(self.outlets)
+
+    def test_masks_match_sqlite_on_generated_sql(self):
+        """Test that the columnar store returns exactly what SQLite returns for text2sql's SQL."""
+        conn = sqlite3.connect(":memory:")
+        self.addCleanup(conn.close)
+        conn.execute("CREATE TABLE outlets (id INTEGER PRIMARY KEY, name TEXT, location TEXT, address TEXT, hours TEXT, services TEXT)")
+        conn.executemany("INSERT INTO outlets VALUES (:id, :name, :location, :address, :hours, :services)", self.outlets)
+        for query in ["outlets in KL", "delivery in selangor", "mall outlets", "zus coffee", "all outlets", "outlets in penang"]:
+            conditions = app_railway.parse_conditions(query)
+            sql = app_railway.conditions_to_sql(conditions)
+            expected = [row[0] for row in conn.execute(sql.replace("SELECT *", "SELECT id"))]
+            self.assertEqual([outlet["id"] for outlet in self.store.select(conditions)], expected, query)
+
+    def test_results_are_not_truncated(self):
+        """Test that every matching outlet is returned, not the first 10."""
+        conditions = app_railway.parse_conditions("outlets in selangor")
+        self.assertGreater(len(self.store.select(conditions)), 10)
+        self.assertEqual(app_railway.OutletStore([]).select(conditions), [])
+
+
+class TestOnnxEmbedder(unittest.TestCase):
+    vocab = {"[PAD]": 0, "[UNK]": 1, "cold": 2, "brew": 3, "tumbler": 4, "mug": 5}
+
+    def setUp(self):
+        import onnx
+        from onnx import TensorProto, helper
+        from tokenizers import Tokenizer
+        from tokenizers.models import WordLevel
+        from tokenizers.pre_tokenizers import Whitespace
+
+        self.model_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.model_dir, ignore_errors=True)
+        self.table = np.random.default_rng(0).standard_normal((len(self.vocab), 8)).astype("float32")
+
+        # A lookup-table "encoder", last_hidden_state = table[input_ids]; attention_mask is accepted but unused, like a real encoder's padding
+        graph = helper.make_graph(
+            [helper.make_node("Gather", ["table", "input_ids"], ["last_hidden_state"])],
+            "lookup",
+            [helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["batch", "sequence"]),
+             helper.make_tensor_value_info("attention_mask", TensorProto.INT64, ["batch", "sequence"])],
+            [helper.make_tensor_value_info("last_hidden_state", TensorProto.FLOAT, ["batch", "sequence", 8])],
+            [helper.make_tensor("table", TensorProto.FLOAT, self.table.shape, self.table.flatten())]
+        )
+        model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)])
+        model.ir_version = 8
+        onnx.save(model, os.path.join(self.model_dir, "model.onnx"))
+
+        tokenizer = Tokenizer(WordLevel(self.vocab, unk_token="[UNK]"))
+        tokenizer.pre_tokenizer = Whitespace()
+        tokenizer.save(os.path.join(self.model_dir, "tokenizer.json"))
+
+    def embedder(self, **config):
+        from p4_onnx import OnnxEmbedder
+
+        config = {"max_seq_length": 4, "dimension": 8, "pooling": "mean", "normalize": True, **config}
+        with open(os.path.join(self.model_dir, "embedder_config.json"), "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        return OnnxEmbedder(self.model_dir)
+
+    def test_mean_pooling_skips_padding_and_normalizes(self):
+        """Test that encode averages only real tokens across padded batches, truncates, and returns unit vectors."""
+        vecs = self.embedder().encode(["cold brew tumbler", "mug", "cold brew cold brew mug"], batch_size=2)
+
+        expected = np.stack([
+            self.table[[2, 3, 4]].mean(axis=0),
+            self.table[5],
+            self.table[[2, 3, 2, 3]].mean(axis=0)
+        ])
+        expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+        self.assertEqual(vecs.dtype, np.float32)
+        np.testing.assert_allclose(vecs, expected, rtol=1e-5, atol=1e-6)
+
+    def test_cls_pooling_single_sentence_and_empty_input(self):
+        """Test cls pooling without normalization, a bare string input, and an empty batch."""
+        embedder = self.embedder(pooling="cls", normalize=False)
+        np.testing.assert_allclose(embedder.encode("tumbler mug"), self.table[4], rtol=1e-6)
+        self.assertEqual(embedder.encode([]).shape, (0, 8))
+        self.assertTrue(embedder.model_version.startswith("onnx-int8-"))
+
+
+@unittest.skipUnless(
+    os.path.exists(os.path.join(p4.ONNX_MODEL_DIR, "model.onnx")),
+    "int8 ONNX model not exported (run: python p4_onnx.py)"
+)
+class TestOnnxEmbeddingParity(unittest.TestCase):
+    def test_onnx_embeddings_match_torch(self):
+        """Test that the int8 ONNX backend stays within cosine 0.99 of the torch embeddings."""
+        from sentence_transformers import SentenceTransformer
+        from p4_onnx import OnnxEmbedder
+
+        texts = ["tumbler", "cold drink container", "OG CUP 2.0 500ml", "something to keep my coffee hot on the go"]
+        with open("zus_drinkware_products.csv", encoding="utf-8") as f:
+            texts += [f"{row['title']}. {' '.join(row['description'].split())}" for row in csv.DictReader(f)]
+
+        torch_vecs = SentenceTransformer(p4.EMBEDDING_MODEL_NAME).encode(texts, convert_to_numpy=True)
+        onnx_vecs = OnnxEmbedder(p4.ONNX_MODEL_DIR).encode(texts)
+        cosine = (torch_vecs * onnx_vecs).sum(axis=1) / (
+            np.linalg.norm(torch_vecs, axis=1) * np.linalg.norm(onnx_vecs, axis=1)
+        )
+        self.assertGreaterEqual(float(cosine.min()), 0.99)
+
+
+if __name__ == "__main__":
+    unittest.main()